@@ -0,0 +1,203 @@
+"""
+Détection d'anomalies en flux, par appareil
+
+Chaque échantillon met à jour en O(1) des statistiques incrémentales de son
+appareil, sans jamais relire l'historique :
+- moyenne mobile exponentielle (EWMA) de chaque métrique ;
+- variance de Welford (moyenne et somme des carrés des écarts) ;
+- vitesse de variation depuis la dernière mesure de la métrique ;
+- pente de décharge de la batterie (régression exponentiellement pondérée).
+
+Anomalies détectées à l'arrivée de chaque échantillon :
+- out_of_band   : valeur hors des bornes BANDS
+- jump          : saut brusque (écart à l'EWMA > JUMP_SIGMAS écarts-types),
+                  avec sa vitesse de variation en détail. La vitesse seule ne
+                  lève pas d'alerte : le bruit d'un échantillonnage rapide
+                  dépasse vite tout seuil fixe par seconde
+- stuck         : même valeur répétée STUCK_SAMPLES fois de suite
+- battery_low   : batterie sous BATTERY_LOW
+- battery_drain : décharge plus rapide que BATTERY_DRAIN_MAX %/h
+
+Les champs recopiés du dernier état connu (clé "held" des deltas complétés,
+cf. deadband.py) ne sont pas des mesures : ils sont ignorés, sans quoi une
+valeur tenue sous sa bande morte passerait pour un capteur bloqué. La
+vitesse de variation est calculée depuis l'horodatage de la dernière mesure
+de la métrique, pas du dernier échantillon de l'appareil.
+
+Une alerte d'un même type n'est pas répétée pour un appareil avant
+ALERT_COOLDOWN secondes.
+"""
+
+import math
+import threading
+
+METRICS = ("temperature", "humidity")
+EWMA_ALPHA = 0.1
+# Bornes acceptables (en dehors : alerte out_of_band)
+BANDS = {
+    "temperature": (0.0, 40.0),
+    "humidity": (20.0, 90.0),
+}
+JUMP_SIGMAS = 6.0
+MIN_SAMPLES = 10          # échantillons avant d'évaluer les écarts statistiques
+STUCK_SAMPLES = 20
+BATTERY_LOW = 20
+BATTERY_DRAIN_MAX = 10.0  # %/h
+# Poids d'un échantillon dans la régression batterie (~1/α échantillons pris en compte) :
+# la batterie est entière et bruitée, la pente n'est fiable que sur une longue fenêtre
+BATTERY_ALPHA = 0.002
+BATTERY_WARMUP = int(1 / BATTERY_ALPHA)
+ALERT_COOLDOWN = 60.0     # secondes
+
+SEVERITY = {
+    "out_of_band": "critical",
+    "jump": "warning",
+    "stuck": "warning",
+    "battery_low": "critical",
+    "battery_drain": "warning",
+}
+
+
+class MetricStats:
+    """Statistiques incrémentales d'une métrique"""
+
+    __slots__ = ("ewma", "n", "mean", "m2", "last", "last_timestamp", "repeats")
+
+    def __init__(self):
+        self.ewma = None
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.last = None
+        self.last_timestamp = None  # horodatage de la dernière mesure
+        self.repeats = 0
+
+    def std(self):
+        return math.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else 0.0
+
+    def rate(self, value, timestamp):
+        """Variation par seconde depuis la dernière mesure (None si inconnue)"""
+        if self.last_timestamp is None or timestamp <= self.last_timestamp:
+            return None
+        return (value - self.last) / (timestamp - self.last_timestamp)
+
+    def update(self, value, timestamp):
+        # Welford
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (value - self.mean)
+        # EWMA
+        self.ewma = value if self.ewma is None else self.ewma + EWMA_ALPHA * (value - self.ewma)
+        self.repeats = self.repeats + 1 if value == self.last else 0
+        self.last = value
+        self.last_timestamp = timestamp
+
+
+class DeviceStats:
+    """État constant en mémoire d'un appareil"""
+
+    __slots__ = ("metrics", "bt_mean_t", "bt_mean_b", "bt_cov",
+                 "bt_var", "bt_n", "last_alert")
+
+    def __init__(self):
+        self.metrics = {m: MetricStats() for m in METRICS}
+        # Régression batterie = f(temps), pondérée exponentiellement
+        self.bt_mean_t = self.bt_mean_b = self.bt_cov = self.bt_var = 0.0
+        self.bt_n = 0
+        self.last_alert = {}  # type d'alerte -> timestamp de la dernière
+
+    def battery_slope(self):
+        """Pente de la batterie en %/h (None tant qu'elle n'est pas estimable)"""
+        if self.bt_n < BATTERY_WARMUP or self.bt_var <= 0:
+            return None
+        return self.bt_cov / self.bt_var * 3600
+
+    def update_battery(self, timestamp, battery):
+        if self.bt_n == 0:
+            self.bt_mean_t, self.bt_mean_b = timestamp, battery
+        else:
+            dt = timestamp - self.bt_mean_t
+            db = battery - self.bt_mean_b
+            self.bt_mean_t += BATTERY_ALPHA * dt
+            self.bt_mean_b += BATTERY_ALPHA * db
+            self.bt_cov = (1 - BATTERY_ALPHA) * (self.bt_cov + BATTERY_ALPHA * dt * db)
+            self.bt_var = (1 - BATTERY_ALPHA) * (self.bt_var + BATTERY_ALPHA * dt * dt)
+        self.bt_n += 1
+
+
+class AnomalyDetector:
+    """Étape d'analyse en flux : un échantillon entre, zéro ou plusieurs alertes sortent"""
+
+    def __init__(self, on_alert=None):
+        self.on_alert = on_alert
+        self.devices = {}
+        self.alerts = 0
+        # Un appareil n'est traité que par un worker, mais les workers du pipeline
+        # partagent le dictionnaire des appareils et le compteur d'alertes
+        self.lock = threading.Lock()
+
+    def __call__(self, record):
+        """Sink du pipeline d'ingestion"""
+        for alert in self.process(record):
+            if self.on_alert is not None:
+                self.on_alert(alert)
+
+    def process(self, record):
+        """Met à jour l'état de l'appareil ; retourne la liste des alertes levées"""
+        device_id = record["device_id"]
+        timestamp = record["timestamp"]
+        found = []
+        held = record.get("held", ())
+        with self.lock:
+            stats = self.devices.get(device_id)
+            if stats is None:
+                stats = self.devices[device_id] = DeviceStats()
+
+            for m in METRICS:
+                value = record.get(m)
+                if value is None or m in held:
+                    continue
+                s = stats.metrics[m]
+                low, high = BANDS[m]
+                if not low <= value <= high:
+                    found.append(("out_of_band", m, value, f"hors de [{low}, {high}]"))
+                if s.n >= MIN_SAMPLES:
+                    sigma = s.std()
+                    deviation = abs(value - s.ewma)
+                    if sigma > 0 and deviation > JUMP_SIGMAS * sigma:
+                        detail = f"écart {deviation:.2f} à l'EWMA ({deviation / sigma:.1f} σ)"
+                        rate = s.rate(value, timestamp)
+                        if rate is not None:
+                            detail += f", variation {rate:+.2f}/s"
+                        found.append(("jump", m, value, detail))
+                s.update(value, timestamp)
+                if s.repeats + 1 == STUCK_SAMPLES:
+                    found.append(("stuck", m, value, f"{STUCK_SAMPLES} valeurs identiques"))
+
+            battery = record.get("battery")
+            if battery is not None and "battery" not in held:
+                stats.update_battery(timestamp, battery)
+                if battery < BATTERY_LOW:
+                    found.append(("battery_low", "battery", battery, f"sous {BATTERY_LOW}%"))
+                slope = stats.battery_slope()
+                if slope is not None and slope < -BATTERY_DRAIN_MAX:
+                    found.append(("battery_drain", "battery", battery, f"{slope:.1f} %/h"))
+
+            alerts = []
+            for kind, metric, value, detail in found:
+                last = stats.last_alert.get(kind)
+                if last is not None and timestamp - last < ALERT_COOLDOWN:
+                    continue
+                stats.last_alert[kind] = timestamp
+                alerts.append({
+                    "device_id": device_id,
+                    "type": kind,
+                    "severity": SEVERITY[kind],
+                    "metric": metric,
+                    "value": value,
+                    "detail": detail,
+                    "timestamp": timestamp,
+                })
+            self.alerts += len(alerts)
+        return alerts
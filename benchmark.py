@@ -0,0 +1,322 @@
+"""
+Benchmark bout-en-bout capteur → broker → abonné (hors ligne)
+
+Pilote VirtualSensor.publish_telemetry à un débit et une taille de payload
+configurables contre le bus en mémoire de transport.py (sans réseau ni
+TLS), et mesure pour chaque composant consommateur :
+- le débit (messages/s)
+- la latence bout-en-bout p50/p95/p99 (publication → traitement/affichage)
+- le temps CPU de chaque composant et le RSS du processus
+
+Chaque scénario tourne dans un processus séparé pour que le RSS mesuré
+soit propre au composant. Les résultats sont écrits en JSON pour comparer
+les exécutions entre elles (détection de régressions).
+
+Exemples:
+    python benchmark.py --rates 100 1000 0 --sizes 0 512 --duration 5
+    python benchmark.py --compare bench_results/avant.json bench_results/apres.json
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import threading
+import subprocess
+import contextlib
+import multiprocessing
+from datetime import datetime
+
+import metrics
+import telemetry_codec
+from transport import MemoryBus
+
+RESULTS_DIR = "bench_results"
+COMPONENTS = ("subscriber", "dashboard")
+# Métriques où une hausse est une régression (les autres : une baisse)
+LOWER_IS_BETTER = ("latency_p50_ms", "latency_p95_ms", "latency_p99_ms",
+                   "cpu_s_per_1k_msgs", "rss_peak_mb")
+
+
+# ==== SCÉNARIOS ====
+def percentile(sorted_values, q):
+    """Percentile (méthode du rang le plus proche) d'une liste triée"""
+    if not sorted_values:
+        return None
+    k = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def rss_mb():
+    """RSS courant du processus (Mo ; None si indisponible)"""
+    rss = metrics.rss_bytes()
+    return None if rss is None else rss / 1e6
+
+
+def rss_peak_mb():
+    """RSS maximal du processus (Mo ; None si indisponible, ex. Windows)"""
+    peak = metrics.peak_rss_bytes()
+    return None if peak is None else peak / 1e6
+
+
+def drive_sensor(sensor, rate, duration, payload_size, stats):
+    """Appelle publish_telemetry au débit demandé (0 = le plus vite possible)"""
+    generate = sensor.generate_telemetry
+    padding = "x" * payload_size
+
+    def padded_telemetry():
+        telemetry = generate()
+        if payload_size:
+            telemetry["padding"] = padding
+        return telemetry
+
+    sensor.generate_telemetry = padded_telemetry
+    start_cpu = time.thread_time()
+    start = time.perf_counter()
+    period = 1.0 / rate if rate else 0.0
+    next_deadline = start
+    while time.perf_counter() - start < duration:
+        sensor.publish_telemetry()
+        stats["sent"] += 1
+        if period:
+            next_deadline += period
+            delay = next_deadline - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+    stats["publish_elapsed_s"] = time.perf_counter() - start
+    stats["sensor_cpu_s"] = time.thread_time() - start_cpu
+
+
+def run_scenario(component, rate, duration, payload_size, refresh, payload_format="json",
+                 batch_size=1):
+    """Exécute un scénario et retourne son dictionnaire de résultats"""
+    from virtual_sensor import VirtualSensor
+    import mqtt_subscriber
+    import dashboard_ingest
+
+    rss_start = rss_mb()
+    broker = MemoryBus()
+    latencies = []
+    stats = {"sent": 0}
+    consumer_cpu = 0.0
+
+    sensor = VirtualSensor(payload_format=payload_format, batch_size=batch_size)
+    sensor.client = broker.client("virtual_sensor_001")
+    sensor.is_connected = True
+
+    if component == "subscriber":
+        subscriber = mqtt_subscriber.IoTSubscriber(quiet=True)
+        # Dernier sink du pipeline : latence génération → fin du traitement,
+        # même définition que pour le dashboard
+        subscriber.pipeline.sinks.append(
+            lambda record: latencies.append(time.time() - record["timestamp"])
+        )
+        client = broker.client("iot_cloud_simulator")
+        client.on_connect = subscriber.on_connect
+        client.on_message = subscriber.on_message
+        subscriber.client = client
+    else:
+        service = dashboard_ingest.IngestService(client=broker.client("streamlit_dashboard"))
+        client = service.client
+
+    # Les prints font partie du coût réel mesuré, mais pas de l'affichage
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        if component == "subscriber":
+            subscriber.pipeline.start()
+            client.connect()
+            client.loop_start()
+        else:
+            service.start()
+        while not client.subscriptions:
+            time.sleep(0.01)
+
+        if component == "dashboard":
+            stop = threading.Event()
+
+            def consumer():
+                # Équivalent d'une session Streamlit qui lit depuis son curseur ;
+                # latence = génération de l'échantillon → lecture par la session
+                nonlocal consumer_cpu
+                start_cpu = time.thread_time()
+                cursor = 0
+                while not stop.is_set() or service.history.total > cursor:
+                    rows, cursor = service.read_since(cursor)
+                    latencies.extend((time.time() - rows["timestamp"]).tolist())
+                    stop.wait(refresh)
+                consumer_cpu = time.thread_time() - start_cpu
+
+            consumer_thread = threading.Thread(target=consumer, daemon=True)
+            consumer_thread.start()
+
+        run_start = time.perf_counter()
+        drive_sensor(sensor, rate, duration, payload_size, stats)
+        sensor.flush()
+
+        # Laisser le consommateur rattraper son retard (au plus 10 s)
+        deadline = time.perf_counter() + 10
+        while len(latencies) < stats["sent"] and time.perf_counter() < deadline:
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - run_start
+
+        if component == "dashboard":
+            stop.set()
+            consumer_thread.join()
+        client.loop_stop()
+        if component == "subscriber":
+            subscriber.pipeline.stop()
+            consumer_cpu = subscriber.pipeline.cpu_time
+
+    received = len(latencies)
+    latencies.sort()
+    cpu_s = client.cpu_time + consumer_cpu
+    return {
+        "component": component,
+        "payload_format": payload_format,
+        "batch_size": batch_size,
+        "rate_target": rate,
+        "payload_padding": payload_size,
+        "duration_s": duration,
+        "sent": stats["sent"],
+        "received": received,
+        "lost": stats["sent"] - received,
+        "throughput_msgs_s": received / elapsed if elapsed else 0.0,
+        "publish_rate_msgs_s": stats["sent"] / stats["publish_elapsed_s"],
+        "latency_p50_ms": _ms(percentile(latencies, 50)),
+        "latency_p95_ms": _ms(percentile(latencies, 95)),
+        "latency_p99_ms": _ms(percentile(latencies, 99)),
+        "latency_max_ms": _ms(latencies[-1] if latencies else None),
+        "sensor_cpu_s": stats["sensor_cpu_s"],
+        "component_cpu_s": cpu_s,
+        "cpu_s_per_1k_msgs": 1000 * cpu_s / received if received else None,
+        "rss_start_mb": rss_start,
+        "rss_peak_mb": rss_peak_mb(),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else seconds * 1000
+
+
+def _scenario_worker(args, results):
+    results.put(run_scenario(*args))
+
+
+def run_isolated(component, rate, duration, payload_size, refresh, payload_format, batch_size):
+    """Lance un scénario dans un processus neuf (RSS propre au composant)"""
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    process = ctx.Process(
+        target=_scenario_worker,
+        args=((component, rate, duration, payload_size, refresh, payload_format, batch_size),
+              results)
+    )
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+# ==== RAPPORTS ====
+def environment_info():
+    """Métadonnées permettant de comparer deux exécutions"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        commit = None
+    return {
+        "date": datetime.now().isoformat(),
+        "git_commit": commit,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def scenario_key(result):
+    return (result["component"], result.get("payload_format", "json"),
+            result.get("batch_size", 1), result["rate_target"], result["payload_padding"])
+
+
+def compare_reports(baseline_path, candidate_path, tolerance):
+    """Compare deux rapports et liste les régressions au-delà de la tolérance"""
+    with open(baseline_path) as f:
+        baseline = {scenario_key(r): r for r in json.load(f)["results"]}
+    with open(candidate_path) as f:
+        candidate = json.load(f)["results"]
+
+    regressions = 0
+    for result in candidate:
+        base = baseline.get(scenario_key(result))
+        if base is None:
+            continue
+        for metric in ("throughput_msgs_s",) + LOWER_IS_BETTER:
+            old, new = base.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = change > tolerance if metric in LOWER_IS_BETTER else change < -tolerance
+            flag = "❌" if worse else "  "
+            regressions += worse
+            print(f"{flag} {scenario_key(result)} {metric}: {old:.3f} → {new:.3f} ({change:+.1%})")
+    print(f"\n{regressions} régression(s) au-delà de {tolerance:.0%}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark capteur → broker → abonné")
+    parser.add_argument("--components", nargs="+", choices=COMPONENTS, default=list(COMPONENTS))
+    parser.add_argument("--rates", nargs="+", type=float, default=[100, 1000, 0],
+                        help="Débits de publication en msg/s (0 = maximum)")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[0, 1024],
+                        help="Octets de remplissage ajoutés à chaque payload (JSON uniquement)")
+    parser.add_argument("--formats", nargs="+", choices=telemetry_codec.FORMATS,
+                        default=[telemetry_codec.FORMAT_JSON])
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1],
+                        help="Échantillons par message publié")
+    parser.add_argument("--duration", type=float, default=5.0, help="Durée par scénario (s)")
+    parser.add_argument("--refresh", type=float, default=0.1,
+                        help="Période de lecture de l'historique par la session du dashboard (s)")
+    parser.add_argument("--output", help="Fichier JSON de sortie")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CANDIDATE"))
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare_reports(*args.compare, args.tolerance) else 0)
+
+    results = []
+    scenarios = [
+        (component, payload_format, batch_size, rate, size)
+        for component in args.components
+        for payload_format in args.formats
+        for batch_size in args.batch_sizes
+        for rate in args.rates
+        for size in (args.sizes if payload_format == telemetry_codec.FORMAT_JSON else [0])
+    ]
+    for component, payload_format, batch_size, rate, size in scenarios:
+        result = run_isolated(component, rate, args.duration, size, args.refresh,
+                              payload_format, batch_size)
+        results.append(result)
+        print(f"{component:>10} {payload_format:>6} x{batch_size:<4} rate={rate or 'max':>6} pad={size:>5}B  "
+              f"{result['throughput_msgs_s']:9.0f} msg/s  "
+              f"p50={result['latency_p50_ms'] or 0:7.2f}ms  "
+              f"p99={result['latency_p99_ms'] or 0:7.2f}ms  "
+              f"cpu={result['component_cpu_s']:.2f}s  "
+              f"rss={result['rss_peak_mb'] or 0:.0f}MB")
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"bench_{datetime.now():%Y%m%d_%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({"environment": environment_info(), "results": results}, f, indent=2)
+    print(f"\n📄 Rapport écrit dans {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,431 @@
+"""
+Commandes descendantes (downlink) et accusés de réception (acks)
+
+Chaque commande porte un identifiant unique et est publiée sur le topic de
+commande d'un appareil (sensors/<device_id>/command). L'appareil l'exécute
+hors du thread réseau MQTT puis publie un ack sur son topic d'ack avec le statut,
+le résultat et la latence d'exécution. AckTracker associe ces acks aux
+commandes envoyées (abonné, dashboard) et mesure l'aller-retour complet.
+
+Commandes de flotte (CommandService) : la cible est un appareil, une liste,
+un groupe (annoncé par les appareils dans leur message de présence) ou un
+filtre sur le dernier échantillon (ex. battery<20). Quand la cible couvre
+tout un groupe, un seul message est publié sur le topic du groupe
+(sensors/group/<group>/command) au lieu d'un message par appareil. Les
+appareils sans ack après ACK_TIMEOUT sont relancés (RETRIES fois) ; comme
+la commande garde son identifiant, un appareil qui l'a déjà exécutée renvoie
+simplement son ack (RecentCommands). Les acks de chaque déploiement tiennent
+dans un tableau compact : un octet de statut et un float par appareil.
+"""
+
+import json
+import operator
+import re
+import time
+import uuid
+import threading
+from array import array
+from collections import OrderedDict, deque
+
+import topics
+
+ACK_TIMEOUT = 5.0  # secondes
+RETRIES = 2             # relances des appareils sans ack (commandes de flotte)
+RECENT_COMMANDS = 256   # identifiants de commandes mémorisés par l'appareil
+ROLLOUT_HISTORY = 20    # déploiements gardés pour l'affichage
+
+ACK_OK = "ok"
+ACK_ERROR = "error"
+ACK_UNKNOWN = "unknown_action"
+
+
+def new_command(action, value=None, **params):
+    """Construit une commande avec un identifiant unique"""
+    command = {"id": uuid.uuid4().hex[:12], "action": action}
+    if value is not None:
+        command["value"] = value
+    command.update(params)
+    return command
+
+
+def publish_command(client, command, device_id=topics.DEFAULT_DEVICE_ID, tracker=None):
+    """Publie une commande à un appareil (et l'enregistre auprès du tracker d'acks)"""
+    if tracker is not None:
+        tracker.register(command)
+    client.publish(topics.command_topic(device_id), json.dumps(command), qos=1)
+    return command
+
+
+def make_ack(command, device_id, status, received_at, result=None, error=None):
+    """Construit l'ack d'une commande exécutée (côté appareil)"""
+    ack = {
+        "id": command.get("id"),
+        "device_id": device_id,
+        "action": command.get("action"),
+        "status": status,
+        # Temps passé sur l'appareil : attente dans la queue + exécution
+        "latency_ms": round((time.monotonic() - received_at) * 1000, 3),
+    }
+    if result is not None:
+        ack["result"] = result
+    if error is not None:
+        ack["error"] = error
+    return ack
+
+
+def make_presence(device_id, groups=(), online=True):
+    """Message de présence d'un appareil (publié retenu sur sensors/<device_id>/presence)"""
+    return json.dumps({"device_id": device_id, "groups": list(groups), "online": online,
+                       "timestamp": time.time()})
+
+
+def device_groups(groups):
+    """Groupes dont l'appareil reçoit les commandes (le groupe de tous les appareils en premier)"""
+    return list(dict.fromkeys((topics.ALL_GROUP, *groups)))
+
+
+class RecentCommands:
+    """
+    Dernières commandes exécutées par un appareil : une commande relancée n'est pas réexécutée.
+    Une commande sans identifiant (ancien format {"action": ...}) n'est jamais mémorisée :
+    chacune est exécutée.
+    """
+
+    def __init__(self, size=RECENT_COMMANDS):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, command_id):
+        if command_id is None:
+            return None
+        with self.lock:
+            return self.entries.get(command_id)
+
+    def add(self, command_id, value):
+        if command_id is None:
+            return
+        with self.lock:
+            self.entries[command_id] = value
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+
+class AckTracker:
+    """Associe les acks reçus aux commandes envoyées et mesure l'aller-retour"""
+
+    def __init__(self):
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def register(self, command):
+        """Enregistre une commande envoyée dont on attend l'ack"""
+        with self.lock:
+            self.pending[command["id"]] = {
+                "sent_at": time.monotonic(),
+                "event": threading.Event(),
+                "ack": None,
+            }
+
+    def on_message(self, client, userdata, msg):
+        """Callback MQTT pour le topic d'ack"""
+        try:
+            ack = json.loads(msg.payload)
+        except Exception as e:
+            print(f"❌ Ack illisible: {e}")
+            return
+        self.record(ack)
+
+    def record(self, ack):
+        """Associe un ack décodé à la commande en attente"""
+        with self.lock:
+            entry = self.pending.get(ack.get("id"))
+            if entry is None or entry["ack"] is not None:
+                return
+            ack["round_trip_ms"] = round((time.monotonic() - entry["sent_at"]) * 1000, 3)
+            entry["ack"] = ack
+        entry["event"].set()
+
+    def wait(self, command_id, timeout=ACK_TIMEOUT):
+        """Attend l'ack d'une commande ; retourne l'ack ou None après le timeout"""
+        with self.lock:
+            entry = self.pending.get(command_id)
+        if entry is None:
+            return None
+        entry["event"].wait(timeout)
+        with self.lock:
+            self.pending.pop(command_id, None)
+        return entry["ack"]
+
+
+# ==== CIBLAGE ====
+PREDICATE_RE = re.compile(r"^\s*(\w+)\s*(<=|>=|==|!=|<|>|=)\s*([^<>=!\s].*?)\s*$")
+OPERATORS = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge,
+             "==": operator.eq, "=": operator.eq, "!=": operator.ne}
+
+
+def parse_predicate(text):
+    """Filtre "champ<op>valeur" (ex. battery<20, status==online) -> fonction sur un DeviceState"""
+    match = PREDICATE_RE.match(text)
+    if match is None:
+        raise ValueError(f"Filtre invalide: {text!r} (ex. battery<20)")
+    field, op, raw = match.groups()
+    compare = OPERATORS[op]
+    try:
+        expected = float(raw)
+    except ValueError:
+        expected = raw
+
+    def predicate(state):
+        payload = state.last_payload
+        if payload is None or payload.get(field) is None:
+            return False
+        try:
+            return compare(payload[field], expected)
+        except TypeError:
+            return False  # nombre comparé à du texte
+
+    predicate.text = text.strip()
+    return predicate
+
+
+# ==== DÉPLOIEMENTS ====
+PENDING, APPLIED, FAILED, UNKNOWN, TIMED_OUT = range(5)
+ACK_STATES = {ACK_OK: APPLIED, ACK_ERROR: FAILED, ACK_UNKNOWN: UNKNOWN}
+
+
+class Rollout:
+    """Une commande envoyée à plusieurs appareils et l'état de leurs acks"""
+
+    def __init__(self, command, device_ids, target, retries=RETRIES, timeout=ACK_TIMEOUT):
+        self.command = command
+        self.target = target  # description de la cible, pour l'affichage
+        self.device_ids = list(device_ids)
+        self.index = {device_id: k for k, device_id in enumerate(self.device_ids)}
+        # Table compacte : statut (1 octet) et aller-retour en ms (float) par appareil
+        self.status = bytearray(len(self.device_ids))
+        self.round_trip = array("f", bytes(4 * len(self.device_ids)))
+        self.counts = [len(self.device_ids), 0, 0, 0, 0]
+        self.retries = retries
+        self.timeout = timeout
+        self.group = None  # groupe dont le topic couvre exactement la cible
+        self.attempts = 0
+        self.published = 0  # messages publiés (groupe = 1 message)
+        self.started = time.monotonic()
+        self.sent_at = self.deadline = None
+        self.ended = None
+        self.finished = threading.Event()
+        self.lock = threading.Lock()
+        if not self.device_ids:
+            self._finish()
+
+    @property
+    def id(self):
+        return self.command["id"]
+
+    def _finish(self):
+        self.ended = time.monotonic()
+        self.finished.set()
+
+    def record(self, ack):
+        """Enregistre l'ack d'un appareil ; faux s'il n'est pas attendu (hors cible, doublon)"""
+        k = self.index.get(ack.get("device_id"))
+        if k is None:
+            return False
+        with self.lock:
+            if self.status[k] != PENDING:
+                return False
+            state = ACK_STATES.get(ack.get("status"), FAILED)
+            self.status[k] = state
+            self.round_trip[k] = (time.monotonic() - self.sent_at) * 1000
+            self.counts[PENDING] -= 1
+            self.counts[state] += 1
+            if self.counts[PENDING] == 0:
+                self._finish()
+        return True
+
+    def pending(self):
+        """Appareils sans ack"""
+        with self.lock:
+            return [self.device_ids[k] for k, state in enumerate(self.status) if state == PENDING]
+
+    def expire(self):
+        """Dernière tentative écoulée : les appareils sans ack passent en échec (timeout)"""
+        with self.lock:
+            for k, state in enumerate(self.status):
+                if state == PENDING:
+                    self.status[k] = TIMED_OUT
+            self.counts[TIMED_OUT] += self.counts[PENDING]
+            self.counts[PENDING] = 0
+            self._finish()
+
+    def progress(self):
+        """Compteurs du déploiement"""
+        with self.lock:
+            total, counts = len(self.device_ids), list(self.counts)
+            acked = [self.round_trip[k] for k, state in enumerate(self.status)
+                     if state not in (PENDING, TIMED_OUT)]
+        acked.sort()
+        return {
+            "action": self.command["action"],
+            "target": self.target,
+            "total": total,
+            "applied": counts[APPLIED],
+            "failed": counts[FAILED],
+            "unknown": counts[UNKNOWN],
+            "timed_out": counts[TIMED_OUT],
+            "pending": counts[PENDING],
+            "attempts": self.attempts,
+            "published": self.published,
+            "round_trip_p50_ms": acked[len(acked) // 2] if acked else None,
+            "elapsed": (self.ended or time.monotonic()) - self.started,
+            "finished": self.finished.is_set(),
+        }
+
+    def summary(self):
+        """Ligne d'avancement (ex. « set_interval appliquée sur 9,812/10,000 »)"""
+        p = self.progress()
+        text = f"{p['action']} → {p['target']} : appliquée sur {p['applied']:,}/{p['total']:,}"
+        if p["failed"] or p["unknown"]:
+            text += f", erreurs {p['failed'] + p['unknown']:,}"
+        if p["timed_out"]:
+            text += f", sans réponse {p['timed_out']:,}"
+        if p["pending"]:
+            text += f", en attente {p['pending']:,} (tentative {p['attempts']}/{self.retries + 1})"
+        return text + f" — {p['published']:,} messages, {p['elapsed']:.1f} s"
+
+
+class CommandService:
+    """
+    Commandes à un appareil, un groupe ou une sélection d'appareils :
+    publication groupée quand c'est possible, relances, suivi des acks.
+    """
+
+    def __init__(self, client, registry, acks=None, timeout=ACK_TIMEOUT, retries=RETRIES):
+        self.client = client
+        self.registry = registry
+        # Acks des commandes unitaires (AckTracker) : même callback MQTT
+        self.acks = acks
+        self.timeout = timeout
+        self.retries = retries
+        self.active = {}  # identifiant de commande -> déploiement en cours
+        self.history = deque(maxlen=ROLLOUT_HISTORY)  # plus récent en tête
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    # ==== ACKS (thread réseau) ====
+    def on_message(self, client, userdata, msg):
+        """Callback MQTT des topics d'ack : déploiements puis commandes unitaires"""
+        try:
+            ack = json.loads(msg.payload)
+        except Exception as e:
+            print(f"❌ Ack illisible: {e}")
+            return
+        rollout = self.active.get(ack.get("id"))
+        if rollout is not None:
+            if rollout.record(ack) and rollout.finished.is_set():
+                self.wakeup.set()
+        elif self.acks is not None:
+            self.acks.record(ack)
+
+    # ==== CIBLAGE ====
+    def resolve(self, device_ids=None, group=None, where=None):
+        """Appareils visés : liste explicite, membres d'un groupe, filtrés par `where`"""
+        if device_ids is not None:
+            targets = list(dict.fromkeys(device_ids))
+        else:
+            targets = self.registry.members(group or topics.ALL_GROUP)
+        if where is not None:
+            states = [self.registry.get(d) for d in targets]
+            targets = [state.device_id for state in states if state is not None and where(state)]
+        return targets
+
+    def _covering_group(self, device_ids, group):
+        """Groupe dont les membres sont exactement ces appareils (None sinon)"""
+        wanted = set(device_ids)
+        for candidate in dict.fromkeys((group, topics.ALL_GROUP)):
+            if candidate is not None and set(self.registry.members(candidate)) == wanted:
+                return candidate
+        return None
+
+    # ==== ENVOI ====
+    def send(self, action, value=None, device_ids=None, group=None, where=None, **params):
+        """Envoie une commande à la cible ; retourne le Rollout (suivi des acks)"""
+        targets = self.resolve(device_ids, group, where)
+        if device_ids is not None:
+            target = device_ids[0] if len(device_ids) == 1 else f"{len(device_ids)} appareils"
+        else:
+            target = f"groupe {group or topics.ALL_GROUP}"
+        if where is not None:
+            target += f" où {getattr(where, 'text', 'filtre')}"
+
+        rollout = Rollout(new_command(action, value, **params), targets, target,
+                          self.retries, self.timeout)
+        with self.lock:
+            self.history.appendleft(rollout)
+            if rollout.finished.is_set():
+                return rollout  # aucune cible
+            self.active[rollout.id] = rollout
+        # Un seul message si la cible est exactement un groupe
+        if len(targets) > 1:
+            rollout.group = self._covering_group(targets, group)
+        self._publish(rollout, targets, rollout.group)
+        self._start()
+        return rollout
+
+    def _publish(self, rollout, device_ids, group=None):
+        payload = json.dumps(rollout.command)
+        rollout.attempts += 1
+        rollout.sent_at = rollout.sent_at or time.monotonic()
+        if group is not None:
+            self.client.publish(topics.group_command_topic(group), payload, qos=1)
+            rollout.published += 1
+        else:
+            for device_id in device_ids:
+                self.client.publish(topics.command_topic(device_id), payload, qos=1)
+            rollout.published += len(device_ids)
+        rollout.deadline = time.monotonic() + rollout.timeout
+
+    # ==== RELANCES ====
+    def _start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._retry_loop, daemon=True, name="command-retry")
+                self.thread.start()
+        self.wakeup.set()
+
+    def _retry_loop(self):
+        while True:
+            with self.lock:
+                rollouts = list(self.active.values())
+            now = time.monotonic()
+            next_deadline = None
+            for rollout in rollouts:
+                if not rollout.finished.is_set() and now >= rollout.deadline:
+                    if rollout.attempts > rollout.retries:
+                        rollout.expire()
+                    else:
+                        pending = rollout.pending()
+                        # Relance groupée si la plupart des membres n'ont pas répondu
+                        # (ceux qui l'ont déjà exécutée renvoient seulement leur ack)
+                        group = rollout.group if 2 * len(pending) > len(rollout.device_ids) else None
+                        self._publish(rollout, pending, group)
+                if rollout.finished.is_set():
+                    with self.lock:
+                        self.active.pop(rollout.id, None)
+                    continue
+                if next_deadline is None or rollout.deadline < next_deadline:
+                    next_deadline = rollout.deadline
+            timeout = None if next_deadline is None else max(0.0, next_deadline - time.monotonic())
+            self.wakeup.wait(timeout)
+            self.wakeup.clear()
+
+    def wait(self, rollout, timeout=None):
+        """Attend la fin d'un déploiement (acks ou relances épuisées) ; vrai s'il est terminé"""
+        return rollout.finished.wait(timeout)
+
+    def rollouts(self):
+        """Déploiements récents, le plus récent en premier"""
+        with self.lock:
+            return list(self.history)
@@ -0,0 +1,26 @@
+"""
+Configuration partagée de la connexion MQTT
+
+Par défaut : le cluster HiveMQ Cloud du projet. Chaque valeur peut être
+remplacée par une variable d'environnement, par exemple pour un mosquitto
+local sans TLS ni authentification :
+
+    IOT_MQTT_BROKER=localhost IOT_MQTT_PORT=1883 IOT_MQTT_TLS=0 IOT_MQTT_USERNAME= python virtual_sensor.py
+
+IOT_TRANSPORT=memory remplace le broker par le bus en mémoire de
+transport.py (tous les composants dans un seul processus).
+"""
+
+import os
+
+MQTT_BROKER = os.environ.get("IOT_MQTT_BROKER", "7be661ae342e41e28bb30488c56a0cfe.s1.eu.hivemq.cloud")
+MQTT_PORT = int(os.environ.get("IOT_MQTT_PORT", "8883"))
+MQTT_USERNAME = os.environ.get("IOT_MQTT_USERNAME", "sensor_user")  # vide = sans authentification
+MQTT_PASSWORD = os.environ.get("IOT_MQTT_PASSWORD", "bY.5Gdir4iSrwWy")
+MQTT_TLS = os.environ.get("IOT_MQTT_TLS", "1").lower() not in ("0", "false", "no")
+MQTT_KEEPALIVE = 60
+
+TRANSPORT = os.environ.get("IOT_TRANSPORT", "paho")  # "paho" ou "memory"
+
+# Serveur de métriques Prometheus de chaque composant (metrics.py) ; local par défaut
+METRICS_HOST = os.environ.get("IOT_METRICS_HOST", "127.0.0.1")
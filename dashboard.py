@@ -2,232 +2,416 @@
 Dashboard IoT en Python avec Streamlit
 Affiche en temps réel les données envoyées par le capteur virtuel.
 Broker : HiveMQ Cloud
-Topic : sensors/temperature/data (télémétrie)
+Topics : sensors/<device_id>/data (télémétrie), sensors/<device_id>/command
 """
-import json
+import os
+import sys
 import time
+import argparse
 from datetime import datetime
-from collections import deque
-from queue import Queue
 import streamlit as st
-import paho.mqtt.client as mqtt
 import pandas as pd
+from dashboard_ingest import METRICS_PORT, TOPIC_TELEMETRY, IngestService
+import metrics
+import transport
+from telemetry_store import DB_PATH, TelemetryStore
+from rollups import POINT_BUDGET, downsample
+import commands
+import topics
 
-# ==== CONFIG MQTT HiveMQ Cloud ====
-MQTT_BROKER = "7be661ae342e41e28bb30488c56a0cfe.s1.eu.hivemq.cloud"
-MQTT_PORT = 8883
-MQTT_USERNAME = "sensor_user"
-MQTT_PASSWORD = "bY.5Gdir4iSrwWy"
-TOPIC_TELEMETRY = "sensors/temperature/data"
-
-# Taille de l'historique pour les graphes
-MAX_POINTS = 100
-
-# ==== QUEUE GLOBALE (partagée entre threads) ====
-# On la crée en dehors de session_state pour éviter les problèmes de threading
-if "global_queue" not in st.session_state:
-    st.session_state.global_queue = Queue()
-
-# ==== ÉTAT PERSISTANT (survivre aux rerun) ====
-if "data_history" not in st.session_state:
-    st.session_state.data_history = deque(maxlen=MAX_POINTS)
-
-if "last_payload" not in st.session_state:
-    st.session_state.last_payload = None
-
-if "connection_status" not in st.session_state:
-    st.session_state.connection_status = "Déconnecté"
-
-# ==== CALLBACKS MQTT (thread séparé) ====
-def on_connect(client, userdata, flags, rc):
-    """Callback appelé lors de la connexion"""
-    if rc == 0:
-        print(f"[{datetime.now()}] ✓ Connecté au broker, abonnement à {TOPIC_TELEMETRY}")
-        client.subscribe(TOPIC_TELEMETRY)
-        # On ne peut pas modifier session_state ici, on utilisera un indicateur
-    else:
-        print(f"❌ Erreur de connexion MQTT: {rc}")
+# Points bruts considérés pour le zoom "Derniers points" (réduits à POINT_BUDGET)
+CHART_POINTS = 20_000
+# Périodes min entre deux passages des fragments en direct (secondes)
+LIVE_REFRESH = 0.5   # statut, métriques, alertes, compteurs, déploiements
+CHART_REFRESH = 1.0  # graphes et tableau (plus coûteux à reconstruire)
+# Période min entre deux reconstructions de la page pour ajouter de nouveaux appareils aux sélecteurs
+DEVICE_LIST_REFRESH = 10.0
+# Métriques des graphes en direct
+CHART_METRICS = ("temperature", "humidity", "battery")
+# Fuseau local pour l'axe des temps
+LOCAL_TZ = datetime.now().astimezone().tzinfo
+# Niveaux de zoom des graphes en direct (secondes, None = points bruts)
+LIVE_ZOOMS = {"Derniers points": None, "5 min": 300, "1 h": 3600, "24 h": 86400, "30 jours": 30 * 86400}
+# Cibles des commandes dans la vue "Tous"
+TARGET_DEVICE, TARGET_GROUP, TARGET_FILTER = "Appareil", "Groupe", "Filtre"
+# Déploiements (commandes de flotte) affichés
+ROLLOUTS_SHOWN = 5
+# Fenêtres proposées pour l'historique persistant (secondes)
+STORE_WINDOWS = {"15 min": 900, "1 h": 3600, "6 h": 6 * 3600, "24 h": 86400, "7 jours": 7 * 86400}
 
-def on_message(client, userdata, msg):
-    """
-    Callback appelé lors de la réception d'un message.
-    IMPORTANT : On utilise userdata (la queue) au lieu de st.session_state
-    """
-    try:
-        payload = json.loads(msg.payload.decode("utf-8"))
-        # On pousse le payload dans la queue passée via userdata
-        userdata.put(payload)
-        print(f"[{datetime.now()}] 📥 Message reçu: Temp={payload['temperature']}°C")
-    except Exception as e:
-        print(f"❌ Erreur de décodage : {e}")
-
-# ==== INITIALISATION MQTT (UNE SEULE FOIS) ====
-if "mqtt_client" not in st.session_state:
-    # Créer le client MQTT avec la queue comme userdata
-    client = mqtt.Client(
-        mqtt.CallbackAPIVersion.VERSION1,
-        client_id="streamlit_dashboard",
-        userdata=st.session_state.global_queue  # Passer la queue ici
-    )
-    
-    # Configuration pour HiveMQ Cloud (authentification + TLS)
-    client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
-    client.tls_set()  # Active TLS/SSL
-    
-    client.on_connect = on_connect
-    client.on_message = on_message
-    
-    try:
-        client.connect(MQTT_BROKER, MQTT_PORT, 60)
-        client.loop_start()  # thread MQTT en arrière-plan
-        st.session_state.mqtt_client = client
-        st.session_state.connection_status = "Connecté"
-        print(f"[{datetime.now()}] 🚀 Client MQTT démarré")
-    except Exception as e:
-        st.session_state.connection_status = f"Erreur: {e}"
-        print(f"❌ Erreur connexion MQTT: {e}")
-
-# ==== CONSOMMER LES MESSAGES DE LA QUEUE ====
-# Ici on est dans le thread Streamlit, on peut utiliser session_state
-message_count = 0
-while not st.session_state.global_queue.empty():
-    try:
-        payload = st.session_state.global_queue.get_nowait()
-        st.session_state.last_payload = payload
-        
-        # Ajouter à l'historique
-        st.session_state.data_history.append({
-            "time": datetime.fromisoformat(payload["timestamp"]),
-            "temperature": payload["temperature"],
-            "humidity": payload["humidity"],
-            "battery": payload["battery"]
-        })
-        message_count += 1
-    except:
-        break
+# Options après "--" : streamlit run dashboard.py -- --replay capture.bin --speed 10
+parser = argparse.ArgumentParser()
+parser.add_argument("--replay", metavar="CAPTURE", help="Rejoue une capture au lieu de se connecter au broker")
+parser.add_argument("--speed", type=float, default=1.0, help="Vitesse du rejeu (0 = maximale)")
+parser.add_argument("--metrics-port", type=int, default=METRICS_PORT,
+                    help="Port HTTP des métriques Prometheus (0 = désactivé)")
+options, _ = parser.parse_known_args(sys.argv[1:])
+
+# ==== INGESTION MQTT PARTAGÉE (UNE SEULE FOIS PAR PROCESSUS) ====
+# Tous les onglets partagent la même connexion et le même historique ;
+# chaque session ne garde qu'un curseur dans cet historique.
+@st.cache_resource(show_spinner=False)
+def get_ingest_service():
+    metrics.serve(options.metrics_port)
+    if options.replay:
+        return IngestService().replay(options.replay, options.speed)
+    return IngestService().start()
+
+service = get_ingest_service()
+registry = service.registry
+
+# Base SQLite écrite par mqtt_subscriber.py --store (lecture seule ici)
+@st.cache_resource(show_spinner=False)
+def get_store():
+    return TelemetryStore(DB_PATH, readonly=True) if os.path.exists(DB_PATH) else None
+
+store = get_store()
 
 # ==== UI STREAMLIT ====
 st.set_page_config(page_title="IoT Dashboard", layout="wide", page_icon="📊")
 
 st.title("📊 Dashboard IoT ")
 
-# Barre d'info avec statut de connexion
-status_color = "🟢" if st.session_state.connection_status == "Connecté" else "🔴"
-st.markdown(
-    f"""
-*Broker* : {MQTT_BROKER}:{MQTT_PORT}  
-*Topic télémétrie* : {TOPIC_TELEMETRY}  
-*Statut* : {status_color} {st.session_state.connection_status}  
-*Messages reçus* : {len(st.session_state.data_history)}
-"""
-)
+# ==== APPAREIL AFFICHÉ ====
+# "Tous" : historique partagé de tous les appareils ; sinon l'historique
+# récent de l'appareil, tenu à jour par le registre (routage par topic)
+ALL_DEVICES = "Tous"
+device = st.selectbox("Appareil", [ALL_DEVICES] + registry.ids(), key="device")
+if device == ALL_DEVICES:
+    history = service.history
+else:
+    history = registry.get(device).history
 
-if st.session_state.connection_status != "Connecté":
-    st.warning("⚠ Non connecté au broker MQTT. Vérifie que virtual_sensor.py est lancé.")
+# ==== ÉTAT PAR SESSION (survivre aux rerun) ====
+# Début de l'historique visible par cette session, par appareil (déplacé par "Effacer")
+if "history_start" not in st.session_state:
+    st.session_state.history_start = {}
 
-st.markdown("---")
+def session_start():
+    return st.session_state.history_start.get(device, 0)
 
-# ==== MÉTRIQUES EN TEMPS RÉEL ====
-col1, col2, col3 = st.columns(3)
+def session_rows(n):
+    """Les n dernières lignes visibles par cette session"""
+    start = max(session_start(), history.total - n)
+    return history.since(start)[0]
 
-if st.session_state.last_payload is not None:
-    p = st.session_state.last_payload
-    
-    col1.metric(
-        "🌡 Température (°C)", 
-        f"{p['temperature']:.2f}",
-        delta=None
-    )
-    col2.metric(
-        "💧 Humidité (%)", 
-        f"{p['humidity']:.2f}",
-        delta=None
+def session_last_payload():
+    """Dernier message reçu, sauf si la session a effacé son historique depuis"""
+    if history.total <= session_start():
+        return None
+    if device == ALL_DEVICES:
+        return service.last_payload
+    return registry.get(device).last_payload
+
+def to_frame(rows):
+    """Colonnes du ring buffer -> DataFrame indexé par le temps"""
+    index = pd.to_datetime(rows["timestamp"], unit="s", utc=True).tz_convert(LOCAL_TZ)
+    return pd.DataFrame(
+        {name: values for name, values in rows.items() if name != "timestamp"},
+        index=pd.Index(index, name="time")
     )
-    col3.metric(
-        "🔋 Batterie (%)", 
-        f"{p['battery']}",
-        delta=None
+
+def delivery_text():
+    """Taux de livraison d'après les numéros de séquence, doublons écartés"""
+    total = service.sequences.totals()
+    if total["delivery_ratio"] is None:
+        return "—"
+    return (f"{total['delivery_ratio']:.2%} ({total['lost']} manquants, "
+            f"{service.duplicates} doublons écartés, {total['reordered']} dans le désordre)")
+
+def data_version():
+    """Change dès qu'une ligne visible par cette session arrive (appareil, effacement, total)"""
+    return device, session_start(), history.total
+
+def session_cache(name, version, build):
+    """
+    Résultat de build() gardé par la session tant que `version` ne change pas :
+    un passage de fragment sans nouvelle donnée ne relit pas l'historique et ne
+    reconstruit aucun DataFrame, il renvoie seulement les éléments déjà calculés.
+    """
+    cache = st.session_state.setdefault("live_cache", {})
+    entry = cache.get(name)
+    if entry is None or entry[0] != version:
+        entry = cache[name] = (version, build())
+    return entry[1]
+
+def render_info():
+    """Barre d'info avec statut de connexion"""
+    status_color = "🟢" if service.connection_status == "Connecté" or options.replay else "🔴"
+    st.markdown(
+        f"""
+*Broker* : {transport.describe()}  
+*Topic télémétrie* : {TOPIC_TELEMETRY}  
+*Statut* : {status_color} {service.connection_status}  
+*Appareils* : {len(registry)}  
+*Messages reçus* : {history.total}  
+*Livraison* : {delivery_text()}
+"""
     )
-    
-    # Informations supplémentaires
+
+def render_metrics():
+    """Métriques du dernier message reçu"""
+    metric_temp, metric_hum, metric_bat = st.columns(3)
+    p = session_last_payload()
     with st.expander("ℹ Détails du dernier message"):
-        st.json(p)
-else:
-    col1.metric("🌡 Température (°C)", "—")
-    col2.metric("💧 Humidité (%)", "—")
-    col3.metric("🔋 Batterie (%)", "—")
+        if p is not None:
+            st.json(p)
+    if p is None:
+        metric_temp.metric("🌡 Température (°C)", "—")
+        metric_hum.metric("💧 Humidité (%)", "—")
+        metric_bat.metric("🔋 Batterie (%)", "—")
+        return
+    metric_temp.metric("🌡 Température (°C)", f"{p['temperature']:.2f}", delta=None)
+    metric_hum.metric("💧 Humidité (%)", f"{p['humidity']:.2f}", delta=None)
+    metric_bat.metric("🔋 Batterie (%)", f"{p['battery']}", delta=None)
+
+def alerts_frame():
+    """Alertes reçues de l'analyse en flux (appareil affiché ou tous)"""
+    alerts = [a for a in list(service.alerts) if device == ALL_DEVICES or a["device_id"] == device]
+    if not alerts:
+        return None
+    frame = pd.DataFrame(alerts, columns=["timestamp", "device_id", "severity", "type", "metric", "value", "detail"])
+    frame["timestamp"] = pd.to_datetime(frame["timestamp"], unit="s", utc=True).dt.tz_convert(LOCAL_TZ)
+    return frame
+
+def render_alerts():
+    """Tableau des alertes, reconstruit seulement quand une alerte arrive"""
+    frame = session_cache("alerts", (device, service.alert_count), alerts_frame)
+    if frame is None:
+        st.caption("Aucune alerte")
+        return
+    st.dataframe(frame, hide_index=True, use_container_width=True)
+
+# ==== ÉLÉMENTS EN DIRECT (FRAGMENTS) ====
+# Chaque partie vivante de la page est un fragment relancé seul, au plus
+# toutes les LIVE_REFRESH / CHART_REFRESH secondes : les messages arrivés
+# entre deux passages sont regroupés en une seule mise à jour, et les
+# contrôles (sélecteurs, commandes, historique persistant) ne sont pas
+# reconstruits. Sans nouvelle donnée, un passage réaffiche le résultat gardé
+# par session_cache() sans relire l'historique ; les éléments sont tout de
+# même renvoyés au navigateur (un fragment qui ne les réémet pas les efface).
+known_devices = len(registry)
+page_built = time.monotonic()
+
+@st.fragment(run_every=LIVE_REFRESH)
+def live_status():
+    """Statut de connexion, métriques du dernier message et alertes"""
+    if len(registry) != known_devices and time.monotonic() - page_built >= DEVICE_LIST_REFRESH:
+        # Nouveaux appareils : reconstruire la page pour les ajouter aux sélecteurs,
+        # au plus une fois par DEVICE_LIST_REFRESH (une flotte qui démarre en ajoute sans cesse)
+        st.rerun()
+    render_info()
+    if options.replay:
+        st.info(f"▶️ Rejeu de la capture {options.replay} : les commandes sont désactivées.")
+    elif service.connection_status != "Connecté":
+        st.warning("⚠ Non connecté au broker MQTT. Vérifie que virtual_sensor.py est lancé.")
+
+    st.markdown("---")
+    render_metrics()
+    # Calculées par l'abonné à l'arrivée de chaque échantillon (anomaly.py)
+    with st.expander("🚨 Alertes", expanded=bool(service.alerts)):
+        render_alerts()
+
+live_status()
 
 st.markdown("---")
 
 # ==== GRAPHES ====
-if len(st.session_state.data_history) > 0:
-    df = pd.DataFrame(list(st.session_state.data_history))
-    df = df.set_index("time")
-    
-    tab1, tab2, tab3 = st.tabs(["📈 Température", "💧 Humidité", "🔋 Batterie"])
-    
-    with tab1:
-        st.line_chart(df["temperature"], use_container_width=True)
-    
-    with tab2:
-        st.line_chart(df["humidity"], use_container_width=True)
-    
-    with tab3:
-        st.line_chart(df["battery"], use_container_width=True)
-    
+# Chaque zoom est limité à POINT_BUDGET points : sous-échantillonnage LTTB
+# des points bruts, ou des agrégats (rollups) à la résolution adaptée.
+def chart_frames(zoom):
+    """Séries des graphes au zoom choisi, tableau des dernières valeurs et légende"""
+    span = LIVE_ZOOMS[zoom]
+    caption = None
+    frames = {}
+    if span is None:
+        rows = session_rows(CHART_POINTS)
+        for name in CHART_METRICS:
+            frames[name] = to_frame(downsample(rows, name))[[name]]
+    else:
+        now = time.time()
+        resolution, rows = service.rollups.query(now - span, now)
+        caption = f"Agrégats à {resolution} s"
+        for name in CHART_METRICS:
+            sampled = downsample(rows, f"{name}_mean")
+            frames[name] = to_frame({
+                "timestamp": sampled["timestamp"],
+                "moyenne": sampled[f"{name}_mean"],
+                "min": sampled[f"{name}_min"],
+                "max": sampled[f"{name}_max"],
+            })
+    table = to_frame(session_rows(20)).sort_index(ascending=False)
+    return frames, table, caption, datetime.now()
+
+@st.fragment(run_every=CHART_REFRESH)
+def live_charts():
+    """Graphes et tableau des dernières valeurs, recalculés seulement s'il y a du nouveau"""
+    if history.total <= session_start():
+        st.info("⏳ En attente de données… Assure-toi que virtual_sensor.py est en cours d'exécution.")
+        st.code("python virtual_sensor.py", language="bash")
+        return
+
+    col_zoom, zoom_box = st.columns([1, 3])
+    # Les agrégats (zooms longs) couvrent tous les appareils confondus
+    zooms = list(LIVE_ZOOMS) if device == ALL_DEVICES else ["Derniers points"]
+    zoom = col_zoom.selectbox("Zoom", zooms, key="zoom")
+    frames, table, caption, built = session_cache("charts", data_version() + (zoom,),
+                                                  lambda: chart_frames(zoom))
+    if caption:
+        zoom_box.caption(caption)
+
+    tabs = st.tabs(["📈 Température", "💧 Humidité", "🔋 Batterie"])
+    for tab, name in zip(tabs, CHART_METRICS):
+        with tab:
+            st.line_chart(frames[name], use_container_width=True)
+
     # Tableau des dernières valeurs
     with st.expander("📋 Historique des données"):
-        st.dataframe(df.tail(20).sort_index(ascending=False), use_container_width=True)
+        st.dataframe(table, use_container_width=True)
+    st.caption(f"🕐 Dernière mise à jour : {built:%H:%M:%S}")
+
+live_charts()
+
+# ==== HISTORIQUE PERSISTANT ====
+st.markdown("---")
+st.subheader("🗄 Historique persistant")
+
+if store is None:
+    st.info(f"Aucune base {DB_PATH}. Lance l'abonné avec le stockage activé :")
+    st.code(f"python mqtt_subscriber.py --store {DB_PATH}", language="bash")
 else:
-    st.info("⏳ En attente de données… Assure-toi que virtual_sensor.py est en cours d'exécution.")
-    st.code("python virtual_sensor.py", language="bash")
+    col_dev, col_win, col_metric = st.columns(3)
+    store_device = col_dev.selectbox("Appareil", [ALL_DEVICES] + store.devices(), key="store_device")
+    window = col_win.selectbox("Fenêtre", list(STORE_WINDOWS), index=1, key="store_window")
+    metric = col_metric.selectbox("Métrique", ["temperature", "humidity", "battery"], key="store_metric")
+
+    end = time.time()
+    started = time.perf_counter()
+    rows = store.query(end - STORE_WINDOWS[window], end, None if store_device == ALL_DEVICES else store_device)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    points = len(rows["timestamp"])
+    rows = downsample(rows, metric, POINT_BUDGET)
+    st.caption(f"{points} points lus en {elapsed_ms:.1f} ms, {len(rows['timestamp'])} affichés")
+    if points:
+        st.line_chart(to_frame(rows)[[metric]], use_container_width=True)
 
 # ==== CONTRÔLES (DOWNLINK COMMANDS) ====
+def send_command(action, value=None, **params):
+    """Publie une commande et attend son ack (None après le timeout)"""
+    if service.client is None:
+        return None  # rejeu : pas de broker
+    command = commands.new_command(action, value, **params)
+    commands.publish_command(
+        service.client,
+        command,
+        target,
+        tracker=service.acks
+    )
+    return service.acks.wait(command["id"])
+
+def run_command(action, message, value=None, **params):
+    """Commande vers la cible choisie : ack d'un appareil, ou déploiement suivi dans « Déploiements »"""
+    if target_kind == TARGET_DEVICE:
+        show_ack(send_command(action, value, **params), message)
+        return
+    if service.client is None or (target_kind == TARGET_FILTER and target_filter is None):
+        st.warning(f"⚠ {message} — commande non envoyée")
+        return
+    if target_kind == TARGET_GROUP:
+        rollout = service.commands.send(action, value, group=target_group, **params)
+    else:
+        rollout = service.commands.send(action, value, where=target_filter, **params)
+    st.info(f"🚀 {message} — {len(rollout.device_ids):,} appareils visés "
+            f"({rollout.published:,} messages publiés)")
+
+@st.fragment(run_every=LIVE_REFRESH)
+def live_rollouts():
+    """Avancement des derniers déploiements (acks reçus / appareils visés)"""
+    rollouts = service.commands.rollouts()[:ROLLOUTS_SHOWN]
+    if not rollouts:
+        st.caption("Aucun déploiement")
+        return
+    for rollout in rollouts:
+        p = rollout.progress()
+        done = p["applied"] / p["total"] if p["total"] else 1.0
+        st.progress(done, text=("✅ " if p["finished"] else "⏳ ") + rollout.summary())
+
+@st.fragment(run_every=LIVE_REFRESH)
+def live_count():
+    st.metric("Messages envoyés", history.total)
+
+def show_ack(ack, message):
+    """Affiche le résultat d'une commande et la latence de son ack"""
+    if ack is None:
+        st.warning(f"⚠ {message} — pas d'ack après {commands.ACK_TIMEOUT:.0f}s")
+    elif ack["status"] == commands.ACK_OK:
+        st.success(f"✅ {message} — ack en {ack['round_trip_ms']:.0f} ms "
+                   f"(appareil {ack['latency_ms']:.0f} ms)")
+    else:
+        st.error(f"❌ {message} — {ack['status']} {ack.get('error', '')}")
+
 st.markdown("---")
 st.subheader("🎛 Commandes de contrôle (Downlink)")
 
+# Vue d'un appareil : commandes à cet appareil (sensors/<device_id>/command).
+# Vue "Tous" : un appareil, un groupe (un seul message sur le topic du groupe)
+# ou les appareils dont le dernier échantillon vérifie un filtre
+target_kind, target_group, target_filter = TARGET_DEVICE, None, None
+if device == ALL_DEVICES:
+    target_kind = st.radio("Cible", [TARGET_DEVICE, TARGET_GROUP, TARGET_FILTER], horizontal=True,
+                           key="target_kind")
+if device != ALL_DEVICES:
+    target = device
+    st.caption(f"Appareil ciblé : {target}")
+elif target_kind == TARGET_DEVICE:
+    target = st.selectbox("Appareil ciblé", registry.ids() or [topics.DEFAULT_DEVICE_ID], key="target")
+elif target_kind == TARGET_GROUP:
+    target_group = st.selectbox("Groupe ciblé", registry.groups(), key="target_group")
+    st.caption(f"{len(registry.members(target_group)):,} appareils en ligne dans le groupe")
+else:
+    filter_text = st.text_input("Filtre sur le dernier échantillon", value="battery<90", key="target_filter")
+    try:
+        target_filter = commands.parse_predicate(filter_text)
+        st.caption(f"{len(service.commands.resolve(where=target_filter)):,} appareils correspondent")
+    except ValueError as e:
+        st.error(str(e))
+
 col_cmd1, col_cmd2, col_cmd3 = st.columns(3)
 
 with col_cmd1:
     st.markdown("*Intervalle d'échantillonnage*")
-    interval = st.number_input("Secondes", min_value=1, max_value=60, value=5, key="interval")
+    interval = st.number_input("Secondes (0.01 = 100 Hz)", min_value=0.01, max_value=60.0, value=5.0,
+                               step=0.01, format="%.2f", key="interval")
     if st.button("📊 Changer l'intervalle", use_container_width=True):
-        command = {"action": "set_interval", "value": interval}
-        st.session_state.mqtt_client.publish(
-            "sensors/temperature/command",
-            json.dumps(command),
-            qos=1
-        )
-        st.success(f"✅ Commande envoyée : intervalle = {interval}s")
+        run_command("set_interval", f"Intervalle = {interval}s", interval)
+
+    st.markdown("*Envoi par lots*")
+    batch_size = st.number_input("Échantillons par message", min_value=1, max_value=1000, value=1, key="batch_size")
+    batch_linger = st.number_input("Délai max (s)", min_value=0.1, max_value=60.0, value=1.0, key="batch_linger")
+    if st.button("📦 Changer les lots", use_container_width=True):
+        run_command("set_batch", f"Lots de {batch_size}, délai {batch_linger}s",
+                    size=batch_size, linger=batch_linger)
 
 with col_cmd2:
     st.markdown("*Gestion du capteur*")
     if st.button("🔄 Redémarrer", use_container_width=True):
-        command = {"action": "reboot"}
-        st.session_state.mqtt_client.publish(
-            "sensors/temperature/command",
-            json.dumps(command),
-            qos=1
-        )
-        st.warning("⚠ Redémarrage du capteur en cours...")
+        with st.spinner("⚠ Redémarrage du capteur en cours..."):
+            run_command("reboot", "Capteur redémarré")
     
     if st.button("🛑 Arrêter", use_container_width=True):
-        command = {"action": "shutdown"}
-        st.session_state.mqtt_client.publish(
-            "sensors/temperature/command",
-            json.dumps(command),
-            qos=1
-        )
-        st.error("❌ Commande d'arrêt envoyée")
+        run_command("shutdown", "Commande d'arrêt")
 
 with col_cmd3:
     st.markdown("*Statistiques*")
-    st.metric("Messages envoyés", len(st.session_state.data_history))
+    live_count()
     if st.button("🗑 Effacer l'historique", use_container_width=True):
-        st.session_state.data_history.clear()
-        st.session_state.last_payload = None
+        # Seule la vue de cette session est effacée, pas l'historique partagé
+        st.session_state.history_start[device] = history.total
         st.info("🧹 Historique effacé")
 
-# ==== REFRESH AUTO ====
-time.sleep(2)  # Attendre 2 secondes avant le prochain refresh
-st.rerun()
\ No newline at end of file
+# ==== DÉPLOIEMENTS ====
+# Commandes de groupe ou filtrées : acks reçus par rapport aux appareils visés,
+# mis à jour en direct (relances comprises)
+with st.expander("📡 Déploiements", expanded=bool(service.commands.rollouts())):
+    live_rollouts()
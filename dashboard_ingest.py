@@ -0,0 +1,219 @@
+"""
+Ingestion MQTT du dashboard
+Un seul service d'ingestion par processus serveur Streamlit : une connexion
+au broker, un décodage par message et un historique partagé que toutes les
+sessions (onglets du navigateur) lisent avec leur propre curseur.
+Chaque message est aussi routé, d'après l'appareil de son topic, vers
+l'entrée de cet appareil dans le registre (état courant, historique récent).
+Les alertes publiées par l'analyse en flux de l'abonné (sensors/+/alert)
+sont simplement gardées pour affichage, sans recalcul.
+
+Séparé de dashboard.py pour pouvoir être réutilisé (et mesuré par
+benchmark.py) sans lancer Streamlit.
+
+Métriques (metrics.py) : messages reçus, taille de l'historique partagé,
+histogrammes du temps de décodage et de la latence horodatage du capteur →
+historique, lus par le serveur de métriques du processus Streamlit.
+
+Les doublons (redistribution QoS 1, vidage de la file d'envoi d'un capteur)
+sont écartés d'après les numéros de séquence avant l'historique : les
+graphiques n'affichent pas deux fois le même échantillon. Les deltas des
+capteurs en envoi sur changement (deadband.py) sont complétés avec le dernier
+état connu de l'appareil : les graphiques restent continus.
+"""
+import json
+import threading
+import time
+from collections import deque
+from datetime import datetime
+import metrics
+import transport
+import telemetry_codec
+import commands
+import topics
+from deadband import StateReconstructor
+from device_registry import DeviceRegistry
+from ring_buffer import ColumnarRingBuffer
+from rollups import RollupEngine
+from sequence_tracker import SequenceTracker
+
+TOPIC_TELEMETRY = topics.DATA_WILDCARD  # tous les appareils
+CLIENT_ID = "streamlit_dashboard"
+
+# Taille de l'historique partagé
+MAX_POINTS = 100_000
+# Alertes récentes conservées
+ALERT_HISTORY = 200
+METRICS_PORT = 9103  # http://127.0.0.1:9103/metrics (0 = désactivé)
+
+DECODE_SECONDS = metrics.REGISTRY.histogram(
+    "iot_dashboard_decode_seconds", "Temps de décodage d'un message par le dashboard")
+LATENCY_SECONDS = metrics.REGISTRY.histogram(
+    "iot_dashboard_latency_seconds", "Latence horodatage du capteur -> historique du dashboard, par échantillon")
+ONE_WAY_SECONDS = metrics.REGISTRY.histogram(
+    "iot_dashboard_one_way_latency_seconds", "Latence aller simple envoi du message -> dashboard, par message")
+
+
+class IngestService:
+    """Connexion MQTT et historique partagés par toutes les sessions"""
+
+    def __init__(self, capacity=MAX_POINTS, client=None):
+        self.history = ColumnarRingBuffer(capacity)
+        self.registry = DeviceRegistry()
+        # Agrégats 1 s / 1 min / 1 h pour les zooms longs
+        self.rollups = RollupEngine()
+        self.last_payload = None
+        self.connection_status = "Déconnecté"
+        self.acks = commands.AckTracker()
+        # Commandes de flotte (groupe, filtre) ; client fixé par start()
+        self.commands = commands.CommandService(client, self.registry, self.acks)
+        self.alerts = deque(maxlen=ALERT_HISTORY)
+        self.alert_count = 0
+        self.sequences = SequenceTracker()
+        self.duplicates = 0
+        # Dernier état de chaque appareil : les deltas deviennent des lignes complètes
+        self.states = StateReconstructor()
+        self.client = client
+
+        self.messages = 0
+        self.decode_errors = 0
+        self.invalid = 0  # échantillons sans appareil ou horodatage
+        self.connections = 0
+        prom = metrics.REGISTRY
+        prom.counter("iot_dashboard_received_total", "Messages de télémétrie reçus", fn=lambda: self.messages)
+        prom.counter("iot_dashboard_samples_total", "Échantillons ajoutés à l'historique",
+                     fn=lambda: self.history.total)
+        prom.counter("iot_dashboard_decode_errors_total", "Messages indécodables", fn=lambda: self.decode_errors)
+        prom.counter("iot_dashboard_invalid_total", "Échantillons sans device_id ou timestamp",
+                     fn=lambda: self.invalid)
+        prom.counter("iot_dashboard_reconnects_total", "Reconnexions au broker",
+                     fn=lambda: max(0, self.connections - 1))
+        prom.counter("iot_dashboard_alerts_total", "Alertes reçues", fn=lambda: self.alert_count)
+        prom.counter("iot_dashboard_duplicates_total", "Échantillons écartés (doublons, hors fenêtre)",
+                     fn=lambda: self.duplicates)
+        prom.gauge("iot_dashboard_delivery_ratio", "Échantillons distincts reçus / attendus",
+                   fn=lambda: self.sequences.totals()["delivery_ratio"] or 0.0)
+        prom.counter("iot_dashboard_deltas_total", "Deltas complétés avec le dernier état connu",
+                     fn=lambda: self.states.deltas)
+        prom.gauge("iot_dashboard_history_rows", "Lignes dans l'historique partagé", fn=lambda: len(self.history))
+        prom.gauge("iot_dashboard_devices", "Appareils connus", fn=lambda: len(self.registry))
+
+    # ==== CALLBACKS MQTT (thread réseau) ====
+    def on_connect(self, client, userdata, flags, rc):
+        """Callback appelé lors de la connexion"""
+        if rc == 0:
+            self.connections += 1
+            print(f"[{datetime.now()}] ✓ Connecté au broker, abonnement à {TOPIC_TELEMETRY}")
+            client.subscribe(TOPIC_TELEMETRY)
+            client.subscribe(topics.ACK_WILDCARD)
+            client.subscribe(topics.ALERT_WILDCARD)
+            client.subscribe(topics.PRESENCE_WILDCARD)
+            self.connection_status = "Connecté"
+        else:
+            print(f"❌ Erreur de connexion MQTT: {rc}")
+            self.connection_status = f"Erreur: code {rc}"
+
+    def on_disconnect(self, client, userdata, rc):
+        """Callback appelé lors de la déconnexion"""
+        self.connection_status = "Déconnecté"
+        print(f"[{datetime.now()}] ⚠️  Déconnecté du broker")
+
+    def on_message(self, client, userdata, msg):
+        """Décode le message une seule fois et l'ajoute à l'historique partagé"""
+        self.messages += 1
+        decode_start = time.perf_counter()
+        try:
+            # Un message peut contenir un lot : une ligne par échantillon
+            records = telemetry_codec.decode_records(msg.payload)
+        except Exception as e:
+            self.decode_errors += 1
+            print(f"❌ Erreur de décodage : {e}")
+            return
+        DECODE_SECONDS.observe(time.perf_counter() - decode_start)
+        now = time.time()
+        if records and records[0].get("sent_at") is not None:
+            ONE_WAY_SECONDS.observe(now - records[0]["sent_at"])
+        identified = [payload for payload in records
+                      if payload.get("device_id") is not None and payload.get("timestamp") is not None]
+        self.invalid += len(records) - len(identified)
+        fresh = [payload for payload in identified if self.sequences.accept(payload)]
+        self.duplicates += len(identified) - len(fresh)
+        # Deltas complétés ; ceux qui précèdent le premier échantillon complet sont écartés
+        fresh = [full for full in map(self.states.apply, fresh) if full is not None]
+        if not fresh:
+            return
+        records = fresh
+        for payload in records:
+            self.history.append(payload)
+            self.rollups.add(payload)
+            LATENCY_SECONDS.observe(now - payload["timestamp"])
+        self.last_payload = records[-1]
+        self.registry.update(topics.device_id(msg.topic) or records[0]["device_id"], records)
+
+    def on_presence(self, client, userdata, msg):
+        """Groupes et état annoncés par un appareil (message retenu)"""
+        if not msg.payload:
+            return  # présence effacée
+        try:
+            presence = json.loads(msg.payload)
+        except Exception as e:
+            print(f"❌ Présence illisible : {e}")
+            return
+        self.registry.set_presence(topics.device_id(msg.topic), presence.get("groups", ()),
+                                   presence.get("online", True))
+
+    def on_alert(self, client, userdata, msg):
+        """Garde une alerte publiée par l'abonné (la plus récente en tête)"""
+        try:
+            alert = json.loads(msg.payload)
+        except Exception as e:
+            print(f"❌ Alerte illisible : {e}")
+            return
+        self.alerts.appendleft(alert)
+        self.alert_count += 1
+
+    # ==== CONNEXION (UNE SEULE FOIS PAR PROCESSUS) ====
+    def start(self):
+        """Ouvre la connexion MQTT partagée"""
+        if self.client is None:
+            # Broker de config.py (authentification + TLS) ou bus en mémoire
+            self.client = transport.create_client(CLIENT_ID)
+
+        self.client.on_connect = self.on_connect
+        self.client.on_disconnect = self.on_disconnect
+        self.client.on_message = self.on_message
+        self.commands.client = self.client
+        self.client.message_callback_add(topics.ACK_WILDCARD, self.commands.on_message)
+        self.client.message_callback_add(topics.ALERT_WILDCARD, self.on_alert)
+        self.client.message_callback_add(topics.PRESENCE_WILDCARD, self.on_presence)
+
+        try:
+            transport.connect(self.client)
+            self.client.loop_start()  # thread MQTT en arrière-plan
+            print(f"[{datetime.now()}] 🚀 Client MQTT partagé démarré")
+        except Exception as e:
+            self.connection_status = f"Erreur: {e}"
+            print(f"❌ Erreur connexion MQTT: {e}")
+        return self
+
+    # ==== REJEU D'UNE CAPTURE (SANS BROKER) ====
+    def replay(self, path, speed=1.0):
+        """Alimente le service depuis une capture mqtt_capture.py, dans un thread"""
+        import mqtt_capture
+
+        def run():
+            reader = mqtt_capture.CaptureReader(path)
+            routes = [(topics.DATA_WILDCARD, self.on_message), (topics.ALERT_WILDCARD, self.on_alert)]
+            count, elapsed = mqtt_capture.replay(reader, routes, speed)
+            reader.close()
+            self.connection_status = f"Rejeu terminé ({count} messages)"
+            print(f"[{datetime.now()}] ▶️  Rejeu terminé : {count} messages en {elapsed:.1f} s")
+
+        self.connection_status = f"Rejeu de {path} ({speed:g}×)"
+        threading.Thread(target=run, daemon=True).start()
+        return self
+
+    # ==== LECTURE PAR LES SESSIONS ====
+    def read_since(self, cursor):
+        """Lignes arrivées depuis le curseur d'une session ; retourne (lignes, curseur)"""
+        return self.history.since(cursor)
@@ -0,0 +1,200 @@
+"""
+Envoi sur changement (report by exception) : bandes mortes et deltas
+
+Côté capteur, un échantillon n'est envoyé que si une mesure a bougé de plus
+que sa bande morte (DEADBANDS) depuis la dernière valeur *envoyée* : une
+dérive lente finit donc toujours par être transmise. L'échantillon envoyé
+est un delta qui ne contient que les champs changés (plus device_id,
+timestamp, seq, sent_at) et porte le marqueur "delta": true (en binaire,
+format v3 dont le masque de présence n'est pas complet). Toutes les
+HEARTBEAT secondes, un échantillon complet est envoyé même sans changement : il sert de point de départ aux
+récepteurs qui arrivent en cours de route et prouve que l'appareil vit.
+
+Un delta porte la nouvelle valeur des champs changés, pas une différence
+arithmétique : un message perdu ne fausse pas l'état reconstruit, le champ
+reste seulement à sa valeur précédente jusqu'au changement suivant.
+
+Côté récepteur, StateReconstructor complète chaque delta avec le dernier
+état connu de l'appareil : les sinks, l'historique et les graphes reçoivent
+des échantillons complets. Un échantillon sans marqueur delta est transmis
+tel quel, même s'il lui manque un champ (la validation en décide) ; il met
+seulement à jour l'état connu. device_id et timestamp doivent avoir été
+vérifiés avant l'appel. Les champs recopiés sont listés dans "held"
+(l'analyse d'anomalies les ignore : une valeur tenue n'est pas une mesure
+répétée). Un delta reçu avant tout état complet est écarté (compteur
+awaiting) jusqu'au prochain échantillon complet.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+# Champs de mesure soumis aux bandes mortes, dans l'ordre du format binaire
+FIELDS = ("temperature", "humidity", "status", "battery", "signal_strength")
+# Bandes mortes par défaut (status : tout changement est envoyé)
+DEADBANDS = {
+    "temperature": 0.5,      # °C
+    "humidity": 2.0,         # %
+    "battery": 1,            # %
+    "signal_strength": 3,    # dBm
+}
+HEARTBEAT = 60.0  # secondes max entre deux échantillons complets
+DELTA = "delta"   # marqueur d'un échantillon qui ne porte que les champs changés
+
+
+def parse_deadbands(text):
+    """ "temperature=0.2,battery=2" -> bandes mortes (les champs absents gardent leur défaut)"""
+    deadbands = dict(DEADBANDS)
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        field, _, value = item.partition("=")
+        field = field.strip()
+        if field not in DEADBANDS:
+            raise ValueError(f"Champ sans bande morte: {field} (choix : {', '.join(DEADBANDS)})")
+        deadbands[field] = float(value)
+    return deadbands
+
+
+class DeadbandFilter:
+    """Filtre d'un capteur : échantillon complet, delta des champs changés, ou rien"""
+
+    def __init__(self, deadbands=DEADBANDS, heartbeat=HEARTBEAT):
+        self.deadbands = dict(deadbands)
+        self.heartbeat = heartbeat
+        self.last = {}  # dernières valeurs envoyées
+        self.last_full = None
+
+        self.full = 0
+        self.deltas = 0
+        self.suppressed = 0
+        self.fields_sent = 0
+
+    def _changed(self, field, value):
+        last = self.last.get(field)
+        band = self.deadbands.get(field)
+        if last is None or not band:
+            return value != last
+        return abs(value - last) >= band
+
+    def filter(self, telemetry, now=None):
+        """Retourne l'échantillon à envoyer (complet ou delta), ou None s'il est supprimé"""
+        now = time.monotonic() if now is None else now
+        if self.last_full is None or now - self.last_full >= self.heartbeat:
+            self.last_full = now
+            self.last = {field: telemetry[field] for field in FIELDS}
+            self.full += 1
+            self.fields_sent += len(FIELDS)
+            return telemetry
+
+        changed = [field for field in FIELDS if self._changed(field, telemetry[field])]
+        if not changed:
+            self.suppressed += 1
+            return None
+        report = {key: value for key, value in telemetry.items() if key not in FIELDS}
+        report[DELTA] = True
+        for field in changed:
+            report[field] = self.last[field] = telemetry[field]
+        self.deltas += 1
+        self.fields_sent += len(changed)
+        return report
+
+    def stats(self):
+        """Échantillons complets, deltas, supprimés et champs envoyés"""
+        total = self.full + self.deltas + self.suppressed
+        sent = self.full + self.deltas
+        return {
+            "samples": total,
+            "full": self.full,
+            "deltas": self.deltas,
+            "suppressed": self.suppressed,
+            "suppressed_ratio": self.suppressed / total if total else None,
+            "fields_per_sample": self.fields_sent / sent if sent else None,
+        }
+
+    def summary(self):
+        """Ligne de résumé pour l'affichage périodique"""
+        s = self.stats()
+        if not s["samples"]:
+            return "📉 Bande morte : aucun échantillon"
+        return (f"📉 Bande morte : {s['samples']} échantillons, {s['suppressed_ratio']:.0%} non envoyés | "
+                f"{s['full']} complets, {s['deltas']} deltas | "
+                f"{s['fields_per_sample']:.1f} champs/échantillon envoyé")
+
+
+class FleetDeadband(DeadbandFilter):
+    """Bandes mortes de toute une flotte : un élément de tableau par appareil, filtrage vectorisé"""
+
+    def __init__(self, size, deadbands=DEADBANDS, heartbeat=HEARTBEAT):
+        super().__init__(deadbands, heartbeat)
+        # Dernières valeurs envoyées (NaN : rien envoyé) ; status en code numérique
+        self.last = {field: np.full(size, np.nan) for field in FIELDS}
+        self.last_full = np.full(size, -np.inf)
+
+    def select(self, indices, values, now):
+        """
+        values : champ -> tableau des nouvelles valeurs des appareils `indices`.
+        Retourne (masque des appareils à publier, champ -> masque des champs à inclure).
+        """
+        full = now - self.last_full[indices] >= self.heartbeat
+        include = {}
+        for field in FIELDS:
+            last = self.last[field][indices]
+            band = self.deadbands.get(field) or 0
+            delta = np.abs(values[field] - last)
+            # NaN (jamais envoyé) : comparaison fausse, d'où le isnan
+            changed = np.isnan(last) | (delta >= band if band else delta > 0)
+            include[field] = full | changed
+        send = np.logical_or.reduce([include[field] for field in FIELDS])
+
+        for field in FIELDS:
+            mask = include[field]
+            self.last[field][indices[mask]] = values[field][mask]
+        self.last_full[indices[full]] = now
+
+        n_full, n_sent = int(full.sum()), int(send.sum())
+        self.full += n_full
+        self.deltas += n_sent - n_full
+        self.suppressed += len(indices) - n_sent
+        self.fields_sent += int(sum(include[field].sum() for field in FIELDS))
+        return send, include
+
+
+class StateReconstructor:
+    """Dernier état connu de chaque appareil ; complète les deltas (thread-safe)"""
+
+    def __init__(self):
+        self.devices = {}  # device_id -> {champ: (valeur, timestamp)}
+        self.lock = threading.Lock()
+        self.deltas = 0    # échantillons complétés
+        self.awaiting = 0  # deltas écartés faute d'état complet
+
+    def apply(self, record):
+        """
+        Échantillon à traiter pour `record` : lui-même s'il n'est pas un delta, le
+        delta complété sinon, ou None pour un delta arrivé avant tout état de départ
+        """
+        timestamp = record["timestamp"]
+        with self.lock:
+            state = self.devices.get(record["device_id"])
+            if state is None:
+                state = self.devices[record["device_id"]] = {}
+            # Un échantillon réordonné en route (accepté en retard par le suivi de
+            # séquence) n'écrase pas la valeur plus récente déjà connue
+            for field in FIELDS:
+                if field in record:
+                    current = state.get(field)
+                    if current is None or current[1] <= timestamp:
+                        state[field] = (record[field], timestamp)
+            if not record.get(DELTA):
+                return record
+            missing = [field for field in FIELDS if field not in record]
+            if any(field not in state for field in missing):
+                self.awaiting += 1
+                return None
+            full = dict(record)
+            del full[DELTA]
+            for field in missing:
+                full[field] = state[field][0]
+            self.deltas += 1
+        full["held"] = tuple(missing)
+        return full
@@ -0,0 +1,101 @@
+"""
+Registre des appareils : état courant et historique borné par appareil
+
+Les messages sont routés par l'identifiant lu dans le topic
+(sensors/<device_id>/data) : une recherche dans un dictionnaire, O(1),
+sans inspecter le payload. L'entrée d'un appareil est créée à son premier
+message ; son historique est un ColumnarRingBuffer de DEVICE_HISTORY lignes.
+
+Les messages de présence (sensors/<device_id>/presence, retenus) donnent les
+groupes de l'appareil et son état en ligne : ils servent à cibler les
+commandes par groupe (commands.CommandService).
+"""
+
+import threading
+import time
+
+import topics
+from ring_buffer import ColumnarRingBuffer
+
+# Lignes d'historique conservées par appareil (~18 octets par ligne)
+DEVICE_HISTORY = 500
+
+
+class DeviceState:
+    """Dernier état connu et historique récent d'un appareil"""
+
+    def __init__(self, device_id, history_size=DEVICE_HISTORY):
+        self.device_id = device_id
+        self.history = ColumnarRingBuffer(history_size)
+        self.last_payload = None
+        self.last_seen = None  # heure de réception (epoch) du dernier message
+        self.messages = 0
+        # Présence annoncée par l'appareil (None : jamais annoncée)
+        self.groups = ()
+        self.online = None
+
+    def update(self, records):
+        """Ajoute les échantillons d'un message (un lot possible)"""
+        for record in records:
+            self.history.append(record)
+        self.last_payload = records[-1]
+        self.last_seen = time.time()
+        self.messages += 1
+
+
+class DeviceRegistry:
+    """Entrées par appareil, indexées par device_id"""
+
+    def __init__(self, history_size=DEVICE_HISTORY):
+        self.history_size = history_size
+        self.devices = {}
+        # Protège uniquement la création d'entrées ; la lecture est sans verrou
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.devices)
+
+    def __contains__(self, device_id):
+        return device_id in self.devices
+
+    def get(self, device_id):
+        """Entrée d'un appareil (None s'il n'a encore rien publié)"""
+        return self.devices.get(device_id)
+
+    def entry(self, device_id):
+        """Entrée d'un appareil, créée si nécessaire"""
+        state = self.devices.get(device_id)
+        if state is None:
+            with self.lock:
+                state = self.devices.get(device_id)
+                if state is None:
+                    state = self.devices[device_id] = DeviceState(device_id, self.history_size)
+        return state
+
+    def update(self, device_id, records):
+        """Route les échantillons d'un message vers l'entrée de son appareil"""
+        if records:
+            self.entry(device_id).update(records)
+
+    def ids(self):
+        """Identifiants des appareils connus, triés"""
+        return sorted(self.devices)
+
+    # ==== PRÉSENCE ET GROUPES ====
+    def set_presence(self, device_id, groups, online):
+        """Enregistre les groupes et l'état annoncés par un appareil"""
+        state = self.entry(device_id)
+        state.groups = tuple(groups)
+        state.online = online
+
+    def groups(self):
+        """Groupes annoncés par les appareils, triés (avec le groupe de tous les appareils)"""
+        names = {topics.ALL_GROUP}
+        for state in list(self.devices.values()):
+            names.update(state.groups)
+        return sorted(names)
+
+    def members(self, group):
+        """Appareils d'un groupe, sauf ceux annoncés hors ligne"""
+        return [state.device_id for state in list(self.devices.values())
+                if state.online is not False and (group == topics.ALL_GROUP or group in state.groups)]
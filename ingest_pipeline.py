@@ -0,0 +1,325 @@
+"""
+Pipeline d'ingestion de l'abonné
+
+    réception (thread réseau paho) → hachage du device_id (topic) → file
+    bornée du worker → workers de décodage et validation → sinks (affichage,
+    stockage, agrégats...)
+
+Le callback MQTT se contente de déposer le payload brut dans la file : le
+thread réseau reste libre pour les PUBACK et keepalives. Chaque appareil est
+toujours traité par le même worker (crc32 du device_id modulo le nombre de
+workers, comme subscriber_cluster.py) : ses messages sont traités dans leur
+ordre d'arrivée, ce que supposent le registre, les agrégats, l'analyse
+d'anomalies et le suivi de séquence. Un message sans topic va au premier
+worker. La capacité QUEUE_SIZE est répartie entre les files des workers.
+Quand la file d'un worker est pleine, la politique de débordement décide :
+- "block"       : le thread réseau attend (contre-pression jusqu'au broker)
+- "drop_newest" : le message entrant est abandonné
+- "drop_oldest" : le plus ancien message en attente est abandonné
+
+Un sink est un simple callable qui reçoit un échantillon décodé. Si un
+DeviceRegistry est fourni, les échantillons valides de chaque message y sont
+routés d'après l'appareil du topic (sensors/<device_id>/data).
+
+Métriques (metrics.py) : compteurs et profondeur de file lus au scrape,
+histogrammes du temps de décodage par message et de la latence de bout en
+bout par échantillon (horodatage du capteur → fin des sinks ; suppose des
+horloges synchronisées entre capteur et abonné).
+
+Numéros de séquence (sequence_tracker.py) : les doublons (QoS 1) et les
+échantillons arrivés trop tard sont écartés avant validation et sinks ; les
+trous, pertes et réordonnancements sont comptés par appareil. La latence aller
+simple (sent_at du message → réception) est mesurée une fois par message.
+
+Envoi sur changement (deadband.py) : les deltas (marqueur "delta") sont
+complétés avec le dernier état connu de l'appareil avant validation ;
+validation, sinks et registre reçoivent des échantillons complets. Un
+échantillon sans device_id ou timestamp est rejeté avant le suivi de séquence
+et la reconstruction. Un delta reçu avant le premier
+échantillon complet de l'appareil est écarté (compteur awaiting).
+"""
+
+import itertools
+import queue
+import threading
+import time
+import zlib
+from datetime import datetime
+
+import metrics
+import telemetry_codec
+import topics
+from deadband import StateReconstructor
+from sequence_tracker import SequenceTracker
+
+OVERFLOW_BLOCK = "block"
+OVERFLOW_DROP_NEWEST = "drop_newest"
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_NEWEST, OVERFLOW_DROP_OLDEST)
+
+QUEUE_SIZE = 10_000
+WORKERS = 2
+SUMMARY_INTERVAL = 5.0   # secondes entre deux lignes de résumé
+LATENCY_SAMPLES = 10_000  # latences gardées par intervalle de résumé
+
+IDENTITY_FIELDS = ("device_id", "timestamp")
+REQUIRED_FIELDS = IDENTITY_FIELDS + ("temperature", "humidity")
+# Bornes de plausibilité : en dehors, l'échantillon est rejeté
+VALID_RANGES = {
+    "temperature": (-50.0, 150.0),
+    "humidity": (0.0, 100.0),
+    "battery": (0, 100),
+}
+
+DECODE_SECONDS = metrics.REGISTRY.histogram(
+    "iot_ingest_decode_seconds", "Temps de décodage d'un message par le pipeline")
+LATENCY_SECONDS = metrics.REGISTRY.histogram(
+    "iot_ingest_latency_seconds", "Latence horodatage du capteur -> fin des sinks, par échantillon")
+ONE_WAY_SECONDS = metrics.REGISTRY.histogram(
+    "iot_ingest_one_way_latency_seconds", "Latence aller simple envoi du message -> réception, par message")
+
+
+def shard(device_id, workers):
+    """Worker responsable d'un appareil (stable d'un lancement à l'autre)"""
+    return zlib.crc32(device_id.encode()) % workers
+
+
+def validate_identity(record):
+    """Retourne None si l'échantillon est attribuable (appareil, horodatage), sinon la raison du rejet"""
+    for field in IDENTITY_FIELDS:
+        if record.get(field) is None:
+            return f"champ manquant: {field}"
+    return None
+
+
+def validate(record):
+    """Retourne None si l'échantillon est valide, sinon la raison du rejet"""
+    for field in REQUIRED_FIELDS:
+        if record.get(field) is None:
+            return f"champ manquant: {field}"
+    for field, (low, high) in VALID_RANGES.items():
+        value = record.get(field)
+        if value is not None and not low <= value <= high:
+            return f"{field} hors bornes: {value}"
+    return None
+
+
+def print_record(record, number, content_type):
+    """Affichage détaillé d'un échantillon (un seul print : pas d'entrelacement)"""
+    print(
+        f"\n{'='*70}\n"
+        f"📨 Message #{number} reçu à {datetime.now()}\n"
+        f"{'='*70}\n"
+        f"🆔 Device ID:    {record.get('device_id')}\n"
+        f"🌡️  Température:  {record.get('temperature')}°C\n"
+        f"💧 Humidité:     {record.get('humidity')}%\n"
+        f"🔋 Batterie:     {record.get('battery')}%\n"
+        f"📡 Signal:       {record.get('signal_strength')} dBm\n"
+        f"⚡ Statut:       {record.get('status')}\n"
+        f"🕐 Timestamp:    {datetime.fromtimestamp(record['timestamp'])}\n"
+        f"📦 Format:       {content_type}\n"
+        f"{'='*70}"
+    )
+
+
+class IngestPipeline:
+    """File bornée + workers de décodage + sinks enfichables"""
+
+    def __init__(self, sinks=(), workers=WORKERS, queue_size=QUEUE_SIZE,
+                 overflow=OVERFLOW_DROP_NEWEST, quiet=False, registry=None,
+                 summary_interval=SUMMARY_INTERVAL, sequences=None, states=None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Politique de débordement inconnue: {overflow}")
+        self.sinks = list(sinks)
+        self.registry = registry
+        # Fenêtres de séquence par appareil (doublons, pertes, réordonnancements)
+        self.sequences = sequences if sequences is not None else SequenceTracker()
+        # Dernier état de chaque appareil, pour compléter les deltas
+        self.states = states if states is not None else StateReconstructor()
+        self.overflow = overflow
+        self.quiet = quiet
+        # Résumé périodique en mode silencieux (None : pas de résumé, ex. cluster)
+        self.summary_interval = summary_interval
+        # Une file par worker : les messages d'un appareil restent dans l'ordre
+        self.queues = [queue.Queue(maxsize=max(1, queue_size // workers)) for _ in range(workers)]
+        self.workers = [
+            threading.Thread(target=self._work, args=(inbox,), daemon=True, name=f"ingest-{i}")
+            for i, inbox in enumerate(self.queues)
+        ]
+        self.numbers = itertools.count(1)
+
+        # received/dropped : thread réseau seul ; les autres : workers (verrou)
+        self.stats_lock = threading.Lock()
+        self.received = 0
+        self.dropped = 0
+        self.decode_errors = 0
+        self.invalid = 0
+        self.duplicates = 0  # doublons et retards hors fenêtre écartés
+        self.processed = 0
+        self.cpu_time = 0.0  # temps CPU cumulé des workers arrêtés
+        # Latence réception → fin des sinks, sur l'intervalle courant
+        self.latencies = []
+
+        self.stopping = threading.Event()
+        self.summary_thread = threading.Thread(target=self._summarize, daemon=True)
+
+        # Compteurs déjà tenus ci-dessus : lus au scrape, sans coût par message
+        prom = metrics.REGISTRY
+        prom.counter("iot_ingest_received_total", "Messages reçus", fn=lambda: self.received)
+        prom.counter("iot_ingest_dropped_total", "Messages perdus (file pleine)", fn=lambda: self.dropped)
+        prom.counter("iot_ingest_decode_errors_total", "Messages indécodables", fn=lambda: self.decode_errors)
+        prom.counter("iot_ingest_invalid_total", "Échantillons rejetés", fn=lambda: self.invalid)
+        prom.counter("iot_ingest_processed_total", "Échantillons traités", fn=lambda: self.processed)
+        prom.counter("iot_ingest_duplicates_total", "Échantillons écartés (doublons, hors fenêtre)",
+                     fn=lambda: self.duplicates)
+        for name, help in (("gaps", "Trous de séquence"), ("lost", "Échantillons perdus (jamais arrivés)"),
+                           ("reordered", "Échantillons arrivés dans le désordre")):
+            prom.counter(f"iot_ingest_sequence_{name}_total", help,
+                         fn=lambda name=name: self.sequences.totals()[name])
+        prom.gauge("iot_ingest_delivery_ratio", "Échantillons distincts reçus / attendus",
+                   fn=lambda: self.sequences.totals()["delivery_ratio"] or 0.0)
+        prom.counter("iot_ingest_deltas_total", "Deltas complétés avec le dernier état connu",
+                     fn=lambda: self.states.deltas)
+        prom.counter("iot_ingest_awaiting_snapshot_total", "Deltas écartés faute d'échantillon complet",
+                     fn=lambda: self.states.awaiting)
+        prom.gauge("iot_ingest_queue_depth", "Messages en attente de décodage", fn=self.queue_depth)
+
+    # ==== RÉCEPTION (thread réseau) ====
+    def submit(self, payload, topic=None):
+        """Dépose un payload brut dans la file selon la politique de débordement"""
+        self.received += 1
+        item = (payload, topic, time.perf_counter())
+        inbox = self.queues[0]
+        if topic is not None and len(self.queues) > 1:
+            inbox = self.queues[shard(topics.device_id(topic) or "", len(self.queues))]
+        if self.overflow == OVERFLOW_BLOCK:
+            inbox.put(item)
+            return
+        while True:
+            try:
+                inbox.put_nowait(item)
+                return
+            except queue.Full:
+                self.dropped += 1
+                if self.overflow == OVERFLOW_DROP_NEWEST:
+                    return
+                try:
+                    inbox.get_nowait()  # drop_oldest : libérer une place
+                except queue.Empty:
+                    pass
+
+    # ==== WORKERS ====
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+        if self.quiet and self.summary_interval:
+            self.summary_thread.start()
+        return self
+
+    def stop(self):
+        """Traite les messages en attente puis arrête les workers"""
+        for inbox in self.queues:
+            inbox.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.stopping.set()
+
+    def queue_depth(self):
+        """Messages en attente, toutes files confondues"""
+        return sum(inbox.qsize() for inbox in self.queues)
+
+    def _work(self, inbox):
+        start_cpu = time.thread_time()
+        while True:
+            item = inbox.get()
+            if item is None:
+                with self.stats_lock:
+                    self.cpu_time += time.thread_time() - start_cpu
+                return
+            payload, topic, received_at = item
+            decode_start = time.perf_counter()
+            try:
+                records = telemetry_codec.decode_records(payload)
+                DECODE_SECONDS.observe(time.perf_counter() - decode_start)
+            except Exception as e:
+                with self.stats_lock:
+                    self.decode_errors += 1
+                if not self.quiet:
+                    print(f"❌ Erreur décodage: {e}")
+                continue
+            sent_at = records[0].get("sent_at") if records else None
+            if sent_at is not None:
+                # Heure de réception murale (received_at est un perf_counter)
+                ONE_WAY_SECONDS.observe(time.time() - (time.perf_counter() - received_at) - sent_at)
+
+            content_type = telemetry_codec.content_type(payload)
+            processed = invalid = duplicates = 0
+            valid = []
+            for k, record in enumerate(records, 1):
+                # Suivi de séquence et reconstruction exigent un appareil et un horodatage
+                reason = validate_identity(record)
+                if reason is None:
+                    if not self.sequences.accept(record):
+                        duplicates += 1
+                        continue
+                    record = self.states.apply(record)
+                    if record is None:
+                        continue  # delta sans état de départ : attendre un échantillon complet
+                    reason = validate(record)
+                if reason is not None:
+                    invalid += 1
+                    if not self.quiet:
+                        print(f"⚠️  Échantillon rejeté ({record.get('device_id')}): {reason}")
+                    continue
+                if not self.quiet:
+                    print_record(record, next(self.numbers), f"{content_type} ({k}/{len(records)})")
+                for sink in self.sinks:
+                    try:
+                        sink(record)
+                    except Exception as e:
+                        print(f"❌ Erreur sink {getattr(sink, '__qualname__', sink)}: {e}")
+                valid.append(record)
+                processed += 1
+            if self.registry is not None and valid:
+                device_id = (topic and topics.device_id(topic)) or valid[0]["device_id"]
+                self.registry.update(device_id, valid)
+            now = time.time()
+            for record in valid:
+                LATENCY_SECONDS.observe(now - record["timestamp"])
+            with self.stats_lock:
+                self.processed += processed
+                self.invalid += invalid
+                self.duplicates += duplicates
+                if len(self.latencies) < LATENCY_SAMPLES:
+                    self.latencies.append(time.perf_counter() - received_at)
+
+    # ==== RÉSUMÉ PÉRIODIQUE (mode silencieux) ====
+    def latency_percentiles(self):
+        """p50 et p99 (ms) des latences depuis le dernier appel ; None si aucune"""
+        with self.stats_lock:
+            latencies, self.latencies = sorted(self.latencies), []
+        if not latencies:
+            return None
+        p50 = latencies[len(latencies) // 2] * 1000
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+        return p50, p99
+
+    def summary(self, elapsed, processed):
+        """Ligne de résumé : débit, file, pertes, latence"""
+        percentiles = self.latency_percentiles()
+        if percentiles:
+            latency = "latence p50 {:.2f} ms p99 {:.2f} ms".format(*percentiles)
+        else:
+            latency = "latence —"
+        return (f"[{datetime.now():%H:%M:%S}] 📊 {processed / elapsed:,.0f} éch/s | "
+                f"file {self.queue_depth()}/{sum(inbox.maxsize for inbox in self.queues)} | "
+                f"perdus {self.dropped} | erreurs {self.decode_errors} | "
+                f"rejetés {self.invalid} | doublons {self.duplicates} | "
+                f"deltas {self.states.deltas} | {self.sequences.summary()} | {latency}")
+
+    def _summarize(self):
+        last_time, last_processed = time.monotonic(), 0
+        while not self.stopping.wait(self.summary_interval):
+            now, processed = time.monotonic(), self.processed
+            print(self.summary(now - last_time, processed - last_processed))
+            last_time, last_processed = now, processed
@@ -0,0 +1,102 @@
+"""
+Chaîne complète dans un seul processus, sur le bus en mémoire
+
+    flotte de capteurs → abonné (pipeline, alertes) + ingestion du dashboard
+
+Sans broker, réseau ni TLS : les mesures ne contiennent que le coût du
+code du projet. Pratique pour profiler (py-spy, cProfile) et pour les tests
+à plein débit.
+
+    python local_stack.py --fleet 2000 --interval 0.1 --duration 30
+    python local_stack.py --deadband       # envoi sur changement (deadband.py)
+    python local_stack.py --metrics-port 0 # sans serveur de métriques
+
+Les métriques des trois composants sont servies ensemble sur un seul port
+(METRICS_PORT par défaut, comme le capteur).
+"""
+
+import argparse
+import threading
+import time
+from datetime import datetime
+
+import config
+import deadband
+import transport
+import telemetry_codec
+from virtual_sensor import (VirtualFleet, FLEET_CONNECTIONS, FLEET_STATUSES, METRICS_PORT, PAYLOAD_FORMAT,
+                            fleet_interval)
+from mqtt_subscriber import IoTSubscriber
+from dashboard_ingest import IngestService
+
+
+def run(fleet_size, interval, duration, connections=FLEET_CONNECTIONS, payload_format=PAYLOAD_FORMAT,
+        deadbands=None, metrics_port=METRICS_PORT):
+    """Fait tourner capteurs, abonné et ingestion du dashboard pendant `duration` secondes"""
+    # Tous les clients créés ensuite passent par le bus en mémoire
+    config.TRANSPORT = transport.TRANSPORT_MEMORY
+
+    subscriber = IoTSubscriber(quiet=True)
+    subscriber.pipeline.start()
+    transport.connect(subscriber.client)
+    subscriber.client.loop_start()
+
+    service = IngestService().start()
+
+    fleet = VirtualFleet(fleet_size, connections, payload_format=payload_format, deadbands=deadbands)
+    interval = fleet_interval(interval)  # pas plus vite que la boucle de la flotte
+    fleet.intervals[:] = interval
+    fleet.next_due = time.monotonic() + fleet.rng.uniform(0, interval, fleet_size)
+    fleet_thread = threading.Thread(target=fleet.run, args=(metrics_port,), daemon=True)
+    fleet_thread.start()
+
+    start = time.monotonic()
+    try:
+        time.sleep(duration)
+    except KeyboardInterrupt:
+        print(f"\n[{datetime.now()}] Arrêt demandé par l'utilisateur")
+    elapsed = time.monotonic() - start
+
+    # Éteindre la flotte : sa boucle s'arrête quand tous les appareils sont offline
+    fleet.status[:] = FLEET_STATUSES.index("offline")
+    fleet_thread.join()
+    subscriber.client.loop_stop()
+    subscriber.pipeline.stop()
+    service.client.loop_stop()
+
+    print("="*70)
+    print(f"⏱  {elapsed:.1f} s, {fleet_size} capteurs toutes les {interval}s ({payload_format})")
+    print(f"📤 Publiés :            {fleet.published} ({fleet.published / elapsed:,.0f} msg/s)")
+    print(f"📨 Abonné :             {subscriber.pipeline.processed} traités, "
+          f"{subscriber.pipeline.dropped} perdus, {subscriber.detector.alerts} alertes, "
+          f"{len(subscriber.registry)} appareils")
+    print(f"🔢 Séquences :          {subscriber.pipeline.sequences.summary()}, "
+          f"{subscriber.pipeline.duplicates} doublons écartés")
+    if fleet.deadband is not None:
+        states = subscriber.pipeline.states
+        print(fleet.deadband.summary())
+        print(f"🧩 Reconstruction :     {states.deltas} deltas complétés, "
+              f"{states.awaiting} en attente d'un échantillon complet")
+    print(f"📊 Ingestion dashboard : {service.history.total} échantillons, "
+          f"{len(service.registry)} appareils, {service.alert_count} alertes")
+    print("="*70)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Capteurs, abonné et dashboard dans un seul processus")
+    parser.add_argument("--fleet", type=int, default=1000, help="Nombre de capteurs simulés")
+    parser.add_argument("--interval", type=float, default=1.0,
+                        help="Intervalle d'envoi de chaque capteur (secondes, 0.1 min)")
+    parser.add_argument("--duration", type=float, default=30, help="Durée de la mesure (secondes)")
+    parser.add_argument("--connections", type=int, default=FLEET_CONNECTIONS,
+                        help="Clients du bus utilisés par la flotte")
+    parser.add_argument("--format", choices=telemetry_codec.FORMATS, default=PAYLOAD_FORMAT,
+                        help="Format des messages de télémétrie")
+    parser.add_argument("--deadband", nargs="?", const="", default=None, metavar="CHAMP=BANDE,...",
+                        help="Envoi sur changement avec ces bandes mortes (seul : valeurs par défaut)")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT,
+                        help="Port HTTP des métriques Prometheus (0 = désactivé)")
+    args = parser.parse_args()
+
+    deadbands = deadband.parse_deadbands(args.deadband) if args.deadband is not None else None
+    run(args.fleet, args.interval, args.duration, args.connections, args.format, deadbands, args.metrics_port)
@@ -0,0 +1,206 @@
+"""
+Métriques internes exposées au format texte Prometheus
+
+    curl http://127.0.0.1:9102/metrics
+
+Chaque processus (capteur, abonné, dashboard...) a un registre REGISTRY et
+peut servir ses métriques par un petit serveur HTTP local (serve()).
+
+Coût sur le chemin chaud borné et constant par message :
+- Counter.inc()       : une addition sous verrou ;
+- Histogram.observe() : une recherche dichotomique dans des seaux fixes
+                        + une addition sous verrou ;
+- compteurs et jauges « lus » (fn=...) : aucun coût par message, la valeur
+  est lue sur l'objet instrumenté au moment du scrape (tailles de file,
+  compteurs déjà tenus par le pipeline, RSS...).
+"""
+
+import bisect
+import os
+import sys
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import config
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Seaux par défaut (secondes) : de 50 µs à 10 s
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Compteur monotone (ou lu sur l'objet instrumenté si fn est fourni)"""
+
+    kind = "counter"
+
+    def __init__(self, name, help, fn=None):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self):
+        yield self.name, self.fn() if self.fn is not None else self.value
+
+
+class Gauge(Counter):
+    """Valeur instantanée (set() ou lue par fn au moment du scrape)"""
+
+    kind = "gauge"
+
+    def set(self, value):
+        self.value = value
+
+
+class Histogram:
+    """Histogramme à seaux fixes (cumulés à l'affichage, comme Prometheus)"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # dernier seau : +Inf
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def samples(self):
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            yield f'{self.name}_bucket{{le="{_format(bound)}"}}', cumulative
+        yield f"{self.name}_sum", total
+        yield f"{self.name}_count", cumulative
+
+
+class Registry:
+    """Ensemble des métriques d'un processus"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get(self, cls, name, *args, **kwargs):
+        """Retourne la métrique existante de ce nom, ou la crée"""
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, *args, **kwargs)
+            elif type(metric) is not cls:
+                raise ValueError(f"Métrique {name} déjà déclarée comme {metric.kind}")
+            return metric
+
+    def counter(self, name, help, fn=None):
+        metric = self._get(Counter, name, help)
+        if fn is not None:
+            metric.fn = fn  # dernier objet instrumenté (ex. nouveau pipeline)
+        return metric
+
+    def gauge(self, name, help, fn=None):
+        metric = self._get(Gauge, name, help)
+        if fn is not None:
+            metric.fn = fn
+        return metric
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help, buckets)
+
+    def render(self):
+        """Texte d'exposition Prometheus de toutes les métriques"""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            try:
+                for name, value in metric.samples():
+                    lines.append(f"{name} {_format(value)}")
+            except Exception as e:
+                lines.append(f"# erreur de lecture: {e}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+# ==== MÉTRIQUES DU PROCESSUS ====
+def peak_rss_bytes():
+    """RSS maximal du processus (octets) ; None si indisponible (Windows)"""
+    try:
+        import resource  # Unix seulement
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss : octets sous macOS, kilo-octets sous Linux
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def rss_bytes():
+    """RSS courant du processus (octets), à défaut le RSS maximal ; None si indisponible"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, AttributeError, ValueError):
+        return peak_rss_bytes()
+
+
+if rss_bytes() is not None:
+    REGISTRY.gauge("process_resident_memory_bytes", "Mémoire résidente du processus", fn=rss_bytes)
+REGISTRY.gauge("process_threads", "Threads actifs du processus", fn=threading.active_count)
+
+
+# ==== SERVEUR HTTP ====
+def serve(port, registry=REGISTRY, host=None):
+    """Sert /metrics dans un thread ; port 0 = désactivé. Retourne le serveur (ou None)"""
+    if not port:
+        return None
+    host = host or config.METRICS_HOST
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # pas de ligne par scrape
+
+    try:
+        server = ThreadingHTTPServer((host, port), Handler)
+    except OSError as e:
+        # Port déjà pris (deux capteurs sur la même machine...) : on continue sans
+        print(f"[{datetime.now()}] ⚠️  Métriques indisponibles sur {host}:{port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics-http").start()
+    print(f"[{datetime.now()}] 📈 Métriques sur http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,253 @@
+"""
+Enregistrement et rejeu du trafic MQTT
+
+Format de capture (little-endian) :
+    en-tête    : FILE_MAGIC (8 octets)
+    message    : heure de réception (float64), longueur du topic (uint16),
+                 longueur du payload (uint32), topic, payload brut
+
+Un index creux <capture>.idx contient une entrée (numéro, heure, position)
+tous les INDEX_EVERY messages : on peut démarrer un rejeu à un instant donné
+sans parcourir toute la capture.
+
+Le rejeu lit la capture via mmap : seules les pages parcourues sont chargées,
+une capture de plusieurs Go ne passe jamais entièrement en mémoire. Les
+messages sont livrés aux callbacks on_message de l'abonné ou du service
+d'ingestion du dashboard, à la vitesse d'origine (1×), accélérée (N×) ou
+maximale (0).
+"""
+
+import argparse
+import bisect
+import mmap
+import os
+import struct
+import threading
+import time
+from datetime import datetime
+
+import paho.mqtt.client as mqtt  # type: ignore
+import transport
+import topics
+
+FILE_MAGIC = b"MQCAP\x00\x01\n"
+RECORD = struct.Struct("<dHI")       # reçu à, len(topic), len(payload)
+INDEX_ENTRY = struct.Struct("<QdQ")  # numéro du message, reçu à, position
+INDEX_EVERY = 1000
+WRITE_BUFFER = 1 << 20               # octets bufferisés avant écriture disque
+CLIENT_ID = "mqtt_capture"
+
+
+def index_path(path):
+    return path + ".idx"
+
+
+class CaptureWriter:
+    """Ajoute les messages reçus à un fichier de capture (thread-safe)"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "wb", buffering=WRITE_BUFFER)
+        self.index = open(index_path(path), "wb")
+        self.file.write(FILE_MAGIC)
+        self.position = len(FILE_MAGIC)
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def write(self, topic, payload, received_at=None):
+        """Ajoute un message brut"""
+        if received_at is None:
+            received_at = time.time()
+        topic = topic.encode() if isinstance(topic, str) else topic
+        payload = payload.encode() if isinstance(payload, str) else payload
+        header = RECORD.pack(received_at, len(topic), len(payload))
+        with self.lock:
+            if self.count % INDEX_EVERY == 0:
+                self.index.write(INDEX_ENTRY.pack(self.count, received_at, self.position))
+            self.file.write(header)
+            self.file.write(topic)
+            self.file.write(payload)
+            self.position += len(header) + len(topic) + len(payload)
+            self.count += 1
+
+    def on_message(self, client, userdata, msg):
+        """Callback MQTT : enregistre le message tel quel"""
+        self.write(msg.topic, msg.payload)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+            self.index.close()
+
+
+class CaptureMessage:
+    """Message rejoué, avec les attributs utilisés des messages paho"""
+
+    __slots__ = ("topic", "payload", "timestamp", "qos", "retain")
+
+    def __init__(self, topic, payload, timestamp):
+        self.topic = topic
+        self.payload = payload
+        self.timestamp = timestamp
+        self.qos = 1
+        self.retain = False
+
+
+class CaptureReader:
+    """Lecture d'une capture par mmap"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        if size < len(FILE_MAGIC):
+            raise ValueError(f"Capture vide ou tronquée: {path}")
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(FILE_MAGIC)] != FILE_MAGIC:
+            raise ValueError(f"Pas un fichier de capture: {path}")
+
+        # Index creux : (numéro, heure, position) ; absent = lecture depuis le début
+        self.index = []
+        if os.path.exists(index_path(path)):
+            with open(index_path(path), "rb") as f:
+                data = f.read()
+            usable = len(data) - len(data) % INDEX_ENTRY.size
+            self.index = list(INDEX_ENTRY.iter_unpack(data[:usable]))
+        self.index_times = [entry[1] for entry in self.index]
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
+
+    def messages(self, position=len(FILE_MAGIC)):
+        """Itère sur les messages à partir d'une position (octets)"""
+        mm, end = self.mm, len(self.mm)
+        while position + RECORD.size <= end:
+            received_at, topic_len, payload_len = RECORD.unpack_from(mm, position)
+            start = position + RECORD.size
+            stop = start + topic_len + payload_len
+            if stop > end:
+                break  # dernier message incomplet (capture interrompue)
+            topic = mm[start:start + topic_len].decode()
+            yield CaptureMessage(topic, mm[start + topic_len:stop], received_at)
+            position = stop
+
+    def position_at(self, timestamp):
+        """Position du point d'index le plus proche avant `timestamp`"""
+        k = bisect.bisect_right(self.index_times, timestamp) - 1
+        return self.index[k][2] if k >= 0 else len(FILE_MAGIC)
+
+    def first_timestamp(self):
+        for message in self.messages():
+            return message.timestamp
+        return None
+
+
+def replay(reader, routes, speed=1.0, start=None, limit=None):
+    """
+    Livre les messages d'une capture aux callbacks de `routes`
+    (liste de (abonnement, callback(client, userdata, msg))).
+    speed : 1 = temps réel, N = N fois plus vite, 0 = aussi vite que possible.
+    start : heure (epoch) du premier message à rejouer.
+    Retourne (messages livrés, durée en secondes).
+    """
+    position = reader.position_at(start) if start is not None else len(FILE_MAGIC)
+    count = 0
+    wall_start = time.perf_counter()
+    capture_start = None
+    for message in reader.messages(position):
+        if start is not None and message.timestamp < start:
+            continue
+        if limit is not None and count >= limit:
+            break
+        if speed:
+            if capture_start is None:
+                capture_start = message.timestamp
+            delay = (message.timestamp - capture_start) / speed - (time.perf_counter() - wall_start)
+            if delay > 0:
+                time.sleep(delay)
+        for subscription, callback in routes:
+            if mqtt.topic_matches_sub(subscription, message.topic):
+                callback(None, None, message)
+                break
+        count += 1
+    return count, time.perf_counter() - wall_start
+
+
+# ==== COMMANDES ====
+def record(path, subscription):
+    """Enregistre le trafic du broker jusqu'à Ctrl+C"""
+    writer = CaptureWriter(path)
+    client = transport.create_client(CLIENT_ID)
+    client.on_connect = lambda c, userdata, flags, rc: c.subscribe(subscription)
+    client.on_message = writer.on_message
+    transport.connect(client)
+    client.loop_start()
+    print(f"[{datetime.now()}] 🔴 Enregistrement de {subscription} dans {path} (Ctrl+C pour arrêter)")
+    try:
+        while True:
+            time.sleep(5)
+            print(f"[{datetime.now()}] {writer.count} messages, {writer.position / 1e6:.1f} Mo")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.loop_stop()
+        client.disconnect()
+        writer.close()
+        print(f"💾 {writer.count} messages enregistrés dans {path}")
+
+
+def replay_into(path, target, speed, start_offset=None, limit=None):
+    """Rejoue une capture dans l'abonné ou dans l'ingestion du dashboard"""
+    reader = CaptureReader(path)
+    start = None
+    if start_offset:
+        start = reader.first_timestamp() + start_offset
+
+    if target == "subscriber":
+        import ingest_pipeline
+        from mqtt_subscriber import IoTSubscriber
+        # Contre-pression plutôt que pertes : le rejeu est reproductible
+        subscriber = IoTSubscriber(quiet=True, overflow=ingest_pipeline.OVERFLOW_BLOCK)
+        routes = [(topics.DATA_WILDCARD, subscriber.on_message)]
+        subscriber.pipeline.start()
+        count, elapsed = replay(reader, routes, speed, start, limit)
+        subscriber.pipeline.stop()
+        result = (f"{subscriber.pipeline.processed} échantillons traités, "
+                  f"{subscriber.pipeline.dropped} perdus, {subscriber.detector.alerts} alertes, "
+                  f"{len(subscriber.registry)} appareils")
+    else:
+        from dashboard_ingest import IngestService
+        service = IngestService()
+        routes = [(topics.DATA_WILDCARD, service.on_message), (topics.ALERT_WILDCARD, service.on_alert)]
+        count, elapsed = replay(reader, routes, speed, start, limit)
+        result = (f"{service.history.total} échantillons dans l'historique, "
+                  f"{len(service.registry)} appareils, {service.alert_count} alertes")
+
+    reader.close()
+    rate = count / elapsed if elapsed else 0.0
+    print(f"▶️  {count} messages rejoués en {elapsed:.2f} s ({rate:,.0f} msg/s) : {result}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Enregistrement et rejeu du trafic MQTT")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    rec = sub.add_parser("record", help="Enregistre le trafic reçu du broker")
+    rec.add_argument("path")
+    rec.add_argument("--topic", default=f"{topics.PREFIX}/#", help="Abonnement MQTT à enregistrer")
+
+    rep = sub.add_parser("replay", help="Rejoue une capture hors ligne")
+    rep.add_argument("path")
+    rep.add_argument("--into", choices=("subscriber", "dashboard"), default="subscriber")
+    rep.add_argument("--speed", type=float, default=1.0,
+                     help="1 = temps réel, 10 = 10× plus vite, 0 = vitesse maximale")
+    rep.add_argument("--start", type=float, default=None,
+                     help="Démarre N secondes après le début de la capture")
+    rep.add_argument("--limit", type=int, default=None, help="Nombre max de messages rejoués")
+
+    args = parser.parse_args()
+    if args.command == "record":
+        record(args.path, args.topic)
+    else:
+        replay_into(args.path, args.into, args.speed, args.start, args.limit)
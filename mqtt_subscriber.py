@@ -3,109 +3,252 @@ MQTT Subscriber - Reçoit et affiche les messages du capteur
 Simule le rôle d'AWS IoT Core pour la réception de données
 """
 
+import argparse
 import json
 from datetime import datetime
-import paho.mqtt.client as mqtt  # type: ignore
+import transport
+import commands
+import metrics
+import topics
+import ingest_pipeline
+from anomaly import AnomalyDetector
+from device_registry import DeviceRegistry
+from ingest_pipeline import IngestPipeline
+from mqtt_capture import CaptureWriter
+from telemetry_store import TelemetryStore
 
-# Configuration HiveMQ Cloud (doit correspondre au capteur)
-MQTT_BROKER = "7be661ae342e41e28bb30488c56a0cfe.s1.eu.hivemq.cloud"
-MQTT_PORT = 8883
-MQTT_USERNAME = "sensor_user"
-MQTT_PASSWORD = "bY.5Gdir4iSrwWy"
-TOPIC_TELEMETRY = "sensors/temperature/data"
-TOPIC_COMMAND = "sensors/temperature/command"
+METRICS_PORT = 9102  # http://127.0.0.1:9102/metrics (0 = désactivé)
 
 
 class IoTSubscriber:
     """Simule le cloud IoT qui reçoit les données"""
     
-    def __init__(self):
-        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, client_id="iot_cloud_simulator")
-        
-        # Configuration pour HiveMQ Cloud (authentification + TLS)
-        self.client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
-        self.client.tls_set()  # Active TLS/SSL
+    def __init__(self, store=None, quiet=False, workers=ingest_pipeline.WORKERS,
+                 queue_size=ingest_pipeline.QUEUE_SIZE,
+                 overflow=ingest_pipeline.OVERFLOW_DROP_NEWEST, recorder=None):
+        # Broker de config.py (authentification + TLS) ou bus en mémoire
+        self.client = transport.create_client("iot_cloud_simulator")
         
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
-        self.message_count = 0
+
+        # Acks des commandes envoyées (topic dédié, callback séparé)
+        self.acks = commands.AckTracker()
+
+        # Stockage persistant optionnel (TelemetryStore)
+        self.store = store
+        # Capture brute du trafic reçu, pour rejeu (CaptureWriter)
+        self.recorder = recorder
+        # État et historique récent de chaque appareil (routage par topic)
+        self.registry = DeviceRegistry()
+        # Cible des commandes de la boucle interactive : un appareil, @groupe ou ?filtre
+        self.target = topics.DEFAULT_DEVICE_ID
+        # Commandes de flotte (groupes, filtres) : relances et suivi des acks
+        self.commands = commands.CommandService(self.client, self.registry, self.acks)
+        self.client.message_callback_add(topics.ACK_WILDCARD, self.commands.on_message)
+        self.client.message_callback_add(topics.PRESENCE_WILDCARD, self.on_presence)
+
+        # Analyse en flux : alertes publiées sur sensors/<device_id>/alert
+        self.detector = AnomalyDetector(on_alert=self.publish_alert)
+
+        # Réception → file bornée → workers → sinks
+        sinks = [self.detector]
+        if store is not None:
+            sinks.append(store.write)
+        self.pipeline = IngestPipeline(
+            sinks, workers=workers, queue_size=queue_size, overflow=overflow, quiet=quiet,
+            registry=self.registry
+        )
+
+        # Connexions réussies (la première n'est pas une reconnexion)
+        self.connections = 0
+        prom = metrics.REGISTRY
+        prom.counter("iot_subscriber_reconnects_total", "Reconnexions au broker",
+                     fn=lambda: max(0, self.connections - 1))
+        prom.counter("iot_subscriber_alerts_total", "Alertes publiées", fn=lambda: self.detector.alerts)
+        prom.gauge("iot_subscriber_devices", "Appareils connus", fn=lambda: len(self.registry))
+
+    @property
+    def message_count(self):
+        """Nombre d'échantillons traités par le pipeline"""
+        return self.pipeline.processed
         
     def on_connect(self, client, userdata, flags, rc):
         """Callback de connexion"""
         if rc == 0:
+            self.connections += 1
             print(f"[{datetime.now()}] ✓ Connecté au broker MQTT")
-            print(f"[{datetime.now()}] ✓ En écoute sur: {TOPIC_TELEMETRY}")
-            client.subscribe(TOPIC_TELEMETRY)
+            print(f"[{datetime.now()}] ✓ En écoute sur: {topics.DATA_WILDCARD}")
+            client.subscribe(topics.DATA_WILDCARD)
+            client.subscribe(topics.ACK_WILDCARD)
+            client.subscribe(topics.PRESENCE_WILDCARD)
         else:
             print(f"[{datetime.now()}] ❌ Échec connexion: Code {rc}")
     
     def on_message(self, client, userdata, message):
-        """Callback de réception de message"""
-        self.message_count += 1
-        
+        """Callback de réception : dépose le payload brut dans le pipeline"""
+        if self.recorder is not None:
+            self.recorder.write(message.topic, message.payload)
+        self.pipeline.submit(message.payload, message.topic)
+    
+    def on_presence(self, client, userdata, message):
+        """Groupes et état annoncés par un appareil (message retenu)"""
+        if not message.payload:
+            return  # présence effacée
         try:
-            payload = json.loads(message.payload.decode('utf-8'))
-            
-            print(f"\n{'='*70}")
-            print(f"📨 Message #{self.message_count} reçu à {datetime.now()}")
-            print(f"{'='*70}")
-            print(f"🆔 Device ID:    {payload.get('device_id')}")
-            print(f"🌡️  Température:  {payload.get('temperature')}°C")
-            print(f"💧 Humidité:     {payload.get('humidity')}%")
-            print(f"🔋 Batterie:     {payload.get('battery')}%")
-            print(f"📡 Signal:       {payload.get('signal_strength')} dBm")
-            print(f"⚡ Statut:       {payload.get('status')}")
-            print(f"🕐 Timestamp:    {payload.get('timestamp')}")
-            print(f"{'='*70}")
-            
+            presence = json.loads(message.payload)
         except Exception as e:
-            print(f"❌ Erreur décodage: {e}")
-    
-    def send_command(self, action, value=None):
-        """Envoie une commande au capteur"""
-        command = {"action": action}
-        if value is not None:
-            command["value"] = value
-        
-        message = json.dumps(command)
-        self.client.publish(TOPIC_COMMAND, message)
-        print(f"\n🚀 Commande envoyée: {command}")
+            print(f"❌ Présence illisible: {e}")
+            return
+        self.registry.set_presence(topics.device_id(message.topic), presence.get("groups", ()),
+                                   presence.get("online", True))
+
+    def publish_alert(self, alert):
+        """Publie une alerte (appelé depuis un worker du pipeline)"""
+        self.client.publish(topics.alert_topic(alert["device_id"]), json.dumps(alert), qos=1)
+        print(f"[{datetime.now()}] 🚨 {alert['device_id']}: {alert['type']} "
+              f"{alert['metric']}={alert['value']} ({alert['detail']})")
+
+    def send_command(self, action, value=None, device_id=None, **params):
+        """Envoie une commande à un appareil (la cible courante par défaut) ; retourne son identifiant"""
+        device_id = device_id or self.target
+        command = commands.new_command(action, value, **params)
+        commands.publish_command(self.client, command, device_id, tracker=self.acks)
+        print(f"\n🚀 Commande envoyée à {device_id}: {command}")
+        return command["id"]
+
+    def send_rollout(self, action, value=None, **params):
+        """Envoie une commande au groupe (@groupe) ou à la sélection (?filtre) visé ; retourne le déploiement"""
+        if self.target.startswith("@"):
+            rollout = self.commands.send(action, value, group=self.target[1:], **params)
+        else:
+            rollout = self.commands.send(action, value, where=commands.parse_predicate(self.target[1:]), **params)
+        print(f"\n🚀 Commande {action} envoyée à {rollout.target} ({len(rollout.device_ids)} appareils)")
+        return rollout
+
+    def wait_rollout(self, rollout):
+        """Affiche l'avancement d'un déploiement jusqu'à sa fin"""
+        while not self.commands.wait(rollout, 1.0):
+            print(f"⏳ {rollout.summary()}")
+        print(f"✓ {rollout.summary()}")
+
+    def run_command(self, action, value=None, **params):
+        """Commande de la boucle interactive vers la cible courante, puis attente des acks"""
+        if self.target[:1] in ("@", "?"):
+            self.wait_rollout(self.send_rollout(action, value, **params))
+        else:
+            self.wait_ack(self.send_command(action, value, **params))
+
+    def wait_ack(self, command_id, timeout=commands.ACK_TIMEOUT):
+        """Attend l'ack d'une commande et affiche sa latence"""
+        ack = self.acks.wait(command_id, timeout)
+        if ack is None:
+            print(f"⚠️  Pas d'ack après {timeout}s")
+        else:
+            print(f"✓ Ack {ack['status']} de {ack['device_id']}: "
+                  f"aller-retour {ack['round_trip_ms']} ms (appareil {ack['latency_ms']} ms)")
+        return ack
     
-    def run(self):
+    def list_devices(self):
+        """Affiche le dernier état connu de chaque appareil"""
+        if not len(self.registry):
+            print("Aucun appareil reçu pour l'instant")
+        for device_id in self.registry.ids():
+            state = self.registry.get(device_id)
+            p = state.last_payload
+            groups = f"  [{', '.join(state.groups)}]" if state.groups else ""
+            if p is None:
+                print(f"  {device_id:<24} {'hors ligne' if state.online is False else 'en ligne'}, "
+                      f"aucune donnée{groups}")
+                continue
+            seq = self.pipeline.sequences.device_stats(device_id)
+            delivery = ""
+            if seq is not None:
+                delivery = f", livraison {seq['delivery_ratio']:.1%}, doublons {seq['duplicates']}"
+            print(f"  {device_id:<24} {p.get('temperature')}°C  {p.get('humidity')}%  "
+                  f"{p.get('status')}  ({state.messages} messages{delivery}, "
+                  f"vu à {datetime.fromtimestamp(state.last_seen):%H:%M:%S}){groups}")
+
+    def run(self, metrics_port=METRICS_PORT):
         """Démarre la réception de messages"""
         try:
             print("="*70)
             print("☁️  CLOUD IoT SIMULATOR - Réception des messages")
             print("="*70)
-            print(f"\nBroker: {MQTT_BROKER}:{MQTT_PORT}")
-            print(f"Topic:  {TOPIC_TELEMETRY}")
+            print(f"\nBroker: {transport.describe()}")
+            print(f"Topic:  {topics.DATA_WILDCARD}")
+            if self.store is not None:
+                print(f"Stockage: {self.store.path}")
+            if self.recorder is not None:
+                print(f"Capture: {self.recorder.path}")
             print("\nCommandes disponibles (tapez pendant l'exécution):")
             print("  i10 - Changer intervalle à 10 secondes")
             print("  i5  - Changer intervalle à 5 secondes")
+            print("  i0.01 - Échantillonner à 100 Hz")
+            print("  b20 - Envoyer les échantillons par lots de 20")
             print("  r   - Redémarrer le capteur")
             print("  s   - Arrêter le capteur")
+            print("  l   - Lister les appareils connus")
+            print(f"  d<id> - Choisir l'appareil visé par les commandes (actuel: {self.target})")
+            print("  g<groupe> - Viser un groupe (ex: gall, gzone-3)")
+            print("  f<filtre> - Viser les appareils dont le dernier échantillon vérifie le filtre (ex: fbattery<90)")
             print("  q   - Quitter\n")
             print("="*70)
             
-            self.client.connect(MQTT_BROKER, MQTT_PORT, 60)
+            metrics.serve(metrics_port)
+            self.pipeline.start()
+            transport.connect(self.client)
             self.client.loop_start()
             
             # Boucle interactive
             while True:
-                cmd = input("\n> ").strip().lower()
+                raw = input(f"\n[{self.target}]> ").strip()
+                cmd = raw.lower()
                 
                 if cmd.startswith('i'):
                     try:
-                        interval = int(cmd[1:])
-                        self.send_command("set_interval", interval)
+                        interval = float(cmd[1:])
+                        self.run_command("set_interval", interval)
+                    except:
+                        print("❌ Format: i<secondes> (ex: i10, i0.5)")
+                        
+                elif cmd.startswith('b'):
+                    try:
+                        size = int(cmd[1:])
+                        self.run_command("set_batch", size=size)
                     except:
-                        print("❌ Format: i<nombre> (ex: i10)")
+                        print("❌ Format: b<taille> (ex: b20)")
                         
                 elif cmd == 'r':
-                    self.send_command("reboot")
+                    self.run_command("reboot")
                     
                 elif cmd == 's':
-                    self.send_command("shutdown")
+                    self.run_command("shutdown")
+
+                elif cmd == 'l':
+                    self.list_devices()
+
+                elif cmd.startswith('d') and len(raw) > 1:
+                    self.target = raw[1:].strip()
+                    if self.target not in self.registry:
+                        print(f"⚠️  {self.target} n'a encore rien publié")
+                    print(f"🎯 Commandes envoyées à {self.target}")
+
+                elif cmd.startswith('g') and len(raw) > 1:
+                    group = raw[1:].strip()
+                    members = self.registry.members(group)
+                    print(f"🎯 Commandes envoyées au groupe {group} ({len(members)} appareils en ligne)")
+                    self.target = f"@{group}"
+
+                elif cmd.startswith('f') and len(raw) > 1:
+                    try:
+                        predicate = commands.parse_predicate(raw[1:])
+                    except ValueError as e:
+                        print(f"❌ {e}")
+                        continue
+                    matches = self.commands.resolve(where=predicate)
+                    print(f"🎯 Commandes envoyées aux appareils où {predicate.text} ({len(matches)} actuellement)")
+                    self.target = f"?{predicate.text}"
                     
                 elif cmd == 'q':
                     print("👋 Au revoir!")
@@ -121,13 +264,48 @@ class IoTSubscriber:
             print("\n💡 SOLUTION: Vérifiez que Mosquitto est démarré")
             print("   Windows: net start mosquitto")
             print("   Linux: sudo systemctl start mosquitto")
-            print("   Ou utilisez un broker public dans le code:")
-            print("   MQTT_BROKER = 'test.mosquitto.org'")
+            print("   Ou choisissez un autre broker (voir config.py):")
+            print("   IOT_MQTT_BROKER=test.mosquitto.org IOT_MQTT_PORT=1883 IOT_MQTT_TLS=0")
         finally:
             self.client.loop_stop()
             self.client.disconnect()
+            self.pipeline.stop()
+            print(f"📨 {self.pipeline.processed} échantillons traités, "
+                  f"{self.pipeline.dropped} perdus (file pleine), "
+                  f"{self.pipeline.duplicates} doublons écartés, "
+                  f"{self.detector.alerts} alertes")
+            print(f"🔢 {self.pipeline.sequences.summary()}")
+            if self.recorder is not None:
+                self.recorder.close()
+                print(f"💾 {self.recorder.count} messages capturés dans {self.recorder.path}")
+            if self.store is not None:
+                self.store.close()
+                print(f"🗄  {self.store.rows_written} échantillons enregistrés "
+                      f"en {self.store.commits} transactions")
 
 
 if __name__ == "__main__":
-    subscriber = IoTSubscriber()
-    subscriber.run()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Abonné MQTT (simulateur cloud IoT)")
+    parser.add_argument("--store", metavar="FICHIER",
+                        help="Enregistre la télémétrie dans une base SQLite (ex: telemetry.db)")
+    parser.add_argument("--record", metavar="FICHIER",
+                        help="Capture les messages bruts reçus pour les rejouer (mqtt_capture.py replay)")
+    parser.add_argument("--quiet", action="store_true",
+                        help="Remplace l'affichage par message par un résumé périodique")
+    parser.add_argument("--workers", type=int, default=ingest_pipeline.WORKERS,
+                        help="Threads de décodage/validation")
+    parser.add_argument("--queue-size", type=int, default=ingest_pipeline.QUEUE_SIZE,
+                        help="Taille de la file entre réception et décodage")
+    parser.add_argument("--overflow", choices=ingest_pipeline.OVERFLOW_POLICIES,
+                        default=ingest_pipeline.OVERFLOW_DROP_NEWEST,
+                        help="Politique quand la file est pleine")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT,
+                        help="Port HTTP des métriques Prometheus (0 = désactivé)")
+    args = parser.parse_args()
+
+    store = TelemetryStore(args.store).start() if args.store else None
+    recorder = CaptureWriter(args.record) if args.record else None
+    subscriber = IoTSubscriber(store=store, quiet=args.quiet, workers=args.workers,
+                               queue_size=args.queue_size, overflow=args.overflow,
+                               recorder=recorder)
+    subscriber.run(args.metrics_port)
\ No newline at end of file
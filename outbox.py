@@ -0,0 +1,336 @@
+"""
+File d'envoi du capteur (store-and-forward)
+
+Pendant une coupure, les échantillons ne sont plus abandonnés : ils entrent
+dans une file bornée, d'abord en mémoire puis, au-delà de MEMORY_SAMPLES,
+déversés sur disque au format binaire compact de telemetry_codec (15 ou 19
+octets par échantillon selon la version, moins pour les deltas de l'envoi
+sur changement, + en-tête par lot). À la
+reconnexion, un thread vide la file par lots de DRAIN_BATCH échantillons (un
+message MQTT par lot), à au plus DRAIN_RATE échantillons d'arriéré par seconde
+pour ne pas saturer le broker.
+
+Les échantillons produits connecté pendant le vidage (put(..., live=True),
+passés par la file pour garder l'ordre) ne comptent pas dans ce débit : ils
+sont envoyés en plus, au rythme où ils arrivent. L'arriéré diminue donc
+toujours de DRAIN_RATE échantillons par seconde, quel que soit le débit
+courant de la flotte.
+
+Fichier de débordement (little-endian) : suite d'enregistrements
+    longueur du topic (uint16), longueur du payload (uint32), topic, payload
+Le fichier n'existe que pendant une coupure : il est supprimé une fois vidé.
+S'il est présent au démarrage (arrêt pendant une coupure), son contenu est
+repris et envoyé en premier.
+
+Quand le fichier atteint DISK_LIMIT octets, les nouveaux échantillons sont
+abandonnés (compteur dropped) : les plus anciens restent prioritaires.
+L'ordre des échantillons d'un même topic est conservé ; un appareil dont des
+échantillons sont en attente (has_pending) doit passer par la file tant
+qu'elle n'est pas vidée pour lui.
+"""
+
+import os
+import struct
+import threading
+import time
+from datetime import datetime
+
+import telemetry_codec
+
+OUTBOX_DIR = "outbox"          # répertoire des fichiers de débordement
+MEMORY_SAMPLES = 1000          # échantillons gardés en mémoire avant débordement sur disque
+DISK_LIMIT = 64 * 1024 * 1024  # taille max du fichier de débordement (octets)
+DRAIN_BATCH = 100              # échantillons par message lors du vidage
+DRAIN_RATE = 500.0             # échantillons d'arriéré/s max lors du vidage (0 = sans limite)
+RETRY_DELAY = 1.0              # attente (secondes) après un échec ou hors connexion
+RECORD = struct.Struct("<HI")  # len(topic), len(payload)
+
+
+def default_path(name):
+    """Fichier de débordement d'un capteur ou d'une flotte"""
+    return os.path.join(OUTBOX_DIR, f"{name}.outbox")
+
+
+class Outbox:
+    """File d'envoi bornée : mémoire, puis disque, vidée à débit limité"""
+
+    def __init__(self, path, memory_samples=MEMORY_SAMPLES, disk_limit=DISK_LIMIT,
+                 drain_batch=DRAIN_BATCH, drain_rate=DRAIN_RATE):
+        self.path = path
+        self.memory_samples = memory_samples
+        self.disk_limit = disk_limit
+        self.drain_batch = drain_batch
+        self.drain_rate = drain_rate
+
+        self.memory = {}    # topic -> échantillons les plus récents (ordre d'arrivée)
+        self.memory_count = 0
+        self.pending = {}   # topic -> échantillons en attente (mémoire + disque)
+        self.depth = 0
+        self.in_flight = False  # lot mémoire en cours de publication (hors verrou)
+        # Échantillons courants mis en file pendant le vidage, envoyés hors limite de débit
+        self.live_credit = 0
+        # Fichier ouvert seulement quand la mémoire déborde
+        self.file = None
+        self.read_pos = 0
+        self.write_pos = 0
+        self.disk_samples = 0
+
+        self.max_depth = 0
+        self.spilled_bytes = 0  # octets écrits sur disque depuis le démarrage
+        self.spilled_samples = 0
+        self.drained = 0
+        self.dropped = 0
+        # Vidage en cours : début, échantillons envoyés ; débit du dernier vidage
+        self.drain_started = None
+        self.drain_count = 0
+        self.drain_throughput = None
+
+        # put() (boucle du capteur) et le thread de vidage
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
+
+        if os.path.exists(path):
+            self._open()
+            self._scan()
+
+    # ==== FICHIER DE DÉBORDEMENT ====
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        # a+b : écriture toujours en fin de fichier, lecture à la position voulue
+        self.file = open(self.path, "a+b")
+
+    def _scan(self):
+        """Reprend un fichier laissé par un arrêt pendant une coupure"""
+        size = os.fstat(self.file.fileno()).st_size
+        position = 0
+        self.file.seek(0)
+        while position + RECORD.size <= size:
+            topic_len, payload_len = RECORD.unpack(self.file.read(RECORD.size))
+            stop = position + RECORD.size + topic_len + payload_len
+            if stop > size:
+                break
+            topic = self.file.read(topic_len).decode()
+            count = telemetry_codec.binary_record_count(self.file.read(payload_len))
+            self.pending[topic] = self.pending.get(topic, 0) + count
+            self.disk_samples += count
+            position = stop
+        # Dernier enregistrement incomplet (arrêt brutal pendant l'écriture)
+        if position < size:
+            self.file.truncate(position)
+        self.write_pos = position
+        self.depth = self.max_depth = self.disk_samples
+        if self.depth:
+            print(f"[{datetime.now()}] 💾 Reprise de {self.depth} échantillons en attente ({self.path})")
+
+    def _spill(self):
+        """Écrit le contenu de la mémoire sur disque, par lots de drain_batch"""
+        if self.file is None:
+            self._open()
+        for topic, samples in self.memory.items():
+            raw_topic = topic.encode()
+            for k in range(0, len(samples), self.drain_batch):
+                chunk = samples[k:k + self.drain_batch]
+                payload = telemetry_codec.encode_binary_batch(chunk)
+                size = RECORD.size + len(raw_topic) + len(payload)
+                if self.write_pos + size > self.disk_limit:
+                    self._forget(topic, len(chunk))
+                    self.dropped += len(chunk)
+                    continue
+                self.file.write(RECORD.pack(len(raw_topic), len(payload)) + raw_topic + payload)
+                self.write_pos += size
+                self.disk_samples += len(chunk)
+                self.spilled_bytes += size
+                self.spilled_samples += len(chunk)
+        self.file.flush()
+        self.memory = {}
+        self.memory_count = 0
+
+    def _forget(self, topic, count):
+        """Retire `count` échantillons d'un topic de la file (envoyés ou abandonnés)"""
+        self.depth -= count
+        left = self.pending[topic] - count
+        if left:
+            self.pending[topic] = left
+        else:
+            del self.pending[topic]
+
+    # ==== ENTRÉE (boucle du capteur) ====
+    def put(self, topic, samples, live=False):
+        """
+        Met en file des échantillons à publier plus tard sur `topic`.
+        live : produits connecté, en file seulement derrière l'arriéré de leur topic.
+        """
+        with self.lock:
+            if live:
+                self.live_credit += len(samples)
+            self.memory.setdefault(topic, []).extend(samples)
+            self.memory_count += len(samples)
+            self.pending[topic] = self.pending.get(topic, 0) + len(samples)
+            self.depth += len(samples)
+            self.max_depth = max(self.max_depth, self.depth)
+            if self.memory_count >= self.memory_samples and not self.in_flight:
+                self._spill()
+        self.wakeup.set()
+
+    def has_pending(self, topic):
+        """Vrai si des échantillons de ce topic attendent encore d'être envoyés"""
+        return topic in self.pending
+
+    def wake(self):
+        """Relance le vidage (à appeler à la reconnexion)"""
+        self.wakeup.set()
+
+    # ==== VIDAGE ====
+    def _send_next(self, publish):
+        """
+        Publie le plus ancien lot en attente (disque puis mémoire).
+        Le lot est retiré sous verrou puis publié hors verrou : put() (boucle du
+        capteur) n'attend jamais le réseau. Si publish() échoue, le lot est remis
+        en tête de la file. Tant qu'un lot mémoire est en vol, le débordement sur
+        disque est différé (le lot remis passerait sinon après les suivants).
+        Retourne le nombre d'échantillons envoyés, 0 si la file est vide, None en cas d'échec.
+        """
+        with self.lock:
+            from_disk = self.read_pos < self.write_pos
+            if from_disk:
+                read_pos = self.read_pos
+                self.file.seek(read_pos)
+                topic_len, payload_len = RECORD.unpack(self.file.read(RECORD.size))
+                topic = self.file.read(topic_len).decode()
+                samples = telemetry_codec.decode_binary(self.file.read(payload_len))
+                self.read_pos += RECORD.size + topic_len + payload_len
+            elif self.memory:
+                topic = next(iter(self.memory))
+                queued = self.memory.pop(topic)
+                samples = queued[:self.drain_batch]
+                if len(queued) > len(samples):
+                    self.memory[topic] = queued[len(samples):]
+                self.memory_count -= len(samples)
+                self.in_flight = True
+            else:
+                return 0
+
+        try:
+            sent = publish(topic, samples)
+        except Exception as e:
+            print(f"[{datetime.now()}] ❌ Erreur d'envoi de la file : {e}")
+            sent = False
+
+        with self.lock:
+            self.in_flight = False
+            if not sent:
+                if from_disk:
+                    self.read_pos = read_pos
+                else:
+                    # Remis en tête : avant les échantillons du même topic arrivés entre-temps
+                    self.memory = {topic: samples + self.memory.pop(topic, []), **self.memory}
+                    self.memory_count += len(samples)
+                return None
+            if from_disk:
+                self.disk_samples -= len(samples)
+                if self.read_pos >= self.write_pos:
+                    # Fichier entièrement vidé : on le supprime
+                    self.file.close()
+                    os.remove(self.path)
+                    self.file = None
+                    self.read_pos = self.write_pos = 0
+            if self.memory_count >= self.memory_samples:
+                self._spill()  # débordement différé pendant l'envoi
+
+            self._forget(topic, len(samples))
+            self.drained += len(samples)
+            now = time.monotonic()
+            if self.drain_started is None:
+                self.drain_started, self.drain_count = now, 0
+            self.drain_count += len(samples)
+            if self.depth == 0:
+                self.live_credit = 0
+                elapsed = now - self.drain_started
+                self.drain_throughput = self.drain_count / elapsed if elapsed > 0 else None
+                print(f"[{datetime.now()}] 📤 File d'envoi vidée : {self.drain_count} échantillons "
+                      f"en {elapsed:.1f} s")
+                self.drain_started = None
+            return len(samples)
+
+    def _drain(self, publish, connected):
+        next_send = time.monotonic()
+        while not self.stopping.is_set():
+            if not connected():
+                self.wakeup.wait(RETRY_DELAY)
+                self.wakeup.clear()
+                continue
+            self.wakeup.clear()
+            sent = self._send_next(publish)
+            if sent is None:
+                self.stopping.wait(RETRY_DELAY)
+            elif sent == 0:
+                self.wakeup.wait()
+                next_send = time.monotonic()
+            elif self.drain_rate:
+                # Les échantillons courants passent sans attendre : seul l'arriéré est limité
+                with self.lock:
+                    live = min(sent, self.live_credit)
+                    self.live_credit -= live
+                if sent > live:
+                    # Cadence fixe : au plus drain_rate échantillons d'arriéré par seconde, sans rafale
+                    next_send = max(next_send, time.monotonic()) + (sent - live) / self.drain_rate
+                    self.stopping.wait(max(0.0, next_send - time.monotonic()))
+
+    def start(self, publish, connected):
+        """
+        Démarre le thread de vidage.
+        publish(topic, samples) -> bool : publie un lot, False si l'envoi a échoué.
+        connected() -> bool : la liaison est-elle disponible ?
+        """
+        self.thread = threading.Thread(target=self._drain, args=(publish, connected),
+                                       daemon=True, name="outbox-drain")
+        self.thread.start()
+        return self
+
+    def close(self):
+        """Arrête le vidage et garde sur disque tout ce qui n'a pas été envoyé"""
+        self.stopping.set()
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join()
+        with self.lock:
+            if self.memory:
+                self._spill()
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+                if self.depth:
+                    print(f"[{datetime.now()}] 💾 {self.depth} échantillons conservés dans {self.path}")
+
+    # ==== STATISTIQUES ====
+    def stats(self):
+        """Profondeur, débordement disque et débit de vidage"""
+        with self.lock:
+            throughput = self.drain_throughput
+            if self.drain_started is not None:
+                elapsed = time.monotonic() - self.drain_started
+                throughput = self.drain_count / elapsed if elapsed > 0 else None
+            return {
+                "depth": self.depth,
+                "max_depth": self.max_depth,
+                "memory_samples": self.memory_count,
+                "disk_samples": self.disk_samples,
+                "disk_bytes": self.write_pos - self.read_pos,
+                "spilled_bytes": self.spilled_bytes,
+                "bytes_per_sample": (self.spilled_bytes / self.spilled_samples
+                                     if self.spilled_samples else None),
+                "drained": self.drained,
+                "dropped": self.dropped,
+                "drain_throughput": throughput,
+            }
+
+    def summary(self):
+        """Ligne de résumé pour l'affichage périodique"""
+        s = self.stats()
+        throughput = f"{s['drain_throughput']:,.0f} éch/s" if s["drain_throughput"] else "—"
+        per_sample = f"{s['bytes_per_sample']:.1f} o/éch" if s["bytes_per_sample"] else "—"
+        return (f"📦 File d'envoi : {s['depth']} en attente (max {s['max_depth']}) | "
+                f"disque {s['disk_bytes'] / 1024:.1f} Ko, {s['spilled_bytes'] / 1024:.1f} Ko déversés "
+                f"({per_sample}) | envoyés {s['drained']} ({throughput}) | perdus {s['dropped']}")
@@ -0,0 +1,75 @@
+"""
+Historique circulaire en colonnes pour le dashboard
+
+Chaque métrique est une colonne numpy typée et préallouée : un ajout écrit
+une valeur par colonne à la position courante (O(1), aucune allocation), et
+les plus anciennes valeurs sont écrasées une fois la capacité atteinte.
+
+Le compteur `total` (nombre d'ajouts depuis la création) sert de curseur :
+since(cursor) retourne uniquement les lignes ajoutées depuis ce curseur, ce
+qui permet de mettre les graphes à jour avec les seules nouvelles lignes.
+"""
+
+import threading
+import numpy as np
+
+# Colonnes de l'historique de télémétrie : nom -> type numpy
+TELEMETRY_COLUMNS = {
+    "timestamp": np.float64,   # secondes depuis l'epoch
+    "temperature": np.float32,
+    "humidity": np.float32,
+    "battery": np.int16,
+}
+
+
+class ColumnarRingBuffer:
+    """Buffer circulaire préalloué, une colonne typée par métrique"""
+
+    def __init__(self, capacity, columns=TELEMETRY_COLUMNS):
+        self.capacity = capacity
+        self.columns = {name: np.zeros(capacity, dtype=dtype) for name, dtype in columns.items()}
+        self.total = 0
+        self.start = 0  # indice absolu de la plus ancienne ligne conservée après clear()
+        # Un seul écrivain mais des lecteurs dans d'autres threads
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.total - max(self.start, self.total - self.capacity)
+
+    def append(self, record):
+        """Ajoute une ligne (dictionnaire contenant au moins chaque colonne)"""
+        with self.lock:
+            position = self.total % self.capacity
+            for name, column in self.columns.items():
+                column[position] = record[name]
+            self.total += 1
+
+    def clear(self):
+        """Vide l'historique (le curseur continue d'avancer)"""
+        with self.lock:
+            self.start = self.total
+
+    def _rows(self, start, stop):
+        """Copie les lignes d'indices absolus [start, stop) en ordre chronologique"""
+        start = max(start, self.start, self.total - self.capacity)
+        if start >= stop:
+            return {name: column[:0].copy() for name, column in self.columns.items()}
+        first, last = start % self.capacity, stop % self.capacity
+        if first < last or last == 0:
+            end = last or self.capacity
+            return {name: column[first:end].copy() for name, column in self.columns.items()}
+        # La plage fait le tour du buffer : deux tranches
+        return {
+            name: np.concatenate((column[first:], column[:last]))
+            for name, column in self.columns.items()
+        }
+
+    def since(self, cursor):
+        """Lignes ajoutées depuis `cursor` ; retourne (colonnes, nouveau curseur)"""
+        with self.lock:
+            return self._rows(cursor, self.total), self.total
+
+    def tail(self, n):
+        """Les n dernières lignes, en ordre chronologique"""
+        with self.lock:
+            return self._rows(self.total - n, self.total)
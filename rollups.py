@@ -0,0 +1,152 @@
+"""
+Agrégats multi-résolution et sous-échantillonnage des graphes
+
+RollupEngine maintient, pour chaque résolution (1 s, 1 min, 1 h par défaut),
+un anneau de buckets min/max/somme/nombre par métrique. Un échantillon met à
+jour un bucket par résolution : O(1), sans jamais relire l'historique.
+
+lttb() réduit une série à un nombre fixe de points en conservant sa forme
+(Largest-Triangle-Three-Buckets), pour que chaque niveau de zoom soit
+dessiné avec le même budget de points.
+"""
+
+import threading
+import numpy as np
+
+METRICS = ("temperature", "humidity", "battery")
+# Résolution (secondes) -> nombre de buckets conservés
+RESOLUTIONS = {
+    1: 3600,      # 1 s sur 1 heure
+    60: 1440,     # 1 min sur 24 heures
+    3600: 720,    # 1 h sur 30 jours
+}
+POINT_BUDGET = 1000
+
+
+class Rollup:
+    """Anneau de buckets d'une résolution donnée"""
+
+    def __init__(self, resolution, capacity, metrics=METRICS):
+        self.resolution = resolution
+        self.capacity = capacity
+        self.metrics = metrics
+        # Listes Python : plus rapides que numpy pour des mises à jour scalaires
+        self.bucket = [-1] * capacity
+        self.count = [0] * capacity
+        self.sum = {m: [0.0] * capacity for m in metrics}
+        self.min = {m: [0.0] * capacity for m in metrics}
+        self.max = {m: [0.0] * capacity for m in metrics}
+
+    def add(self, timestamp, record):
+        """Ajoute un échantillon à son bucket (O(1))"""
+        bucket = int(timestamp // self.resolution)
+        slot = bucket % self.capacity
+        current = self.bucket[slot]
+        if current != bucket:
+            if current > bucket:
+                return  # échantillon plus ancien que la fenêtre conservée
+            # Nouveau bucket : on recycle l'emplacement
+            self.bucket[slot] = bucket
+            self.count[slot] = 1
+            for m in self.metrics:
+                value = record[m]
+                self.sum[m][slot] = value
+                self.min[m][slot] = value
+                self.max[m][slot] = value
+            return
+        self.count[slot] += 1
+        for m in self.metrics:
+            value = record[m]
+            self.sum[m][slot] += value
+            if value < self.min[m][slot]:
+                self.min[m][slot] = value
+            elif value > self.max[m][slot]:
+                self.max[m][slot] = value
+
+    def query(self, start, end):
+        """
+        Buckets dont le début est dans [start, end), triés par temps, en colonnes
+        numpy : deux fenêtres adjacentes ne comptent jamais le même bucket
+        """
+        buckets = np.asarray(self.bucket)
+        times = buckets * self.resolution
+        slots = np.flatnonzero((buckets >= 0) & (times >= start) & (times < end))
+        slots = slots[np.argsort(buckets[slots])]
+
+        count = np.asarray(self.count)[slots]
+        rows = {"timestamp": buckets[slots].astype(np.float64) * self.resolution, "count": count}
+        for m in self.metrics:
+            rows[f"{m}_mean"] = np.asarray(self.sum[m])[slots] / count
+            rows[f"{m}_min"] = np.asarray(self.min[m])[slots]
+            rows[f"{m}_max"] = np.asarray(self.max[m])[slots]
+        return rows
+
+
+class RollupEngine:
+    """Agrégats min/max/moyenne/nombre à plusieurs résolutions"""
+
+    def __init__(self, resolutions=RESOLUTIONS, metrics=METRICS):
+        self.rollups = {res: Rollup(res, capacity, metrics) for res, capacity in sorted(resolutions.items())}
+        self.lock = threading.Lock()
+
+    def add(self, record):
+        """Met à jour toutes les résolutions avec un échantillon décodé"""
+        timestamp = record["timestamp"]
+        with self.lock:
+            for rollup in self.rollups.values():
+                rollup.add(timestamp, record)
+
+    def pick_resolution(self, span, budget=POINT_BUDGET):
+        """Résolution la plus fine qui couvre `span` secondes en au plus ~4×budget buckets"""
+        for res, rollup in self.rollups.items():
+            if span / res <= 4 * budget and res * rollup.capacity >= span:
+                return res
+        return max(self.rollups)
+
+    def query(self, start, end, resolution=None, budget=POINT_BUDGET):
+        """Buckets de [start, end) à la résolution donnée (ou choisie automatiquement)"""
+        if resolution is None:
+            resolution = self.pick_resolution(end - start, budget)
+        with self.lock:
+            return resolution, self.rollups[resolution].query(start, end)
+
+
+def lttb(x, y, budget=POINT_BUDGET):
+    """
+    Largest-Triangle-Three-Buckets : indices des `budget` points qui
+    préservent le mieux la forme de la série (x croissant).
+    """
+    n = len(x)
+    if n <= budget or budget < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # Bornes des budget-2 buckets intérieurs (premier et dernier points gardés)
+    edges = np.linspace(1, n - 1, budget - 1).astype(np.int64)
+    selected = np.empty(budget, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+
+    previous = 0
+    for i in range(budget - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # Moyenne du bucket suivant (le dernier point pour le dernier bucket)
+        next_lo, next_hi = hi, edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_lo:next_hi].mean()
+        avg_y = y[next_lo:next_hi].mean()
+        # Point du bucket qui forme le plus grand triangle
+        area = np.abs(
+            (x[previous] - avg_x) * (y[lo:hi] - y[previous])
+            - (x[previous] - x[lo:hi]) * (avg_y - y[previous])
+        )
+        previous = lo + int(np.argmax(area))
+        selected[i + 1] = previous
+    return selected
+
+
+def downsample(rows, column, budget=POINT_BUDGET):
+    """Applique LTTB sur `column` et garde les mêmes lignes dans toutes les colonnes"""
+    if len(rows["timestamp"]) <= budget:
+        return rows
+    keep = lttb(rows["timestamp"], rows[column], budget)
+    return {name: values[keep] for name, values in rows.items()}
@@ -0,0 +1,138 @@
+"""
+Cadenceur d'échantillonnage à échéances fixes
+
+Chaque tick est programmé à partir de l'échéance précédente (et non de la
+fin de la publication) : le temps de publication ne décale plus la cadence.
+Les échéances sont attendues par Event.wait() (pas d'attente active : elle
+garderait le GIL au détriment des threads réseau) ; la cadence reste
+régulière de 1 s jusqu'à 10 ms (100 Hz).
+
+Un changement d'intervalle (commande set_interval) réveille l'attente et
+s'applique au tick suivant, calculé depuis le dernier tick effectué. Les
+statistiques de gigue repartent de zéro pour la nouvelle cadence.
+
+Quand un tick déborde de plus d'un intervalle, les échéances dépassées sont
+comptées comme manquées et sautées : pas de rafale de rattrapage, la phase
+de la cadence est conservée.
+"""
+
+import threading
+import time
+from collections import deque
+
+import metrics
+
+MIN_INTERVAL = 0.01      # 100 Hz
+MAX_INTERVAL = 3600.0
+JITTER_SAMPLES = 1000    # derniers ticks gardés pour la gigue et la fréquence réelle
+
+TICK_LATENESS = metrics.REGISTRY.histogram(
+    "iot_sensor_tick_lateness_seconds", "Retard de chaque tick d'échantillonnage sur son échéance")
+
+
+def clamp_interval(value):
+    """Intervalle accepté par le cadenceur (secondes, float)"""
+    return min(MAX_INTERVAL, max(MIN_INTERVAL, float(value)))
+
+
+class DeadlineScheduler:
+    """Appelle une fonction à intervalle fixe, sans dérive"""
+
+    def __init__(self, interval):
+        self.interval = clamp_interval(interval)
+        self.changed = threading.Event()
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+
+        self.ticks = 0
+        self.missed = 0
+        # (instant, retard sur l'échéance) des derniers ticks, en secondes
+        self.recent = deque(maxlen=JITTER_SAMPLES)
+        self.max_lateness = 0.0
+
+    def set_interval(self, interval):
+        """Nouvel intervalle, appliqué au tick suivant ; retourne la valeur retenue"""
+        self.interval = clamp_interval(interval)
+        self.changed.set()
+        return self.interval
+
+    def stop(self):
+        self.stopping.set()
+        self.changed.set()
+
+    def _wait_until(self, deadline):
+        """Attend l'échéance ; False si l'intervalle a changé ou si l'arrêt est demandé"""
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return True
+            if self.changed.wait(remaining):
+                return False
+
+    def run(self, tick, running=lambda: True):
+        """Appelle tick() à chaque échéance tant que running() est vrai"""
+        last_tick = deadline = time.perf_counter()
+        while running() and not self.stopping.is_set():
+            if not self._wait_until(deadline):
+                self.changed.clear()
+                if self.stopping.is_set():
+                    break
+                # Nouvel intervalle : prochain tick compté depuis le dernier effectué
+                deadline = max(last_tick + self.interval, time.perf_counter())
+                with self.lock:
+                    self.recent.clear()
+                    self.max_lateness = 0.0
+                continue
+
+            now = time.perf_counter()
+            late = now - deadline
+            with self.lock:
+                self.ticks += 1
+                self.recent.append((now, late))
+                self.max_lateness = max(self.max_lateness, late)
+            TICK_LATENESS.observe(late)
+            last_tick = deadline
+            tick()
+
+            deadline += self.interval
+            now = time.perf_counter()
+            if now - deadline > self.interval:
+                # Échéances sautées (publication trop lente, machine chargée) : pas de rafale
+                skipped = int((now - deadline) // self.interval)
+                with self.lock:
+                    self.missed += skipped
+                deadline += skipped * self.interval
+
+    # ==== STATISTIQUES ====
+    def stats(self):
+        """Ticks, échéances manquées, gigue (ms) et fréquence effective des derniers ticks"""
+        with self.lock:
+            recent = list(self.recent)
+            ticks, missed, max_lateness = self.ticks, self.missed, self.max_lateness
+        lateness = sorted(late for _, late in recent)
+        span = recent[-1][0] - recent[0][0] if len(recent) > 1 else 0.0
+        result = {
+            "interval": self.interval,
+            "ticks": ticks,
+            "missed": missed,
+            "rate_hz": (len(recent) - 1) / span if span > 0 else 0.0,
+            "jitter_p50_ms": None,
+            "jitter_p99_ms": None,
+            "jitter_max_ms": max_lateness * 1000,
+        }
+        if lateness:
+            result["jitter_p50_ms"] = lateness[len(lateness) // 2] * 1000
+            result["jitter_p99_ms"] = lateness[min(len(lateness) - 1, int(len(lateness) * 0.99))] * 1000
+        return result
+
+    def summary(self):
+        """Ligne de résumé pour l'affichage périodique"""
+        s = self.stats()
+        if s["jitter_p50_ms"] is None:
+            jitter = "gigue —"
+        else:
+            jitter = (f"gigue p50 {s['jitter_p50_ms']:.2f} ms p99 {s['jitter_p99_ms']:.2f} ms "
+                      f"max {s['jitter_max_ms']:.2f} ms")
+        return (f"⏱  Cadence : {s['interval']:g} s ({1 / s['interval']:.1f} Hz visés, "
+                f"{s['rate_hz']:.1f} Hz réels) | ticks {s['ticks']} | "
+                f"échéances manquées {s['missed']} | {jitter}")
@@ -0,0 +1,173 @@
+"""
+Suivi des numéros de séquence côté réception
+
+Chaque capteur numérote ses échantillons (champ "seq", croissant par
+appareil). Pour chaque appareil, le récepteur garde le plus grand numéro vu
+et un masque de bits des WINDOW numéros précédents (un entier Python) :
+O(1) en mémoire par appareil, quelques opérations entières par échantillon.
+
+Pour chaque échantillon reçu :
+- numéro > plus grand vu + 1    : trou (gap), les numéros manquants
+                                  peuvent encore arriver en retard ;
+- numéro déjà dans le masque    : doublon (QoS 1), à ignorer ;
+- numéro < plus grand vu, absent du masque : réordonné (comble un trou) ;
+- numéro plus ancien que la fenêtre : trop tard, ignoré (doublon ou
+                                  retard, impossible à distinguer).
+Chaque démarrage du capteur repart de 0 et porte un identifiant de démarrage
+("boot", heure de démarrage en secondes) : un nouvel identifiant ouvre une
+nouvelle numérotation (redémarrage), les échantillons d'un démarrage plus
+ancien arrivés après coup sont ignorés. Pour un capteur sans "boot", seul un
+numéro très inférieur au plus grand vu et proche de 0 signale un redémarrage.
+
+Taux de livraison = numéros distincts reçus / numéros attendus (du premier
+au plus grand vu). Les manquants encore dans la fenêtre peuvent arriver ;
+ceux qui en sortent sans être arrivés sont comptés comme perdus.
+
+La latence aller simple (réception - sent_at) suppose des horloges
+synchronisées entre capteur et récepteur (NTP).
+"""
+
+import threading
+
+WINDOW = 1024  # numéros suivis sous le plus grand vu
+WINDOW_MASK = (1 << WINDOW) - 1
+
+
+class DeviceSequence:
+    """État de séquence d'un appareil"""
+
+    __slots__ = ("boot", "first", "highest", "mask", "previous", "received", "duplicates", "reordered",
+                 "gaps", "lost", "late", "restarts")
+
+    def __init__(self, seq, boot=None):
+        self.boot = boot  # identifiant du démarrage en cours (None : capteur sans boot)
+        self.first = seq
+        self.highest = seq
+        self.previous = 0  # numéros attendus des numérotations précédentes (redémarrages)
+        self.mask = 1  # bit k : numéro highest - k reçu
+        self.received = 1
+        self.duplicates = 0
+        self.reordered = 0
+        self.gaps = 0
+        self.lost = 0
+        self.late = 0
+        self.restarts = 0
+
+    def span(self):
+        """Numéros attendus depuis le début de la numérotation courante"""
+        return self.highest - self.first + 1
+
+    def expected(self):
+        return self.previous + self.span()
+
+    def _drop_window(self):
+        """Compte comme perdus les numéros de la fenêtre jamais reçus"""
+        self.lost += min(WINDOW, self.span()) - bin(self.mask).count("1")
+
+    def _restart(self, seq, boot):
+        """Nouvelle numérotation à partir de `seq` (redémarrage du capteur)"""
+        self.restarts += 1
+        self._drop_window()
+        self.previous += self.span()
+        self.first = self.highest = seq
+        self.boot = boot
+        self.mask = 1
+        self.received += 1
+
+    def accept(self, seq, boot=None):
+        """Enregistre un numéro ; retourne False si l'échantillon est à ignorer"""
+        if boot is not None and boot != self.boot:
+            if self.boot is not None and boot < self.boot:
+                self.late += 1  # démarrage précédent, arrivé après le nouveau
+                return False
+            self._restart(seq, boot)
+            return True
+        ahead = seq - self.highest
+        if ahead > 0:
+            if ahead > 1:
+                self.gaps += 1
+            # Les numéros qui sortent de la fenêtre sans avoir été reçus sont perdus
+            if ahead >= WINDOW:
+                self._drop_window()
+                self.lost += ahead - WINDOW  # sautés sans jamais entrer dans la fenêtre
+            else:
+                leaving = self.mask >> (WINDOW - ahead)
+                leaving_count = max(0, min(WINDOW, self.span()) - (WINDOW - ahead))
+                self.lost += leaving_count - bin(leaving).count("1")
+            self.mask = ((self.mask << ahead) | 1) & WINDOW_MASK
+            self.highest = seq
+            self.received += 1
+            return True
+
+        behind = -ahead
+        if behind >= WINDOW:
+            if seq < WINDOW and boot is None:
+                # Redémarrage d'un capteur sans boot : nouvelle numérotation
+                self._restart(seq, None)
+                return True
+            self.late += 1
+            return False
+        bit = 1 << behind
+        if self.mask & bit:
+            self.duplicates += 1
+            return False
+        self.mask |= bit
+        self.reordered += 1
+        self.received += 1
+        return True
+
+
+class SequenceTracker:
+    """Fenêtres de séquence de tous les appareils (thread-safe)"""
+
+    def __init__(self):
+        self.devices = {}
+        # Un appareil n'est traité que par un worker, mais les workers du pipeline
+        # partagent ce dictionnaire (ajouts d'appareils, lectures des totaux)
+        self.lock = threading.Lock()
+
+    def accept(self, record):
+        """Vrai si l'échantillon est nouveau ; faux pour un doublon ou un retard hors fenêtre"""
+        seq = record.get("seq")
+        if seq is None:
+            return True  # capteur sans numérotation
+        device_id = record["device_id"]
+        with self.lock:
+            state = self.devices.get(device_id)
+            if state is None:
+                self.devices[device_id] = DeviceSequence(seq, record.get("boot"))
+                return True
+            return state.accept(seq, record.get("boot"))
+
+    def device_stats(self, device_id):
+        """Compteurs d'un appareil, avec son taux de livraison (None s'il est inconnu)"""
+        with self.lock:
+            state = self.devices.get(device_id)
+            if state is None:
+                return None
+            stats = {name: getattr(state, name) for name in DeviceSequence.__slots__
+                     if name not in ("mask", "boot")}
+            stats["expected"] = state.expected()
+        stats["delivery_ratio"] = stats["received"] / stats["expected"]
+        return stats
+
+    def totals(self):
+        """Compteurs additionnés sur tous les appareils, avec le taux de livraison"""
+        names = ("received", "duplicates", "reordered", "gaps", "lost", "late", "restarts")
+        total = dict.fromkeys(names, 0)
+        total["expected"] = 0
+        with self.lock:
+            for state in self.devices.values():
+                for name in names:
+                    total[name] += getattr(state, name)
+                total["expected"] += state.expected()
+        total["delivery_ratio"] = total["received"] / total["expected"] if total["expected"] else None
+        return total
+
+    def summary(self):
+        """Résumé court pour les lignes périodiques"""
+        total = self.totals()
+        if total["delivery_ratio"] is None:
+            return "livraison —"
+        return (f"livraison {total['delivery_ratio']:.2%} (trous {total['gaps']}, "
+                f"manquants {total['lost']}, désordre {total['reordered']})")
@@ -0,0 +1,330 @@
+"""
+Abonné multi-processus : une connexion MQTT, N processus de traitement
+
+    thread réseau paho → hachage du device_id (topic) → file du worker
+    → processus worker : IngestPipeline (1 thread) + registre + stockage
+      + détection d'anomalies → alertes renvoyées au processus principal
+
+Chaque appareil est toujours envoyé au même worker (crc32 du device_id
+modulo N) : l'ordre des messages d'un appareil et son état (registre,
+agrégats) restent locaux à un seul processus. Les messages sont transmis
+aux workers par petits lots pour amortir le coût de la sérialisation.
+
+Les compteurs de chaque worker sont écrits dans un tableau partagé ; le
+processus principal les additionne pour afficher une vue unique. Le suivi
+des numéros de séquence d'un appareil est local à son worker (affinité) :
+les compteurs de doublons, trous et pertes s'additionnent aussi. Il en va de
+même pour le dernier état de chaque appareil qui complète les deltas de
+l'envoi sur changement (deadband.py).
+
+Les abonnements partagés MQTT ($share/<groupe>/...) répartissent les
+messages sans garantie d'affinité par appareil : on ne les utilise pas ici.
+"""
+
+import argparse
+import json
+import multiprocessing
+import queue
+import threading
+import time
+from datetime import datetime
+
+import metrics
+import transport
+import topics
+import ingest_pipeline
+
+WORKERS = max(1, multiprocessing.cpu_count() - 1)
+FANOUT_BATCH = 64       # messages max par envoi à un worker
+FANOUT_LINGER = 0.05    # délai max (secondes) avant l'envoi d'un lot incomplet
+WORKER_QUEUE_SIZE = 1000  # lots en attente par worker
+CLIENT_ID = "iot_cloud_cluster"
+METRICS_PORT = 9104  # http://127.0.0.1:9104/metrics (0 = désactivé)
+
+# Emplacements de chaque worker dans le tableau partagé
+COUNTERS = ("received", "processed", "dropped", "decode_errors", "invalid",
+            "devices", "latency_p50_ms", "latency_p99_ms",
+            "duplicates", "gaps", "lost", "reordered", "sequence_received", "sequence_expected",
+            "deltas", "awaiting")
+SUMMED = COUNTERS[:6] + COUNTERS[8:]  # additionnés sur les workers (pas les latences)
+
+
+def _worker_main(index, inbox, counters, alerts, store_path, quiet):
+    """Boucle d'un processus worker"""
+    from anomaly import AnomalyDetector
+    from device_registry import DeviceRegistry
+    from telemetry_store import TelemetryStore
+
+    store = TelemetryStore(store_path).start() if store_path else None
+    registry = DeviceRegistry()
+    # L'affinité par appareil garde l'état de détection dans ce seul processus
+    sinks = [AnomalyDetector(on_alert=alerts.put)]
+    if store is not None:
+        sinks.append(store.write)
+    # Un seul thread de décodage : conserve l'ordre des messages par appareil
+    pipeline = ingest_pipeline.IngestPipeline(
+        sinks,
+        workers=1,
+        overflow=ingest_pipeline.OVERFLOW_BLOCK,
+        quiet=quiet,
+        registry=registry,
+        summary_interval=None,
+    )
+    pipeline.start()
+    base = index * len(COUNTERS)
+
+    def publish_counters():
+        values = (pipeline.received, pipeline.processed, pipeline.dropped,
+                  pipeline.decode_errors, pipeline.invalid, len(registry))
+        for k, value in enumerate(values):
+            counters[base + k] = value
+
+    def publish_sequences():
+        # Parcourt tous les appareils : seulement au rythme du résumé
+        total = pipeline.sequences.totals()
+        values = (pipeline.duplicates, total["gaps"], total["lost"], total["reordered"],
+                  total["received"], total["expected"], pipeline.states.deltas, pipeline.states.awaiting)
+        for k, value in enumerate(values, 8):
+            counters[base + k] = value
+
+    last_latency = time.monotonic()
+    try:
+        while True:
+            try:
+                batch = inbox.get(timeout=FANOUT_LINGER)
+            except queue.Empty:
+                batch = ()  # file vide : rafraîchir quand même les compteurs
+            if batch is None:
+                break
+            for payload, topic in batch:
+                pipeline.submit(payload, topic)
+            publish_counters()
+            if time.monotonic() - last_latency >= ingest_pipeline.SUMMARY_INTERVAL:
+                percentiles = pipeline.latency_percentiles()
+                if percentiles:
+                    counters[base + 6], counters[base + 7] = percentiles
+                publish_sequences()
+                last_latency = time.monotonic()
+    except KeyboardInterrupt:
+        pass  # Ctrl+C est géré par le processus principal
+    finally:
+        pipeline.stop()
+        publish_counters()
+        publish_sequences()
+        if store is not None:
+            store.close()
+
+
+class SubscriberCluster:
+    """Connexion MQTT unique qui répartit la télémétrie sur N processus"""
+
+    def __init__(self, workers=WORKERS, store_path=None, quiet=True,
+                 overflow=ingest_pipeline.OVERFLOW_DROP_NEWEST, client=None):
+        if overflow not in (ingest_pipeline.OVERFLOW_BLOCK, ingest_pipeline.OVERFLOW_DROP_NEWEST):
+            raise ValueError(f"Politique de débordement non supportée: {overflow}")
+        self.overflow = overflow
+        self.client = client
+        ctx = multiprocessing.get_context("spawn")
+        self.counters = ctx.Array("d", workers * len(COUNTERS), lock=False)
+        self.inboxes = [ctx.Queue(maxsize=WORKER_QUEUE_SIZE) for _ in range(workers)]
+        # Alertes levées par les workers, publiées par le processus principal
+        self.alerts = ctx.Queue()
+        self.alert_count = 0
+        self.processes = [
+            ctx.Process(target=_worker_main,
+                        args=(i, inbox, self.counters, self.alerts, store_path, quiet),
+                        name=f"ingest-worker-{i}", daemon=True)
+            for i, inbox in enumerate(self.inboxes)
+        ]
+
+        # Lots en cours de constitution, un par worker. Le verrou d'un worker couvre
+        # le détachement du lot et son dépôt dans la file : le thread réseau et le
+        # vidage périodique ne peuvent pas intervertir deux lots du même worker
+        self.pending = [[] for _ in range(workers)]
+        self.send_locks = [threading.Lock() for _ in range(workers)]
+        self.received = 0
+        self.dropped = 0  # lots perdus côté répartiteur (file du worker pleine), en messages
+        self.stopping = threading.Event()
+        self.flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self.alert_thread = threading.Thread(target=self._alert_loop, daemon=True)
+
+        # Vue agrégée des workers, lue au scrape dans le tableau partagé
+        prom = metrics.REGISTRY
+        for name in COUNTERS[:5]:
+            prom.counter(f"iot_cluster_{name}_total", f"Messages ({name}), tous workers",
+                         fn=lambda name=name: self.stats()[name])
+        prom.gauge("iot_cluster_devices", "Appareils connus, tous workers", fn=lambda: self.stats()["devices"])
+        prom.gauge("iot_cluster_latency_p99_seconds", "Latence p99 du worker le plus lent",
+                   fn=lambda: self.stats()["latency_p99_ms"] / 1000)
+        for name in ("duplicates", "gaps", "lost", "reordered"):
+            prom.counter(f"iot_cluster_sequence_{name}_total", f"Échantillons ({name}), tous workers",
+                         fn=lambda name=name: self.stats()[name])
+        prom.gauge("iot_cluster_delivery_ratio", "Échantillons distincts reçus / attendus, tous workers",
+                   fn=lambda: self.stats()["delivery_ratio"] or 0.0)
+        prom.counter("iot_cluster_deltas_total", "Deltas complétés avec le dernier état connu, tous workers",
+                     fn=lambda: self.stats()["deltas"])
+        prom.counter("iot_cluster_awaiting_snapshot_total",
+                     "Deltas écartés faute d'échantillon complet, tous workers",
+                     fn=lambda: self.stats()["awaiting"])
+        prom.counter("iot_cluster_alerts_total", "Alertes publiées", fn=lambda: self.alert_count)
+
+    # ==== RÉPARTITION (thread réseau) ====
+    def on_connect(self, client, userdata, flags, rc):
+        """Callback de connexion"""
+        if rc == 0:
+            print(f"[{datetime.now()}] ✓ Connecté au broker MQTT, "
+                  f"{len(self.processes)} workers sur {topics.DATA_WILDCARD}")
+            client.subscribe(topics.DATA_WILDCARD)
+        else:
+            print(f"[{datetime.now()}] ❌ Échec connexion: Code {rc}")
+
+    def on_message(self, client, userdata, message):
+        """Ajoute le message au lot du worker responsable de son appareil"""
+        self.received += 1
+        device_id = topics.device_id(message.topic) or ""
+        i = ingest_pipeline.shard(device_id, len(self.inboxes))
+        with self.send_locks[i]:
+            batch = self.pending[i]
+            batch.append((message.payload, message.topic))
+            if len(batch) < FANOUT_BATCH:
+                return
+            self.pending[i] = []
+            self._send(i, batch)
+
+    def _send(self, i, batch):
+        if self.overflow == ingest_pipeline.OVERFLOW_BLOCK:
+            self.inboxes[i].put(batch)
+            return
+        try:
+            self.inboxes[i].put_nowait(batch)
+        except queue.Full:
+            self.dropped += len(batch)
+
+    def flush(self):
+        """Envoie tous les lots incomplets"""
+        for i, lock in enumerate(self.send_locks):
+            with lock:
+                batch = self.pending[i]
+                if batch:
+                    self.pending[i] = []
+                    self._send(i, batch)
+
+    def _flush_loop(self):
+        while not self.stopping.wait(FANOUT_LINGER):
+            self.flush()
+
+    def _alert_loop(self):
+        while True:
+            alert = self.alerts.get()
+            if alert is None:
+                return
+            self.alert_count += 1
+            self.client.publish(topics.alert_topic(alert["device_id"]), json.dumps(alert), qos=1)
+            print(f"[{datetime.now()}] 🚨 {alert['device_id']}: {alert['type']} "
+                  f"{alert['metric']}={alert['value']} ({alert['detail']})")
+
+    # ==== VUE AGRÉGÉE ====
+    def worker_stats(self):
+        """Compteurs de chaque worker (liste de dictionnaires)"""
+        values = self.counters[:]
+        size = len(COUNTERS)
+        return [dict(zip(COUNTERS, values[i * size:(i + 1) * size])) for i in range(len(self.processes))]
+
+    def stats(self):
+        """Compteurs additionnés sur tous les workers"""
+        workers = self.worker_stats()
+        total = {name: sum(w[name] for w in workers) for name in SUMMED}
+        total["dropped"] += self.dropped
+        total["latency_p99_ms"] = max(w["latency_p99_ms"] for w in workers)
+        expected = total["sequence_expected"]
+        total["delivery_ratio"] = total["sequence_received"] / expected if expected else None
+        return total
+
+    @property
+    def message_count(self):
+        """Nombre d'échantillons traités par l'ensemble des workers"""
+        return int(sum(w["processed"] for w in self.worker_stats()))
+
+    def summary(self, elapsed, processed):
+        """Ligne de résumé agrégée, avec la répartition par worker"""
+        total = self.stats()
+        share = " ".join(f"{int(w['processed'])}" for w in self.worker_stats())
+        p99 = total["latency_p99_ms"]
+        latency = f"p99 max {p99:.2f} ms" if p99 else "p99 —"
+        ratio = total["delivery_ratio"]
+        delivery = (f"livraison {ratio:.2%} (doublons {int(total['duplicates'])}, "
+                    f"manquants {int(total['lost'])})" if ratio is not None else "livraison —")
+        return (f"[{datetime.now():%H:%M:%S}] 📊 {processed / elapsed:,.0f} éch/s | "
+                f"{int(total['devices'])} appareils | traités {int(total['processed'])} | "
+                f"perdus {int(total['dropped'])} | erreurs {int(total['decode_errors'])} | "
+                f"rejetés {int(total['invalid'])} | alertes {self.alert_count} | {delivery} | {latency} | "
+                f"par worker [{share}]")
+
+    # ==== CYCLE DE VIE ====
+    def start(self):
+        """Démarre les workers et la connexion MQTT"""
+        for process in self.processes:
+            process.start()
+        self.flusher.start()
+        self.alert_thread.start()
+        if self.client is None:
+            self.client = transport.create_client(CLIENT_ID)
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
+        transport.connect(self.client)
+        self.client.loop_start()
+        return self
+
+    def stop(self):
+        """Laisse chaque worker vider sa file, publie les dernières alertes puis se déconnecte"""
+        self.client.on_message = None  # plus de nouveaux messages
+        self.stopping.set()
+        self.flusher.join()
+        self.flush()
+        for inbox in self.inboxes:
+            inbox.put(None)
+        for process in self.processes:
+            process.join()
+        self.alerts.put(None)
+        self.alert_thread.join()
+        self.client.loop_stop()
+        self.client.disconnect()
+
+    def run(self, metrics_port=METRICS_PORT):
+        """Affiche un résumé agrégé toutes les SUMMARY_INTERVAL secondes"""
+        try:
+            metrics.serve(metrics_port)
+            print("="*70)
+            print(f"☁️  CLOUD IoT SIMULATOR - {len(self.processes)} workers")
+            print("="*70)
+            self.start()
+            last_time, last_processed = time.monotonic(), 0
+            while True:
+                time.sleep(ingest_pipeline.SUMMARY_INTERVAL)
+                now, processed = time.monotonic(), self.message_count
+                print(self.summary(now - last_time, processed - last_processed))
+                last_time, last_processed = now, processed
+        except KeyboardInterrupt:
+            print("\n👋 Arrêt demandé")
+        finally:
+            self.stop()
+            print(f"📨 {self.message_count} échantillons traités par {len(self.processes)} workers")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Abonné MQTT multi-processus")
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="Nombre de processus de traitement")
+    parser.add_argument("--store", metavar="FICHIER",
+                        help="Enregistre la télémétrie dans une base SQLite (ex: telemetry.db)")
+    parser.add_argument("--verbose", action="store_true",
+                        help="Affiche chaque échantillon (désactivé par défaut à haut débit)")
+    parser.add_argument("--overflow", default=ingest_pipeline.OVERFLOW_DROP_NEWEST,
+                        choices=(ingest_pipeline.OVERFLOW_BLOCK, ingest_pipeline.OVERFLOW_DROP_NEWEST),
+                        help="Politique quand la file d'un worker est pleine")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT,
+                        help="Port HTTP des métriques Prometheus (0 = désactivé)")
+    args = parser.parse_args()
+
+    cluster = SubscriberCluster(args.workers, args.store, quiet=not args.verbose, overflow=args.overflow)
+    cluster.run(args.metrics_port)
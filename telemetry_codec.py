@@ -0,0 +1,359 @@
+"""
+Format de fil des messages de télémétrie (JSON ou binaire compact)
+
+Partagé par virtual_sensor.py, mqtt_subscriber.py et dashboard.py.
+
+Format binaire (version 1, little-endian) :
+    en-tête : magic (0xB7) | version (uint8) | longueur device_id (uint8) | device_id (UTF-8)
+    puis un ou plusieurs enregistrements de taille fixe (15 octets) :
+        timestamp       float64  secondes depuis l'epoch
+        temperature     int16    centièmes de °C
+        humidity        uint16   centièmes de %
+        status          uint8    index dans STATUSES
+        battery         uint8    %
+        signal_strength int8     dBm
+
+Format binaire version 2 (numéros de séquence, écrit dès que les
+échantillons portent un champ "seq") :
+    en-tête : comme en version 1, suivi de sent_at (float64, heure d'envoi
+              du message, secondes depuis l'epoch)
+    enregistrements de 19 octets : ceux de la version 1 suivis de
+        seq             uint32   numéro de séquence de l'échantillon (par appareil)
+Les deux versions sont décodées ; en JSON, "seq" et "sent_at" sont de simples
+champs supplémentaires de chaque échantillon.
+
+Identifiant de démarrage (versions 2 et 3) : si le bit BOOT_FLAG de l'octet de
+version est levé, sent_at est suivi de
+        boot            uint32   démarrage du capteur (sa numérotation courante)
+repris dans le champ "boot" de chaque échantillon décodé (en JSON, un simple
+champ de plus).
+
+Format binaire version 3 (deltas de l'envoi sur changement, écrit dès qu'un
+échantillon du lot ne porte pas tous les champs de mesure, cf. deadband.py) :
+    en-tête : comme en version 2
+    enregistrements de taille variable :
+        timestamp       float64
+        seq             uint32
+        présence        uint8    bit k : k-ième champ de SPARSE_FIELDS présent
+        puis les seuls champs présents, dans l'ordre et le codage de la version 1
+Un échantillon complet y prend 20 octets, un delta d'un seul champ 14 ou 15.
+Un enregistrement dont le masque n'est pas complet est décodé avec le
+marqueur "delta": true. En JSON, un delta est un objet sans les champs
+absents, qui porte ce marqueur.
+
+Le premier octet sert de marqueur de type de contenu : un payload JSON
+commence toujours par "{" ou "[", alors que 0xB7 ne peut pas commencer un
+texte UTF-8. Les capteurs JSON et binaires peuvent donc coexister sur le
+même topic pendant la migration.
+
+Lots : un message peut contenir plusieurs échantillons d'un même appareil.
+En binaire, l'en-tête est suivi de N enregistrements ; en JSON, le message
+est une liste d'objets. decode_records() retourne toujours une liste.
+
+Quel que soit le format reçu, les échantillons décodés sont les mêmes
+dictionnaires, avec un timestamp normalisé en secondes depuis l'epoch (float).
+"""
+
+import json
+import struct
+import sys
+import time
+from datetime import datetime
+
+FORMAT_JSON = "json"
+FORMAT_BINARY = "binary"
+FORMATS = (FORMAT_JSON, FORMAT_BINARY)
+
+CONTENT_TYPE_JSON = "application/json"
+CONTENT_TYPE_BINARY = "application/x-iot-telemetry"
+
+BINARY_MAGIC = 0xB7
+BINARY_VERSION = 2
+HEADER = struct.Struct("<BBB")
+SENT_AT = struct.Struct("<d")          # en-tête v2 : heure d'envoi
+BOOT = struct.Struct("<I")             # en-tête v2/v3 : identifiant de démarrage
+BOOT_FLAG = 0x80                       # bit de l'octet de version : en-tête avec boot
+RECORD_V1 = struct.Struct("<dhHBBb")
+RECORD_V2 = struct.Struct("<dhHBBbI")  # v1 + numéro de séquence
+RECORD_V3 = struct.Struct("<dIB")      # timestamp, seq, masque de présence
+# Champs de mesure d'un enregistrement v3 et leur codage, dans l'ordre des bits
+SPARSE_FIELDS = (("temperature", "h"), ("humidity", "H"), ("status", "B"),
+                 ("battery", "B"), ("signal_strength", "b"))
+FULL_MASK = (1 << len(SPARSE_FIELDS)) - 1
+
+STATUSES = ("online", "rebooting", "offline")
+STATUS_CODES = {status: i for i, status in enumerate(STATUSES)}
+
+# Masque de présence -> (struct des champs présents, noms de ces champs)
+_SPARSE_LAYOUTS = [
+    (struct.Struct("<" + "".join(code for k, (_, code) in enumerate(SPARSE_FIELDS) if mask >> k & 1)),
+     tuple(name for k, (name, _) in enumerate(SPARSE_FIELDS) if mask >> k & 1))
+    for mask in range(FULL_MASK + 1)
+]
+
+# Cache des device_id décodés : une seule chaîne par appareil
+_DEVICE_IDS = {}
+_DEVICE_IDS_MAX = 65536
+
+
+def content_type(payload):
+    """Retourne le type de contenu d'un payload d'après son premier octet"""
+    if payload and payload[0] == BINARY_MAGIC:
+        return CONTENT_TYPE_BINARY
+    return CONTENT_TYPE_JSON
+
+
+def _epoch(timestamp):
+    """Convertit un timestamp ISO-8601 (ou déjà numérique) en secondes epoch"""
+    if isinstance(timestamp, str):
+        return datetime.fromisoformat(timestamp).timestamp()
+    return float(timestamp)
+
+
+def _intern_device_id(raw):
+    """Décode un device_id en réutilisant la même chaîne pour chaque appareil"""
+    device_id = _DEVICE_IDS.get(raw)
+    if device_id is None:
+        if len(_DEVICE_IDS) >= _DEVICE_IDS_MAX:
+            _DEVICE_IDS.clear()
+        device_id = _DEVICE_IDS[raw] = sys.intern(raw.decode("utf-8"))
+    return device_id
+
+
+# ==== ENCODAGE ====
+def encode_json(telemetry):
+    """Encode un échantillon en JSON (format historique)"""
+    return json.dumps(telemetry)
+
+
+def _pack_record(telemetry):
+    return RECORD_V1.pack(
+        _epoch(telemetry["timestamp"]),
+        round(telemetry["temperature"] * 100),
+        round(telemetry["humidity"] * 100),
+        STATUS_CODES.get(telemetry["status"], 0),
+        telemetry["battery"],
+        telemetry["signal_strength"]
+    )
+
+
+def _pack_record_v2(telemetry):
+    return RECORD_V2.pack(
+        _epoch(telemetry["timestamp"]),
+        round(telemetry["temperature"] * 100),
+        round(telemetry["humidity"] * 100),
+        STATUS_CODES.get(telemetry["status"], 0),
+        telemetry["battery"],
+        telemetry["signal_strength"],
+        telemetry["seq"]
+    )
+
+
+def _field_code(name, value):
+    """Valeur d'un champ de mesure telle qu'écrite dans un enregistrement binaire"""
+    if name in ("temperature", "humidity"):
+        return round(value * 100)
+    if name == "status":
+        return STATUS_CODES.get(value, 0)
+    return value
+
+
+def _pack_record_v3(telemetry):
+    mask, values = 0, []
+    for k, (name, _) in enumerate(SPARSE_FIELDS):
+        if name in telemetry:
+            mask |= 1 << k
+            values.append(_field_code(name, telemetry[name]))
+    layout = _SPARSE_LAYOUTS[mask][0]
+    return RECORD_V3.pack(_epoch(telemetry["timestamp"]), telemetry.get("seq", 0), mask) + layout.pack(*values)
+
+
+def _is_sparse(telemetry):
+    """Vrai pour un delta (marqueur "delta") ou un échantillon sans tous les champs de mesure"""
+    return bool(telemetry.get("delta")) or any(name not in telemetry for name, _ in SPARSE_FIELDS)
+
+
+def encode_binary(telemetry):
+    """Encode un échantillon dans le format binaire compact"""
+    return encode_binary_batch([telemetry])
+
+
+def encode_binary_batch(samples):
+    """Encode plusieurs échantillons d'un même appareil en un seul message"""
+    device_id = samples[0]["device_id"].encode("utf-8")
+    if "seq" not in samples[0]:
+        return b"".join(
+            [HEADER.pack(BINARY_MAGIC, 1, len(device_id)), device_id]
+            + [_pack_record(telemetry) for telemetry in samples]
+        )
+    sent_at = samples[0].get("sent_at") or time.time()
+    if any(_is_sparse(telemetry) for telemetry in samples):
+        version, pack = 3, _pack_record_v3
+    else:
+        version, pack = BINARY_VERSION, _pack_record_v2
+    header = [device_id, SENT_AT.pack(sent_at)]
+    boot = samples[0].get("boot")
+    if boot is not None:
+        version |= BOOT_FLAG
+        header.append(BOOT.pack(boot))
+    return b"".join(
+        [HEADER.pack(BINARY_MAGIC, version, len(device_id))] + header
+        + [pack(telemetry) for telemetry in samples]
+    )
+
+
+def _iter_sparse(payload, offset):
+    """(timestamp, seq, noms, valeurs brutes) de chaque enregistrement v3 à partir de `offset`"""
+    end = len(payload)
+    while offset < end:
+        if offset + RECORD_V3.size > end:
+            raise ValueError("Payload binaire tronqué")
+        timestamp, seq, mask = RECORD_V3.unpack_from(payload, offset)
+        offset += RECORD_V3.size
+        if mask > FULL_MASK:
+            raise ValueError(f"Masque de présence invalide: {mask:#x}")
+        layout, names = _SPARSE_LAYOUTS[mask]
+        if offset + layout.size > end:
+            raise ValueError("Payload binaire tronqué")
+        yield timestamp, seq, names, layout.unpack_from(payload, offset)
+        offset += layout.size
+
+
+def _check_header(magic, version):
+    """Lève ValueError si l'en-tête n'est pas celui d'un payload binaire connu"""
+    if magic != BINARY_MAGIC:
+        raise ValueError(f"Marqueur binaire invalide: {magic:#x}")
+    if version not in (1, 2, 3):
+        raise ValueError(f"Version de format binaire non supportée: {version}")
+
+
+def binary_record_count(payload):
+    """Nombre d'échantillons d'un payload binaire (ValueError s'il n'en est pas un)"""
+    magic, version, id_length = HEADER.unpack_from(payload)
+    has_boot = version & BOOT_FLAG
+    version &= ~BOOT_FLAG
+    _check_header(magic, version)
+    if version == 1:
+        return (len(payload) - HEADER.size - id_length) // RECORD_V1.size
+    offset = HEADER.size + id_length + SENT_AT.size
+    if has_boot:
+        offset += BOOT.size
+    if version == 2:
+        return (len(payload) - offset) // RECORD_V2.size
+    return sum(1 for _ in _iter_sparse(payload, offset))
+
+
+def stamp_sent(samples, sent_at=None):
+    """Fixe l'heure d'envoi (sent_at) des échantillons d'un message, juste avant l'encodage"""
+    sent_at = time.time() if sent_at is None else sent_at
+    for telemetry in samples:
+        telemetry["sent_at"] = sent_at
+    return samples
+
+
+def encode(telemetry, payload_format=FORMAT_JSON):
+    """Encode un échantillon dans le format demandé ("json" ou "binary")"""
+    if payload_format == FORMAT_BINARY:
+        return encode_binary(telemetry)
+    return encode_json(telemetry)
+
+
+def encode_batch(samples, payload_format=FORMAT_JSON):
+    """Encode un lot d'échantillons d'un même appareil en un seul message"""
+    if len(samples) == 1:
+        return encode(samples[0], payload_format)
+    if payload_format == FORMAT_BINARY:
+        return encode_binary_batch(samples)
+    return json.dumps(samples)
+
+
+# ==== DÉCODAGE ====
+def decode_binary(payload):
+    """Décode un payload binaire en liste d'échantillons"""
+    magic, version, id_length = HEADER.unpack_from(payload)
+    has_boot = version & BOOT_FLAG
+    version &= ~BOOT_FLAG
+    _check_header(magic, version)
+
+    offset = HEADER.size + id_length
+    device_id = _intern_device_id(bytes(payload[HEADER.size:offset]))
+    if version == 1:
+        if (len(payload) - offset) % RECORD_V1.size:
+            raise ValueError("Payload binaire tronqué")
+        return [{
+            "device_id": device_id,
+            "timestamp": timestamp,
+            "temperature": temperature / 100,
+            "humidity": humidity / 100,
+            "status": STATUSES[status] if status < len(STATUSES) else "unknown",
+            "battery": battery,
+            "signal_strength": signal
+        } for timestamp, temperature, humidity, status, battery, signal
+            in RECORD_V1.iter_unpack(memoryview(payload)[offset:])]
+
+    sent_at, = SENT_AT.unpack_from(payload, offset)
+    offset += SENT_AT.size
+    if has_boot:
+        boot, = BOOT.unpack_from(payload, offset)
+        offset += BOOT.size
+    if version == 3:
+        records = []
+        for timestamp, seq, names, values in _iter_sparse(payload, offset):
+            record = {"device_id": device_id, "timestamp": timestamp}
+            for name, value in zip(names, values):
+                if name in ("temperature", "humidity"):
+                    value /= 100
+                elif name == "status":
+                    value = STATUSES[value] if value < len(STATUSES) else "unknown"
+                record[name] = value
+            if len(names) < len(SPARSE_FIELDS):
+                record["delta"] = True
+            record["seq"] = seq
+            record["sent_at"] = sent_at
+            if has_boot:
+                record["boot"] = boot
+            records.append(record)
+        return records
+    if (len(payload) - offset) % RECORD_V2.size:
+        raise ValueError("Payload binaire tronqué")
+    records = [{
+        "device_id": device_id,
+        "timestamp": timestamp,
+        "temperature": temperature / 100,
+        "humidity": humidity / 100,
+        "status": STATUSES[status] if status < len(STATUSES) else "unknown",
+        "battery": battery,
+        "signal_strength": signal,
+        "seq": seq,
+        "sent_at": sent_at
+    } for timestamp, temperature, humidity, status, battery, signal, seq
+        in RECORD_V2.iter_unpack(memoryview(payload)[offset:])]
+    if has_boot:
+        for record in records:
+            record["boot"] = boot
+    return records
+
+
+def decode_json(payload):
+    """Décode un payload JSON (objet ou lot) en liste d'échantillons"""
+    records = json.loads(payload)
+    if isinstance(records, dict):
+        records = [records]
+    for record in records:
+        record["timestamp"] = _epoch(record["timestamp"])
+    return records
+
+
+def decode_records(payload):
+    """Décode un payload (JSON ou binaire, unitaire ou lot) en liste d'échantillons"""
+    if content_type(payload) == CONTENT_TYPE_BINARY:
+        return decode_binary(payload)
+    return decode_json(payload)
+
+
+def decode(payload):
+    """Décode un payload (JSON ou binaire) en un échantillon"""
+    records = decode_records(payload)
+    if len(records) != 1:
+        raise ValueError(f"{len(records)} échantillons dans un message unitaire")
+    return records[0]
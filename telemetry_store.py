@@ -0,0 +1,180 @@
+"""
+Stockage persistant de la télémétrie (SQLite en mode WAL)
+
+Les écritures passent par une file et un thread écrivain unique qui les
+regroupe en transactions (group commit) : au plus WRITE_BATCH lignes ou
+FLUSH_INTERVAL secondes par commit. Le mode WAL permet au dashboard de
+lire pendant que l'abonné écrit, depuis un autre processus. Le dashboard
+ouvre la base en lecture seule (readonly=True) : ni création du schéma ni
+création du fichier, ses connexions sont ouvertes en mode=ro.
+
+La table est indexée par (device_id, timestamp) : une requête sur une
+plage de temps d'un appareil est une simple lecture d'intervalle d'index.
+"""
+
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+DB_PATH = "telemetry.db"
+WRITE_BATCH = 1000       # lignes max par transaction
+FLUSH_INTERVAL = 0.5     # secondes max avant commit d'une transaction incomplète
+QUEUE_SIZE = 100_000     # lignes en attente avant de bloquer l'appelant
+
+COLUMNS = ("timestamp", "temperature", "humidity", "battery", "signal_strength")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS telemetry (
+    device_id       TEXT    NOT NULL,
+    timestamp       REAL    NOT NULL,
+    temperature     REAL,
+    humidity        REAL,
+    battery         INTEGER,
+    signal_strength INTEGER,
+    status          TEXT,
+    PRIMARY KEY (device_id, timestamp)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS telemetry_time ON telemetry (timestamp);
+"""
+
+INSERT = """
+INSERT OR IGNORE INTO telemetry
+    (device_id, timestamp, temperature, humidity, battery, signal_strength, status)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def _connect(path, readonly=False):
+    if readonly:
+        # Aucune écriture possible, fichier jamais créé (erreur s'il manque)
+        uri = Path(path).resolve().as_uri() + "?mode=ro"
+        return sqlite3.connect(uri, uri=True, timeout=10, check_same_thread=False)
+    connection = sqlite3.connect(path, timeout=10, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")  # durable au commit du WAL
+    return connection
+
+
+class TelemetryStore:
+    """Stockage SQLite de la télémétrie avec écritures groupées"""
+
+    def __init__(self, path=DB_PATH, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        if not readonly:
+            with _connect(path) as connection:
+                connection.executescript(SCHEMA)
+        self.readers = threading.local()
+
+        self.pending = queue.Queue(maxsize=QUEUE_SIZE)
+        self.rows_written = 0
+        self.commits = 0
+        self.writer = None
+
+    # ==== ÉCRITURE ====
+    def start(self):
+        """Démarre le thread écrivain"""
+        if self.readonly:
+            raise ValueError(f"Stockage ouvert en lecture seule: {self.path}")
+        if self.writer is None:
+            self.writer = threading.Thread(target=self._write_loop, daemon=True)
+            self.writer.start()
+        return self
+
+    def write(self, record):
+        """Met un échantillon décodé en file d'écriture"""
+        self.pending.put((
+            record["device_id"],
+            record["timestamp"],
+            record.get("temperature"),
+            record.get("humidity"),
+            record.get("battery"),
+            record.get("signal_strength"),
+            record.get("status"),
+        ))
+
+    def close(self):
+        """Écrit les échantillons en attente puis arrête le thread écrivain"""
+        if self.writer is not None:
+            self.pending.put(None)
+            self.writer.join()
+            self.writer = None
+
+    def _write_loop(self):
+        connection = _connect(self.path)
+        running = True
+        while running:
+            rows = [self.pending.get()]
+            deadline = time.monotonic() + FLUSH_INTERVAL
+            # Regrouper ce qui arrive pendant FLUSH_INTERVAL (ou jusqu'à WRITE_BATCH)
+            while len(rows) < WRITE_BATCH:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    rows.append(self.pending.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            if None in rows:
+                running = False
+                rows = [row for row in rows if row is not None]
+            if not rows:
+                continue
+            try:
+                with connection:
+                    # INSERT OR IGNORE : les doublons (device_id, timestamp) ne comptent pas
+                    written = connection.executemany(INSERT, rows).rowcount
+                self.rows_written += written
+                self.commits += 1
+            except sqlite3.Error as e:
+                print(f"[{datetime.now()}] ❌ Erreur écriture SQLite ({len(rows)} lignes): {e}")
+        connection.close()
+
+    # ==== LECTURE ====
+    def _reader(self):
+        """Une connexion de lecture par thread (sessions Streamlit, etc.)"""
+        connection = getattr(self.readers, "connection", None)
+        if connection is None:
+            connection = self.readers.connection = _connect(self.path, self.readonly)
+        return connection
+
+    def devices(self):
+        """Liste des appareils présents dans le stockage"""
+        rows = self._reader().execute("SELECT DISTINCT device_id FROM telemetry ORDER BY device_id")
+        return [device_id for (device_id,) in rows]
+
+    def time_range(self, device_id=None):
+        """Premier et dernier timestamp stockés (None, None si vide)"""
+        if device_id is None:
+            sql, params = "SELECT MIN(timestamp), MAX(timestamp) FROM telemetry", ()
+        else:
+            sql = "SELECT MIN(timestamp), MAX(timestamp) FROM telemetry WHERE device_id = ?"
+            params = (device_id,)
+        return self._reader().execute(sql, params).fetchone()
+
+    def query(self, start, end, device_id=None):
+        """
+        Échantillons entre start et end (secondes epoch), triés par temps.
+        Retourne un dictionnaire de colonnes numpy, comme ColumnarRingBuffer.
+        """
+        columns = ", ".join(COLUMNS)
+        if device_id is None:
+            sql = (f"SELECT {columns} FROM telemetry "
+                   "WHERE timestamp >= ? AND timestamp < ? ORDER BY timestamp")
+            params = (start, end)
+        else:
+            sql = (f"SELECT {columns} FROM telemetry "
+                   "WHERE device_id = ? AND timestamp >= ? AND timestamp < ? ORDER BY timestamp")
+            params = (device_id, start, end)
+        rows = self._reader().execute(sql, params).fetchall()
+
+        values = list(zip(*rows)) if rows else [()] * len(COLUMNS)
+        return {
+            name: np.asarray(column, dtype=np.float64)
+            for name, column in zip(COLUMNS, values)
+        }
@@ -0,0 +1,119 @@
+import numpy as np
+import pytest
+
+from deadband import DELTA, FIELDS, DeadbandFilter, FleetDeadband, StateReconstructor, parse_deadbands
+
+
+def sample(timestamp=0.0, **values):
+    telemetry = {
+        "device_id": "a",
+        "timestamp": timestamp,
+        "temperature": 20.0,
+        "humidity": 50.0,
+        "status": "online",
+        "battery": 90,
+        "signal_strength": -60,
+    }
+    telemetry.update(values)
+    return telemetry
+
+
+def test_parse_deadbands_overrides_defaults_and_rejects_unknown_fields():
+    deadbands = parse_deadbands("temperature=0.2, battery=2")
+    assert deadbands["temperature"] == 0.2
+    assert deadbands["battery"] == 2
+    assert deadbands["humidity"] == 2.0
+    with pytest.raises(ValueError):
+        parse_deadbands("pressure=1")
+
+
+def test_filter_sends_full_then_deltas_then_suppresses():
+    band = DeadbandFilter(heartbeat=60)
+    first = sample()
+    assert band.filter(first, now=0) is first
+
+    assert band.filter(sample(1, temperature=20.2), now=1) is None  # sous la bande morte
+    delta = band.filter(sample(2, temperature=20.6, status="rebooting"), now=2)
+    assert delta[DELTA] is True
+    assert delta["temperature"] == 20.6 and delta["status"] == "rebooting"
+    assert "humidity" not in delta and "battery" not in delta
+    assert delta["device_id"] == "a" and delta["timestamp"] == 2
+
+    stats = band.stats()
+    assert (stats["full"], stats["deltas"], stats["suppressed"]) == (1, 1, 1)
+
+
+def test_deadband_is_measured_from_last_sent_value():
+    band = DeadbandFilter(heartbeat=60)
+    band.filter(sample(), now=0)
+    # Dérive lente : chaque pas est sous la bande, le cumul la dépasse
+    assert band.filter(sample(temperature=20.3), now=1) is None
+    assert band.filter(sample(temperature=20.5), now=2)["temperature"] == 20.5
+
+
+def test_heartbeat_forces_a_full_sample():
+    band = DeadbandFilter(heartbeat=10)
+    band.filter(sample(), now=0)
+    assert band.filter(sample(), now=5) is None
+    full = band.filter(sample(), now=10)
+    assert DELTA not in full
+    assert band.stats()["full"] == 2
+
+
+def test_fleet_select_matches_per_device_rules():
+    fleet = FleetDeadband(3, heartbeat=10)
+    indices = np.arange(3)
+    values = {field: np.zeros(3) for field in FIELDS}
+    send, include = fleet.select(indices, values, now=0)
+    assert send.all() and all(include[field].all() for field in FIELDS)
+
+    values["temperature"] = np.array([0.1, 0.6, 0.0])
+    send, include = fleet.select(indices, values, now=1)
+    assert send.tolist() == [False, True, False]
+    assert include["temperature"].tolist() == [False, True, False]
+    assert not include["humidity"].any()
+
+    send, _ = fleet.select(indices, values, now=11)
+    assert send.all()
+    assert (fleet.full, fleet.deltas, fleet.suppressed) == (6, 1, 2)
+
+
+def test_reconstructor_passes_full_samples_through():
+    state = StateReconstructor()
+    record = sample()
+    assert state.apply(record) is record
+    assert state.deltas == 0
+
+
+def test_reconstructor_drops_delta_without_starting_state():
+    state = StateReconstructor()
+    assert state.apply({"device_id": "a", "timestamp": 1, DELTA: True, "temperature": 21.0}) is None
+    assert state.awaiting == 1
+
+
+def test_reconstructor_completes_delta_and_reports_held_fields():
+    state = StateReconstructor()
+    state.apply(sample(0))
+    full = state.apply({"device_id": "a", "timestamp": 1, DELTA: True, "temperature": 21.0})
+    assert DELTA not in full
+    assert full["temperature"] == 21.0
+    assert full["humidity"] == 50.0 and full["battery"] == 90
+    assert full["held"] == ("humidity", "status", "battery", "signal_strength")
+    assert state.deltas == 1
+
+
+def test_reconstructor_completes_delta_from_earlier_deltas():
+    state = StateReconstructor()
+    state.apply({"device_id": "a", "timestamp": 0, DELTA: True, "temperature": 21.0})
+    state.apply({"device_id": "a", "timestamp": 1, DELTA: True,
+                 **{field: value for field, value in sample().items() if field in FIELDS[1:]}})
+    full = state.apply({"device_id": "a", "timestamp": 2, DELTA: True, "battery": 80})
+    assert full["temperature"] == 21.0 and full["battery"] == 80
+
+
+def test_reordered_sample_does_not_overwrite_newer_state():
+    state = StateReconstructor()
+    state.apply(sample(10, temperature=25.0))
+    state.apply(sample(5, temperature=18.0))  # arrivé en retard
+    full = state.apply({"device_id": "a", "timestamp": 11, DELTA: True, "battery": 80})
+    assert full["temperature"] == 25.0
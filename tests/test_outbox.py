@@ -0,0 +1,102 @@
+import os
+
+from outbox import Outbox
+
+
+def sample(seq):
+    return {"device_id": "d", "timestamp": 1700000000.0 + seq, "temperature": 20.0, "humidity": 50.0,
+            "status": "online", "battery": 90, "signal_strength": -60, "seq": seq}
+
+
+def drain(outbox, publish):
+    while outbox._send_next(publish):
+        pass
+
+
+def collect(sent):
+    def publish(topic, samples):
+        sent.extend(s["seq"] for s in samples)
+        return True
+    return publish
+
+
+def test_spills_to_disk_and_drains_in_order(tmp_path):
+    path = str(tmp_path / "d.outbox")
+    outbox = Outbox(path, memory_samples=10, drain_batch=4)
+    for seq in range(25):
+        outbox.put("t", [sample(seq)])
+    assert os.path.exists(path)
+    assert outbox.stats()["disk_samples"] == 20
+    assert outbox.has_pending("t")
+
+    sent = []
+    drain(outbox, collect(sent))
+    assert sent == list(range(25))
+    assert outbox.depth == 0 and not outbox.has_pending("t")
+    assert not os.path.exists(path)  # supprimé une fois vidé
+
+
+def test_failed_publish_keeps_batch_at_the_front(tmp_path):
+    outbox = Outbox(str(tmp_path / "d.outbox"), memory_samples=100, drain_batch=5)
+    outbox.put("t", [sample(seq) for seq in range(10)])
+    assert outbox._send_next(lambda topic, samples: False) is None
+
+    def broken(topic, samples):
+        raise ConnectionError("coupure")
+    assert outbox._send_next(broken) is None
+    assert outbox.depth == 10
+
+    sent = []
+    drain(outbox, collect(sent))
+    assert sent == list(range(10))
+
+
+def test_failed_disk_batch_is_read_again(tmp_path):
+    outbox = Outbox(str(tmp_path / "d.outbox"), memory_samples=5, drain_batch=5)
+    outbox.put("t", [sample(seq) for seq in range(5)])
+    assert outbox._send_next(lambda topic, samples: False) is None
+    sent = []
+    drain(outbox, collect(sent))
+    assert sent == list(range(5))
+
+
+def test_disk_limit_drops_newest_samples(tmp_path):
+    outbox = Outbox(str(tmp_path / "d.outbox"), memory_samples=5, drain_batch=5, disk_limit=150)
+    for seq in range(20):
+        outbox.put("t", [sample(seq)])
+    stats = outbox.stats()
+    assert stats["dropped"] > 0
+    assert stats["depth"] + stats["dropped"] == 20
+
+    sent = []
+    drain(outbox, collect(sent))
+    assert sent == list(range(len(sent)))  # les plus anciens sont gardés
+
+
+def test_close_keeps_backlog_and_restart_resumes_it(tmp_path):
+    path = str(tmp_path / "d.outbox")
+    outbox = Outbox(path, memory_samples=100)
+    outbox.put("a", [sample(seq) for seq in range(7)])
+    outbox.put("b", [sample(seq) for seq in range(3)])
+    outbox.close()
+
+    resumed = Outbox(path)
+    assert resumed.depth == 10
+    assert resumed.pending == {"a": 7, "b": 3}
+    sent = []
+    drain(resumed, collect(sent))
+    assert len(sent) == 10
+    assert not os.path.exists(path)
+
+
+def test_truncated_tail_is_discarded_on_resume(tmp_path):
+    path = str(tmp_path / "d.outbox")
+    outbox = Outbox(path, memory_samples=100)
+    outbox.put("t", [sample(seq) for seq in range(4)])
+    outbox.close()
+    with open(path, "ab") as f:
+        f.write(b"\x01\x00")  # arrêt brutal pendant l'écriture d'un enregistrement
+
+    resumed = Outbox(path)
+    assert resumed.depth == 4
+    assert os.path.getsize(path) == resumed.write_pos
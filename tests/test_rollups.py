@@ -0,0 +1,85 @@
+import numpy as np
+
+from rollups import Rollup, RollupEngine, downsample, lttb
+
+
+def record(temperature, humidity=50.0, battery=90):
+    return {"temperature": temperature, "humidity": humidity, "battery": battery}
+
+
+def test_bucket_aggregates_min_max_mean_count():
+    rollup = Rollup(60, 10)
+    for t, temperature in ((0, 20.0), (10, 22.0), (59.9, 18.0)):
+        rollup.add(t, record(temperature))
+    rows = rollup.query(0, 60)
+    assert rows["count"].tolist() == [3]
+    assert rows["temperature_min"][0] == 18.0
+    assert rows["temperature_max"][0] == 22.0
+    assert np.isclose(rows["temperature_mean"][0], 20.0)
+
+
+def test_query_is_half_open_and_adjacent_windows_do_not_overlap():
+    rollup = Rollup(60, 10)
+    for t in range(0, 300, 30):
+        rollup.add(t, record(20.0))
+    first = rollup.query(0, 120)
+    second = rollup.query(120, 300)
+    assert first["timestamp"].tolist() == [0, 60]
+    assert second["timestamp"].tolist() == [120, 180, 240]
+    assert first["count"].sum() + second["count"].sum() == 10
+
+
+def test_bucket_in_progress_is_included_when_window_starts_inside_it():
+    rollup = Rollup(60, 10)
+    rollup.add(100, record(20.0))
+    # Le bucket courant commence à 60, avant le début de la fenêtre
+    assert rollup.query(60, 120)["count"].tolist() == [1]
+    assert len(rollup.query(61, 120)["timestamp"]) == 0
+
+
+def test_ring_recycles_slots_and_drops_samples_older_than_window():
+    rollup = Rollup(1, 4)
+    for t in range(6):
+        rollup.add(t, record(float(t)))
+    rollup.add(1, record(99.0))  # plus ancien que la fenêtre conservée
+    rows = rollup.query(0, 10)
+    assert rows["timestamp"].tolist() == [2, 3, 4, 5]
+    assert 99.0 not in rows["temperature_max"]
+
+
+def test_engine_picks_finest_resolution_within_budget():
+    engine = RollupEngine({1: 100, 60: 100})
+    assert engine.pick_resolution(50, budget=1000) == 1
+    assert engine.pick_resolution(1000, budget=1000) == 60
+    engine.add({"timestamp": 30.0, **record(21.0)})
+    resolution, rows = engine.query(0, 3600)
+    assert resolution == 60
+    assert rows["count"].tolist() == [1]
+
+
+def test_lttb_keeps_endpoints_and_budget():
+    x = np.arange(10_000, dtype=np.float64)
+    y = np.sin(x / 100)
+    keep = lttb(x, y, 100)
+    assert len(keep) == 100
+    assert keep[0] == 0 and keep[-1] == len(x) - 1
+    assert np.all(np.diff(keep) > 0)
+
+
+def test_lttb_keeps_isolated_spike():
+    x = np.arange(1000, dtype=np.float64)
+    y = np.zeros(1000)
+    y[437] = 50.0
+    assert 437 in lttb(x, y, 50)
+
+
+def test_lttb_returns_all_points_under_budget():
+    assert lttb([0, 1, 2], [1, 2, 3], 10).tolist() == [0, 1, 2]
+
+
+def test_downsample_keeps_columns_aligned():
+    rows = {"timestamp": np.arange(500, dtype=np.float64), "temperature": np.arange(500) % 7.0}
+    small = downsample(rows, "temperature", 50)
+    assert len(small["timestamp"]) == len(small["temperature"]) == 50
+    assert np.array_equal(small["temperature"], rows["temperature"][small["timestamp"].astype(int)])
+    assert downsample(rows, "temperature", 1000) is rows
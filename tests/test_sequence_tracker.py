@@ -0,0 +1,110 @@
+from sequence_tracker import WINDOW, DeviceSequence, SequenceTracker
+
+
+def feed(state, seqs, boot=None):
+    return [state.accept(seq, boot) for seq in seqs]
+
+
+def pending(state):
+    """Numéros manquants encore dans la fenêtre (ni reçus ni perdus)"""
+    return min(WINDOW, state.span()) - bin(state.mask).count("1")
+
+
+def test_in_order_stream_is_fully_delivered():
+    tracker = SequenceTracker()
+    for seq in range(100):
+        assert tracker.accept({"device_id": "a", "seq": seq})
+    stats = tracker.device_stats("a")
+    assert stats["received"] == stats["expected"] == 100
+    assert stats["delivery_ratio"] == 1.0
+    assert stats["gaps"] == stats["lost"] == stats["duplicates"] == 0
+
+
+def test_record_without_seq_is_always_accepted():
+    tracker = SequenceTracker()
+    assert tracker.accept({"device_id": "a"})
+    assert tracker.device_stats("a") is None
+    assert tracker.totals()["delivery_ratio"] is None
+
+
+def test_duplicate_is_rejected():
+    state = DeviceSequence(0)
+    assert feed(state, [1, 2, 2, 1]) == [True, True, False, False]
+    assert state.duplicates == 2
+    assert state.received == 3
+
+
+def test_gap_filled_late_counts_as_reordered_not_lost():
+    state = DeviceSequence(0)
+    assert feed(state, [1, 4, 2, 3]) == [True] * 4
+    assert state.gaps == 1
+    assert state.reordered == 2
+    assert state.lost == 0
+    assert state.received == state.expected() == 5
+
+
+def test_missing_numbers_are_lost_once_they_leave_the_window():
+    state = DeviceSequence(0)
+    state.accept(5)  # 1..4 manquants, encore dans la fenêtre
+    assert state.lost == 0
+    state.accept(5 + WINDOW)
+    assert state.lost == 4
+    assert pending(state) == WINDOW - 1
+    assert state.received + state.lost + pending(state) == state.expected()
+
+
+def test_large_jump_counts_skipped_numbers_as_lost():
+    state = DeviceSequence(0)
+    state.accept(3 * WINDOW)
+    assert state.lost == 2 * WINDOW  # sautés sans entrer dans la fenêtre
+    state.accept(4 * WINDOW)
+    assert state.lost == 3 * WINDOW - 1
+    assert state.received + state.lost + pending(state) == state.expected()
+
+
+def test_sample_behind_the_window_is_late():
+    state = DeviceSequence(0)
+    feed(state, range(1, 2 * WINDOW + 10))
+    assert state.accept(WINDOW + 5) is False
+    assert state.late == 1
+    assert state.restarts == 0
+
+
+def test_restart_without_boot_is_detected_by_heuristic():
+    state = DeviceSequence(0)
+    feed(state, range(1, 2 * WINDOW))
+    assert state.accept(0) is True
+    assert state.restarts == 1
+    assert feed(state, [1, 2]) == [True, True]
+    assert state.received == state.expected() == 2 * WINDOW + 3
+
+
+def test_boot_change_restarts_numbering_even_close_to_previous():
+    state = DeviceSequence(0, boot=1)
+    feed(state, range(1, 10), boot=1)
+    # Redémarrage rapide : le nouveau numéro n'est pas loin derrière
+    assert state.accept(0, boot=2) is True
+    assert state.restarts == 1
+    assert state.accept(1, boot=2) is True
+    assert state.duplicates == 0
+    assert state.received == state.expected() == 12
+
+
+def test_sample_from_previous_boot_is_late():
+    state = DeviceSequence(0, boot=1)
+    state.accept(0, boot=2)
+    assert state.accept(3, boot=1) is False
+    assert state.late == 1
+    assert state.boot == 2
+
+
+def test_totals_add_up_devices():
+    tracker = SequenceTracker()
+    for device_id in ("a", "b"):
+        for seq in (0, 1, 3):
+            tracker.accept({"device_id": device_id, "seq": seq, "boot": 1})
+    total = tracker.totals()
+    assert total["received"] == 6
+    assert total["expected"] == 8
+    assert total["gaps"] == 2
+    assert "trous 2" in tracker.summary()
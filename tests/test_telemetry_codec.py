@@ -0,0 +1,95 @@
+import json
+
+import pytest
+
+import telemetry_codec as codec
+
+
+def sample(**extra):
+    telemetry = {
+        "device_id": "virtual_sensor_001",
+        "timestamp": 1700000000.5,
+        "temperature": 21.37,
+        "humidity": 48.2,
+        "status": "online",
+        "battery": 87,
+        "signal_strength": -61,
+    }
+    telemetry.update(extra)
+    return telemetry
+
+
+def test_v1_round_trip_without_seq():
+    payload = codec.encode(sample(), codec.FORMAT_BINARY)
+    assert payload[1] == 1
+    assert codec.content_type(payload) == codec.CONTENT_TYPE_BINARY
+    assert codec.decode(payload) == sample()
+    assert codec.binary_record_count(payload) == 1
+
+
+def test_v2_batch_round_trip_with_seq_and_sent_at():
+    samples = [sample(seq=i, timestamp=1700000000.0 + i, sent_at=1700000010.0) for i in range(5)]
+    payload = codec.encode_batch(samples, codec.FORMAT_BINARY)
+    assert payload[1] == codec.BINARY_VERSION
+    assert codec.decode_records(payload) == samples
+    assert codec.binary_record_count(payload) == 5
+
+
+def test_boot_flag_carries_boot_id():
+    samples = [sample(seq=i, sent_at=1.0, boot=42) for i in range(3)]
+    payload = codec.encode_batch(samples, codec.FORMAT_BINARY)
+    assert payload[1] == codec.BINARY_VERSION | codec.BOOT_FLAG
+    assert [r["boot"] for r in codec.decode_records(payload)] == [42, 42, 42]
+    assert codec.binary_record_count(payload) == 3
+
+
+def test_v3_delta_keeps_only_present_fields():
+    full = sample(seq=1, sent_at=1.0, boot=7)
+    delta = {"device_id": full["device_id"], "timestamp": full["timestamp"] + 1,
+             "seq": 2, "sent_at": 1.0, "boot": 7, "delta": True, "temperature": 22.5}
+    payload = codec.encode_batch([full, delta], codec.FORMAT_BINARY)
+    assert payload[1] == 3 | codec.BOOT_FLAG
+
+    first, second = codec.decode_records(payload)
+    assert "delta" not in first
+    assert first["battery"] == 87
+    assert second["delta"] is True
+    assert second["temperature"] == 22.5
+    assert "humidity" not in second and "battery" not in second
+    assert second["seq"] == 2 and second["boot"] == 7
+    assert codec.binary_record_count(payload) == 2
+
+
+def test_v3_truncated_payload_is_rejected():
+    delta = sample(seq=1, sent_at=1.0, delta=True)
+    payload = codec.encode_binary(delta)
+    with pytest.raises(ValueError):
+        codec.decode_binary(payload[:-1])
+    with pytest.raises(ValueError):
+        codec.binary_record_count(payload[:-1])
+
+
+def test_json_batch_round_trip():
+    samples = [sample(seq=i) for i in range(3)]
+    payload = codec.encode_batch(samples)
+    assert codec.content_type(payload.encode()) == codec.CONTENT_TYPE_JSON
+    assert codec.decode_records(payload) == samples
+
+
+@pytest.mark.parametrize("payload", [
+    json.dumps(sample()).encode(),
+    b"\x00\x01\x02garbage",
+    bytes([codec.BINARY_MAGIC, 9, 0]),
+    bytes([codec.BINARY_MAGIC, 9 | codec.BOOT_FLAG, 0]),
+])
+def test_binary_record_count_rejects_what_decode_rejects(payload):
+    with pytest.raises(ValueError):
+        codec.decode_binary(payload)
+    with pytest.raises(ValueError):
+        codec.binary_record_count(payload)
+
+
+def test_unitary_decode_rejects_batch():
+    payload = codec.encode_batch([sample(seq=0), sample(seq=1)], codec.FORMAT_BINARY)
+    with pytest.raises(ValueError):
+        codec.decode(payload)
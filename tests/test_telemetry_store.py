@@ -0,0 +1,38 @@
+from telemetry_store import TelemetryStore
+
+
+def record(device_id, timestamp, temperature=20.0):
+    return {"device_id": device_id, "timestamp": timestamp, "temperature": temperature,
+            "humidity": 50.0, "battery": 90, "signal_strength": -60, "status": "online"}
+
+
+def test_duplicates_are_not_counted_as_written(tmp_path):
+    store = TelemetryStore(str(tmp_path / "telemetry.db")).start()
+    for r in (record("a", 1.0), record("a", 2.0), record("a", 1.0), record("b", 1.0)):
+        store.write(r)
+    store.close()
+    assert store.rows_written == 3
+
+
+def test_query_is_half_open_and_sorted(tmp_path):
+    store = TelemetryStore(str(tmp_path / "telemetry.db")).start()
+    for t in (3.0, 1.0, 2.0):
+        store.write(record("a", t, temperature=t * 10))
+    store.write(record("b", 1.5))
+    store.close()
+
+    rows = store.query(1.0, 3.0, device_id="a")
+    assert rows["timestamp"].tolist() == [1.0, 2.0]
+    assert rows["temperature"].tolist() == [10.0, 20.0]
+    assert store.query(1.0, 3.0)["timestamp"].tolist() == [1.0, 1.5, 2.0]
+    assert store.devices() == ["a", "b"]
+    assert store.time_range("a") == (1.0, 3.0)
+
+
+def test_readonly_store_reads_without_writing(tmp_path):
+    path = str(tmp_path / "telemetry.db")
+    writer = TelemetryStore(path).start()
+    writer.write(record("a", 1.0))
+    writer.close()
+    reader = TelemetryStore(path, readonly=True)
+    assert reader.devices() == ["a"]
@@ -0,0 +1,81 @@
+"""
+Schéma des topics MQTT : un sous-arbre par appareil
+
+    sensors/<device_id>/data      télémétrie publiée par l'appareil
+    sensors/<device_id>/command   commandes envoyées à l'appareil
+    sensors/<device_id>/ack       acks des commandes exécutées
+    sensors/<device_id>/alert     alertes levées par l'analyse en flux
+    sensors/<device_id>/presence  groupes et état en ligne de l'appareil (retenu)
+    sensors/group/<group>/command commandes envoyées à tous les membres d'un groupe
+
+Les consommateurs s'abonnent avec le joker "+" et retrouvent l'appareil
+directement dans le topic, sans décoder le payload. Les topics de groupe ont
+un niveau de plus : ils ne correspondent pas à sensors/+/command.
+"""
+
+PREFIX = "sensors"
+DATA = "data"
+COMMAND = "command"
+ACK = "ack"
+ALERT = "alert"
+PRESENCE = "presence"
+GROUP = "group"
+
+DATA_WILDCARD = f"{PREFIX}/+/{DATA}"
+COMMAND_WILDCARD = f"{PREFIX}/+/{COMMAND}"
+ACK_WILDCARD = f"{PREFIX}/+/{ACK}"
+ALERT_WILDCARD = f"{PREFIX}/+/{ALERT}"
+PRESENCE_WILDCARD = f"{PREFIX}/+/{PRESENCE}"
+GROUP_COMMAND_WILDCARD = f"{PREFIX}/{GROUP}/+/{COMMAND}"
+
+# Groupe implicite dont tous les appareils sont membres
+ALL_GROUP = "all"
+
+# Appareil par défaut (capteur unique de virtual_sensor.py)
+DEFAULT_DEVICE_ID = "virtual_sensor_001"
+
+
+def data_topic(device_id):
+    """Topic de télémétrie d'un appareil"""
+    return f"{PREFIX}/{device_id}/{DATA}"
+
+
+def command_topic(device_id):
+    """Topic de commande d'un appareil"""
+    return f"{PREFIX}/{device_id}/{COMMAND}"
+
+
+def ack_topic(device_id):
+    """Topic d'ack d'un appareil"""
+    return f"{PREFIX}/{device_id}/{ACK}"
+
+
+def alert_topic(device_id):
+    """Topic d'alerte d'un appareil"""
+    return f"{PREFIX}/{device_id}/{ALERT}"
+
+
+def presence_topic(device_id):
+    """Topic de présence (retenu) d'un appareil"""
+    return f"{PREFIX}/{device_id}/{PRESENCE}"
+
+
+def group_command_topic(group):
+    """Topic de commande d'un groupe d'appareils"""
+    return f"{PREFIX}/{GROUP}/{group}/{COMMAND}"
+
+
+def group(topic):
+    """Groupe d'un topic sensors/group/<group>/command (None sinon)"""
+    parts = topic.split("/")
+    if len(parts) != 4 or parts[0] != PREFIX or parts[1] != GROUP:
+        return None
+    return parts[2]
+
+
+def device_id(topic):
+    """Identifiant de l'appareil d'un topic sensors/<device_id>/<type> (None sinon)"""
+    parts = topic.split("/")
+    if len(parts) != 3 or parts[0] != PREFIX:
+        return None
+    return parts[1]
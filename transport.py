@@ -0,0 +1,231 @@
+"""
+Couche de transport MQTT commune au capteur, à l'abonné et au dashboard
+
+Deux backends exposent la même API (celle de paho utilisée par le projet :
+connect, loop_start, subscribe, publish, message_callback_add, callbacks
+on_connect/on_message...) :
+- "paho"   : vrai client MQTT vers le broker de config.py (HiveMQ, mosquitto...)
+- "memory" : bus en mémoire du processus, sans réseau ni TLS. Le payload
+             publié est remis tel quel (même objet bytes, sans copie) à
+             chaque abonné, dans le thread de dispatch de l'abonné comme
+             le ferait loop_start(). Les messages retenus (retain=True)
+             sont remis aux nouveaux abonnés, comme avec un broker.
+
+Le backend par défaut vient de config.TRANSPORT (variable IOT_TRANSPORT).
+"""
+
+import threading
+import time
+from queue import Queue, Empty
+
+import paho.mqtt.client as mqtt  # type: ignore
+import config
+
+TRANSPORT_PAHO = "paho"
+TRANSPORT_MEMORY = "memory"
+TRANSPORTS = (TRANSPORT_PAHO, TRANSPORT_MEMORY)
+
+
+def create_client(client_id, userdata=None, transport=None):
+    """Crée un client MQTT du backend choisi (config.TRANSPORT par défaut)"""
+    transport = transport or config.TRANSPORT
+    if transport == TRANSPORT_MEMORY:
+        return BUS.client(client_id, userdata)
+    if transport != TRANSPORT_PAHO:
+        raise ValueError(f"Transport inconnu: {transport}")
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, client_id=client_id, userdata=userdata)
+    if config.MQTT_USERNAME:
+        client.username_pw_set(config.MQTT_USERNAME, config.MQTT_PASSWORD)
+    if config.MQTT_TLS:
+        client.tls_set()
+    return client
+
+
+def connect(client):
+    """Connecte un client au broker configuré (sans effet réseau pour le bus en mémoire)"""
+    return client.connect(config.MQTT_BROKER, config.MQTT_PORT, config.MQTT_KEEPALIVE)
+
+
+def connect_async(client):
+    """Connexion en arrière-plan : loop_start() réessaie tant que le broker est injoignable"""
+    client.connect_async(config.MQTT_BROKER, config.MQTT_PORT, config.MQTT_KEEPALIVE)
+
+
+def describe():
+    """Description courte du transport, pour l'affichage"""
+    if config.TRANSPORT == TRANSPORT_MEMORY:
+        return "bus en mémoire"
+    return f"{config.MQTT_BROKER}:{config.MQTT_PORT}"
+
+
+# ==== BUS EN MÉMOIRE ====
+class MemoryMessage:
+    """Équivalent minimal de paho MQTTMessage"""
+
+    __slots__ = ("topic", "payload", "qos", "retain", "mid", "timestamp")
+
+    def __init__(self, topic, payload, qos):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = False
+        self.mid = 0
+        self.timestamp = time.monotonic()
+
+
+class MemoryBus:
+    """Broker en mémoire : route les publications vers les clients abonnés"""
+
+    def __init__(self):
+        self.clients = []
+        self.lock = threading.Lock()
+        # topic -> clients abonnés (vidé à chaque changement d'abonnement)
+        self.routes = {}
+        # topic -> dernier payload publié avec retain=True
+        self.retained = {}
+
+    def client(self, client_id="", userdata=None):
+        """Crée un client compatible avec l'API paho utilisée par le projet"""
+        client = MemoryClient(self, client_id, userdata)
+        with self.lock:
+            self.clients.append(client)
+        return client
+
+    def subscriptions_changed(self):
+        with self.lock:
+            self.routes = {}
+
+    def route(self, topic, payload, qos, retain=False):
+        """Distribue un message à tous les clients dont un filtre correspond"""
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        if retain:
+            # Comme un broker : payload vide = suppression du message retenu
+            with self.lock:
+                if payload:
+                    self.retained[topic] = (payload, qos)
+                else:
+                    self.retained.pop(topic, None)
+        clients = self.routes.get(topic)
+        if clients is None:
+            with self.lock:
+                clients = [
+                    client for client in self.clients
+                    if any(mqtt.topic_matches_sub(sub, topic) for sub in client.subscriptions)
+                ]
+                self.routes[topic] = clients
+        for client in clients:
+            client.inbox.put(MemoryMessage(topic, payload, qos))
+
+    def send_retained(self, client, sub):
+        """Remet à un nouvel abonné les messages retenus correspondant à son filtre"""
+        with self.lock:
+            retained = [(topic, payload, qos) for topic, (payload, qos) in self.retained.items()
+                        if mqtt.topic_matches_sub(sub, topic)]
+        for topic, payload, qos in retained:
+            message = MemoryMessage(topic, payload, qos)
+            message.retain = True
+            client.inbox.put(message)
+
+
+class MemoryClient:
+    """Client du bus en mémoire : un thread de dispatch par client, comme loop_start()"""
+
+    def __init__(self, bus, client_id, userdata):
+        self.bus = bus
+        self.client_id = client_id
+        self.userdata = userdata
+        self.subscriptions = set()
+        self.topic_callbacks = {}
+        self.inbox = Queue()
+        self.thread = None
+        self.running = False
+        self.offline = False  # vrai après disconnect() : publish() échoue comme avec paho
+        self.cpu_time = 0.0  # temps CPU du thread de dispatch (benchmark)
+        self.on_connect = None
+        self.on_disconnect = None
+        self.on_message = None
+
+    def username_pw_set(self, username, password=None):
+        pass
+
+    def tls_set(self, *args, **kwargs):
+        pass
+
+    def max_inflight_messages_set(self, inflight):
+        pass
+
+    def reconnect_delay_set(self, min_delay=1, max_delay=120):
+        pass
+
+    def connect(self, host="", port=0, keepalive=60):
+        self.offline = False
+        self.inbox.put("connect")
+        return 0
+
+    connect_async = connect
+
+    def message_callback_add(self, sub, callback):
+        self.topic_callbacks[sub] = callback
+
+    def subscribe(self, topic, qos=0):
+        self.subscriptions.add(topic)
+        self.bus.subscriptions_changed()
+        self.bus.send_retained(self, topic)
+        return (0, 0)
+
+    def unsubscribe(self, topic):
+        self.subscriptions.discard(topic)
+        self.bus.subscriptions_changed()
+        return (0, 0)
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        info = mqtt.MQTTMessageInfo(0)
+        if self.offline:
+            info.rc = mqtt.MQTT_ERR_NO_CONN
+        else:
+            self.bus.route(topic, payload or b"", qos, retain)
+            info._set_as_published()  # remis immédiatement : wait_for_publish() ne bloque pas
+        return info
+
+    def loop_start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._loop, daemon=True, name=f"bus-{self.client_id}")
+        self.thread.start()
+
+    def loop_stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+
+    def disconnect(self):
+        self.offline = True
+        self.subscriptions.clear()
+        self.bus.subscriptions_changed()
+        if self.on_disconnect:
+            self.on_disconnect(self, self.userdata, 0)
+
+    def _loop(self):
+        """Thread de dispatch : messages vers les callbacks"""
+        start = time.thread_time()
+        while self.running:
+            try:
+                msg = self.inbox.get(timeout=0.05)
+            except Empty:
+                continue
+            if msg == "connect":
+                if self.on_connect:
+                    self.on_connect(self, self.userdata, {}, 0)
+            else:
+                callback = next(
+                    (cb for sub, cb in self.topic_callbacks.items()
+                     if mqtt.topic_matches_sub(sub, msg.topic)),
+                    self.on_message
+                )
+                if callback:
+                    callback(self, self.userdata, msg)
+        self.cpu_time = time.thread_time() - start
+
+
+# Bus par défaut du processus (IOT_TRANSPORT=memory)
+BUS = MemoryBus()
@@ -12,42 +12,146 @@ AVANTAGES:
 import json
 import time
 import random
+import argparse
+import threading
 from datetime import datetime
-import paho.mqtt.client as mqtt # type: ignore
-
-# Configuration MQTT LOCAL (broker Mosquitto local)
-# NOUVEAU (HiveMQ Cloud)
-MQTT_BROKER = "7be661ae342e41e28bb30488c56a0cfe.s1.eu.hivemq.cloud"  # Votre URL de cluster
-MQTT_PORT = 8883
-MQTT_USERNAME = "sensor_user"      # Votre username
-MQTT_PASSWORD = "bY.5Gdir4iSrwWy"  # Votre password
-CLIENT_ID = "virtual_sensor_001"
-TOPIC_TELEMETRY = "sensors/temperature/data"
-TOPIC_COMMAND = "sensors/temperature/command"
+from queue import Queue
+import numpy as np
+import transport
+import telemetry_codec
+import commands
+import topics
+import outbox
+import metrics
+import deadband
+from sampling_scheduler import DeadlineScheduler, clamp_interval
+
+# Broker, identifiants et TLS : voir config.py (variables IOT_MQTT_*)
+CLIENT_ID = topics.DEFAULT_DEVICE_ID  # identifiant MQTT = identifiant de l'appareil
 
 # Variables de simulation
 current_temperature = 22.0
 current_humidity = 50.0
+current_battery = 100.0
+current_signal = -50
 device_status = "online"
-sampling_interval = 5  # secondes
+sampling_interval = 5.0  # secondes (float, jusqu'à 0.01 s = 100 Hz)
+PAYLOAD_FORMAT = telemetry_codec.FORMAT_JSON  # "json" ou "binary"
+BATCH_SIZE = 1      # échantillons par message (1 = pas de lot)
+BATCH_LINGER = 1.0  # délai max (secondes) avant l'envoi d'un lot incomplet
+VERBOSE_MIN_INTERVAL = 1.0  # en dessous : pas d'affichage par échantillon, seulement le résumé
+REPORT_INTERVAL = 5.0       # secondes entre deux résumés de cadence
+BATTERY_DRAIN = 1.0         # décharge simulée de la batterie (%/heure)
+
+# Configuration du mode flotte (N capteurs dans un seul processus)
+FLEET_SIZE = 1000
+FLEET_CONNECTIONS = 4       # connexions MQTT partagées par toute la flotte
+FLEET_TICK = 0.1            # période de la boucle de simulation (secondes) = intervalle min en flotte
+FLEET_ID_PREFIX = "virtual_sensor_"
+FLEET_STATUSES = ("online", "rebooting", "offline")
+FLEET_GROUP = "fleet"        # groupe de tous les appareils de la flotte
+FLEET_ZONES = 10             # la flotte est aussi répartie en groupes zone-0 ... zone-9
+FLEET_OUTBOX_MEMORY = 50_000  # échantillons de la flotte gardés en mémoire pendant une coupure
+RECONNECT_DELAY = (1, 30)     # délais min/max (secondes) entre deux tentatives de reconnexion
+METRICS_PORT = 9101           # http://127.0.0.1:9101/metrics (0 = désactivé)
+
+
+def fleet_interval(value):
+    """Intervalle accepté par la flotte : la boucle ne tourne que toutes les FLEET_TICK secondes"""
+    return max(FLEET_TICK, clamp_interval(value))
+
+
+def register_metrics(device):
+    """Expose les compteurs d'un capteur ou d'une flotte (lus au scrape, sans coût par message)"""
+    prom = metrics.REGISTRY
+    prom.counter("iot_sensor_samples_total", "Échantillons produits", fn=lambda: device.samples)
+    prom.counter("iot_sensor_published_total", "Messages de télémétrie publiés", fn=lambda: device.published)
+    prom.counter("iot_sensor_reconnects_total", "Reconnexions au broker", fn=lambda: device.reconnects)
+    prom.gauge("iot_sensor_outbox_depth", "Échantillons en attente d'envoi", fn=lambda: device.outbox.depth)
+    prom.gauge("iot_sensor_outbox_disk_bytes", "Octets en attente dans le fichier de débordement",
+               fn=lambda: device.outbox.write_pos - device.outbox.read_pos)
+    prom.counter("iot_sensor_outbox_drained_total", "Échantillons renvoyés après une coupure",
+                 fn=lambda: device.outbox.drained)
+    prom.counter("iot_sensor_outbox_dropped_total", "Échantillons perdus (file d'envoi pleine)",
+                 fn=lambda: device.outbox.dropped)
+    if device.deadband is not None:
+        prom.counter("iot_sensor_suppressed_total", "Échantillons non envoyés (sous les bandes mortes)",
+                     fn=lambda: device.deadband.suppressed)
+        prom.counter("iot_sensor_deltas_total", "Échantillons envoyés en delta (champs changés seulement)",
+                     fn=lambda: device.deadband.deltas)
+        prom.counter("iot_sensor_fields_sent_total", "Champs de mesure envoyés",
+                     fn=lambda: device.deadband.fields_sent)
 
 
 class VirtualSensor:
     """Classe représentant un capteur IoT virtuel"""
     
-    def __init__(self):
+    def __init__(self, payload_format=PAYLOAD_FORMAT, batch_size=BATCH_SIZE,
+                 batch_linger=BATCH_LINGER, device_id=CLIENT_ID, outbox_path=None,
+                 drain_rate=outbox.DRAIN_RATE, groups=(), deadbands=None,
+                 heartbeat=deadband.HEARTBEAT):
+        self.device_id = device_id
+        self.topic_telemetry = topics.data_topic(device_id)
+        self.topic_command = topics.command_topic(device_id)
+        # Groupes annoncés dans le message de présence (commandes de flotte)
+        self.groups = commands.device_groups(groups)
         self.client = None
         self.is_connected = False
+        self.payload_format = payload_format
+
+        # Mise en lot des échantillons (protégée : le timer et les commandes
+        # tournent dans d'autres threads que la boucle principale)
+        self.batch_size = batch_size
+        self.batch_linger = batch_linger
+        self.batch = []
+        self.batch_lock = threading.Lock()
+        self.batch_timer = None
+
+        # Échantillons produits hors connexion, renvoyés à la reconnexion
+        self.outbox = outbox.Outbox(outbox_path or outbox.default_path(device_id),
+                                    drain_rate=drain_rate)
+
+        # Cadence d'échantillonnage à échéances fixes (set_interval appliqué au tick suivant)
+        self.scheduler = DeadlineScheduler(sampling_interval)
+        self.last_report = time.monotonic()
+
+        # Envoi sur changement (None : chaque échantillon est envoyé complet)
+        self.deadband = deadband.DeadbandFilter(deadbands, heartbeat) if deadbands is not None else None
+
+        self.samples = 0
+        self.seq = 0        # numéro de séquence du prochain échantillon
+        self.boot = int(time.time())  # identifiant de ce démarrage (numérotation repartie de 0)
+        self.published = 0  # messages (un lot = un message)
+        self.was_connected = False
+        self.reconnects = 0
+        register_metrics(self)
+        metrics.REGISTRY.counter("iot_sensor_missed_deadlines_total", "Échéances d'échantillonnage manquées",
+                                 fn=lambda: self.scheduler.missed)
+
+        # Commandes exécutées hors du thread réseau MQTT ; une commande relancée
+        # (même identifiant) n'est pas réexécutée, son ack est renvoyé
+        self.recent = commands.RecentCommands()
+        self.command_queue = Queue()
+        self.command_thread = threading.Thread(target=self.command_worker, daemon=True)
         
     def on_connect(self, client, userdata, flags, rc):
         """Callback de connexion"""
         if rc == 0:
             print(f"[{datetime.now()}] ✓ Connecté au broker MQTT local!")
             self.is_connected = True
+            if self.was_connected:
+                self.reconnects += 1
+            self.was_connected = True
+            self.outbox.wake()
             
-            # S'abonner au topic de commande
-            self.client.subscribe(TOPIC_COMMAND)
-            print(f"[{datetime.now()}] ✓ Abonné au topic: {TOPIC_COMMAND}")
+            # S'abonner au topic de commande et à ceux de ses groupes
+            self.client.subscribe(self.topic_command)
+            for group in self.groups:
+                self.client.subscribe(topics.group_command_topic(group))
+            self.client.publish(topics.presence_topic(self.device_id),
+                                commands.make_presence(self.device_id, self.groups), qos=1, retain=True)
+            print(f"[{datetime.now()}] ✓ Abonné au topic: {self.topic_command} "
+                  f"(groupes : {', '.join(self.groups)})")
         else:
             print(f"[{datetime.now()}] ❌ Échec de connexion: Code {rc}")
             
@@ -57,67 +161,100 @@ class VirtualSensor:
         print(f"[{datetime.now()}] ⚠️  Déconnecté du broker")
         
     def command_callback(self, client, userdata, message):
-        """Callback appelé lors de la réception d'une commande"""
-        global sampling_interval, device_status
-        
+        """Callback appelé lors de la réception d'une commande
+
+        Tourne dans le thread réseau paho : on se contente de décoder et de
+        mettre la commande en file, l'exécution se fait dans command_worker.
+        """
+        received_at = time.monotonic()
         print(f"\n[{datetime.now()}] 📥 Commande reçue sur {message.topic}")
         try:
             payload = json.loads(message.payload.decode('utf-8'))
             print(f"Payload: {json.dumps(payload, indent=2)}")
-            
-            # Traiter la commande
-            if "action" in payload:
-                action = payload["action"]
-                
-                if action == "set_interval":
-                    new_interval = payload.get("value", 5)
-                    sampling_interval = new_interval
-                    print(f"✓ Intervalle d'échantillonnage mis à jour: {sampling_interval}s")
-                    
-                elif action == "reboot":
-                    print("✓ Simulation de redémarrage de l'appareil...")
-                    device_status = "rebooting"
-                    time.sleep(2)
-                    device_status = "online"
-                    print("✓ Appareil redémarré")
-                    
-                elif action == "shutdown":
-                    print("✓ Arrêt de l'appareil demandé")
-                    device_status = "offline"
+            self.command_queue.put((payload, received_at))
         except Exception as e:
             print(f"❌ Erreur traitement commande: {e}")
+
+    def command_worker(self):
+        """Exécute les commandes une par une et publie leur ack"""
+        while True:
+            payload, received_at = self.command_queue.get()
+            ack = self.recent.get(payload.get("id"))
+            if ack is not None:
+                # Relance d'une commande déjà exécutée
+                if self.is_connected:
+                    self.client.publish(topics.ack_topic(self.device_id), json.dumps(ack), qos=1)
+                continue
+            try:
+                result = self.execute_command(payload)
+                if result is None:
+                    ack = commands.make_ack(payload, self.device_id, commands.ACK_UNKNOWN, received_at)
+                else:
+                    ack = commands.make_ack(payload, self.device_id, commands.ACK_OK, received_at, result)
+            except Exception as e:
+                print(f"❌ Erreur traitement commande: {e}")
+                ack = commands.make_ack(payload, self.device_id, commands.ACK_ERROR, received_at, error=str(e))
+            self.recent.add(payload.get("id"), ack)
+
+            if self.is_connected:
+                self.client.publish(topics.ack_topic(self.device_id), json.dumps(ack), qos=1)
+                print(f"✓ Ack envoyé ({ack['status']}, {ack['latency_ms']} ms)")
+
+    def execute_command(self, payload):
+        """Applique une commande ; retourne son résultat (None si action inconnue)"""
+        global sampling_interval, device_status
+
+        action = payload.get("action")
+
+        if action == "set_interval":
+            sampling_interval = self.scheduler.set_interval(payload.get("value", 5))
+            print(f"✓ Intervalle d'échantillonnage mis à jour: {sampling_interval}s")
+            return {"interval": sampling_interval}
+
+        elif action == "reboot":
+            print("✓ Simulation de redémarrage de l'appareil...")
+            device_status = "rebooting"
+            time.sleep(2)
+            device_status = "online"
+            print("✓ Appareil redémarré")
+            return {"status": device_status}
+
+        elif action == "shutdown":
+            print("✓ Arrêt de l'appareil demandé")
+            device_status = "offline"
+            return {"status": device_status}
+
+        elif action == "set_batch":
+            self.batch_size = max(1, int(payload.get("size", self.batch_size)))
+            self.batch_linger = float(payload.get("linger", self.batch_linger))
+            print(f"✓ Lots: {self.batch_size} échantillons, délai max {self.batch_linger}s")
+            self.flush()
+            return {"size": self.batch_size, "linger": self.batch_linger}
+
+        return None
         
     def connect(self):
-        """Établit la connexion MQTT avec HiveMQ Cloud"""
+        """Établit la connexion MQTT (broker de config.py ou bus en mémoire)"""
         print(f"[{datetime.now()}] Initialisation du client MQTT...")
         
-        # Initialiser le client MQTT
-        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, client_id=CLIENT_ID)
-        
-        # Configuration pour HiveMQ Cloud (authentification + TLS)
-        self.client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
-        self.client.tls_set()  # Active TLS/SSL (obligatoire pour HiveMQ Cloud)
+        # Client du transport configuré (authentification + TLS selon config.py)
+        self.client = transport.create_client(self.device_id)
         
         self.client.on_connect = self.on_connect
         self.client.on_disconnect = self.on_disconnect
         self.client.on_message = self.command_callback
+        self.client.reconnect_delay_set(*RECONNECT_DELAY)
+        if not self.command_thread.is_alive():
+            self.command_thread.start()
         
-        # Connexion au broker
-        print(f"[{datetime.now()}] Connexion à {MQTT_BROKER}:{MQTT_PORT}...")
-        try:
-            self.client.connect(MQTT_BROKER, MQTT_PORT, 60)
-        except Exception as e:
-            print(f"\n❌ ERREUR DE CONNEXION: {e}")
-            print("\n💡 SOLUTION: Installez et démarrez Mosquitto:")
-            print("   Windows: https://mosquitto.org/download/")
-            print("   Linux: sudo apt-get install mosquitto")
-            print("   Mac: brew install mosquitto")
-            print("\n   Ou utilisez un broker public: test.mosquitto.org")
-            raise
+        # Connexion au broker en arrière-plan : loop_start() réessaie tant
+        # qu'il est injoignable, les échantillons attendent dans la file d'envoi
+        print(f"[{datetime.now()}] Connexion à {transport.describe()}...")
+        transport.connect_async(self.client)
     
     def generate_telemetry(self):
         """Génère des données de télémétrie simulées"""
-        global current_temperature, current_humidity
+        global current_temperature, current_humidity, current_battery, current_signal
         
         # Simuler des variations réalistes
         current_temperature += random.uniform(-0.5, 0.5)
@@ -125,42 +262,116 @@ class VirtualSensor:
         
         current_humidity += random.uniform(-2.0, 2.0)
         current_humidity = max(30.0, min(80.0, current_humidity))
+
+        # Batterie qui se décharge lentement, signal qui dérive
+        current_battery = max(0.0, current_battery - BATTERY_DRAIN * self.scheduler.interval / 3600)
+        current_signal = max(-70, min(-30, current_signal + random.randint(-1, 1)))
         
         telemetry = {
-            "device_id": CLIENT_ID,
+            "device_id": self.device_id,
             "timestamp": datetime.now().isoformat(),
             "temperature": round(current_temperature, 2),
             "humidity": round(current_humidity, 2),
             "status": device_status,
-            "battery": random.randint(85, 100),
-            "signal_strength": random.randint(-70, -30)
+            "battery": round(current_battery),
+            "signal_strength": current_signal
         }
         
         return telemetry
     
     def publish_telemetry(self):
-        """Publie les données de télémétrie"""
-        if not self.is_connected:
-            print("❌ Non connecté, impossible de publier")
-            return
-        
+        """Publie les données de télémétrie (mises en file si la liaison est coupée)"""
         telemetry = self.generate_telemetry()
-        message_json = json.dumps(telemetry)
-        
-        print(f"\n[{datetime.now()}] 📤 Publication des données:")
-        print(f"  Temperature: {telemetry['temperature']}°C")
-        print(f"  Humidity: {telemetry['humidity']}%")
-        print(f"  Status: {telemetry['status']}")
+        self.samples += 1
+        report = telemetry if self.deadband is None else self.deadband.filter(telemetry)
         
-        self.client.publish(TOPIC_TELEMETRY, message_json, qos=1)
+        if self.verbose:
+            if report is None:
+                print(f"\n[{datetime.now()}] 💤 Sous les bandes mortes, échantillon non envoyé")
+            elif not self.is_connected:
+                print(f"\n[{datetime.now()}] 📥 Non connecté, échantillon mis en file")
+            else:
+                print(f"\n[{datetime.now()}] 📤 Publication des données:")
+            print(f"  Temperature: {telemetry['temperature']}°C")
+            print(f"  Humidity: {telemetry['humidity']}%")
+            print(f"  Status: {telemetry['status']}")
+        if report is None:
+            return
+
+        # Numéroté à l'envoi (après la bande morte : un échantillon supprimé n'est
+        # pas un trou) ; les échantillons mis en file gardent leur numéro
+        report["seq"] = self.seq
+        report["boot"] = self.boot
+        self.seq += 1
+        with self.batch_lock:
+            self.batch.append(report)
+            full = len(self.batch) >= self.batch_size
+            if not full and self.batch_timer is None:
+                # Premier échantillon du lot : programmer l'envoi au plus tard
+                self.batch_timer = threading.Timer(self.batch_linger, self.flush)
+                self.batch_timer.daemon = True
+                self.batch_timer.start()
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Publie les échantillons en attente en un seul message"""
+        with self.batch_lock:
+            if self.batch_timer is not None:
+                self.batch_timer.cancel()
+                self.batch_timer = None
+            if not self.batch:
+                return
+            samples, self.batch = self.batch, []
+
+        # Hors connexion, ou arriéré pas encore vidé (l'ordre des échantillons est conservé)
+        if not self.is_connected or self.outbox.has_pending(self.topic_telemetry):
+            self.outbox.put(self.topic_telemetry, samples, live=self.is_connected)
+            if self.verbose:
+                print(self.outbox.summary())
+            return
+
+        message = telemetry_codec.encode_batch(telemetry_codec.stamp_sent(samples), self.payload_format)
+        if len(samples) > 1:
+            print(f"[{datetime.now()}] 📦 Lot de {len(samples)} échantillons publié")
+        self.client.publish(self.topic_telemetry, message, qos=1)
+        self.published += 1
+
+    def publish_batch(self, topic, samples):
+        """Publie un lot sorti de la file d'envoi ; False si la liaison est coupée"""
+        if not self.is_connected:
+            return False
+        message = telemetry_codec.encode_batch(telemetry_codec.stamp_sent(samples), self.payload_format)
+        self.client.publish(topic, message, qos=1)
+        self.published += 1
+        return True
+
+    @property
+    def verbose(self):
+        """Affichage par échantillon seulement aux cadences lentes"""
+        return self.scheduler.interval >= VERBOSE_MIN_INTERVAL
+
+    def tick(self):
+        """Un tick du cadenceur : un échantillon, et un résumé toutes les REPORT_INTERVAL s"""
+        self.publish_telemetry()
+        now = time.monotonic()
+        if now - self.last_report >= REPORT_INTERVAL:
+            print(f"[{datetime.now()}] {self.scheduler.summary()}")
+            if self.outbox.depth or self.outbox.dropped:
+                print(f"[{datetime.now()}] {self.outbox.summary()}")
+            if self.deadband is not None:
+                print(f"[{datetime.now()}] {self.deadband.summary()}")
+            self.last_report = now
         
-    def run(self):
+    def run(self, metrics_port=METRICS_PORT):
         """Boucle principale du capteur"""
         try:
+            metrics.serve(metrics_port)
             self.connect()
             
-            # Démarrer la boucle réseau
+            # Démarrer la boucle réseau et le vidage de la file d'envoi
             self.client.loop_start()
+            self.outbox.start(self.publish_batch, lambda: self.is_connected)
             
             # Attendre la connexion
             timeout = 5
@@ -169,42 +380,436 @@ class VirtualSensor:
                 timeout -= 1
             
             if not self.is_connected:
-                print("❌ Impossible de se connecter au broker")
-                return
+                # On continue : les échantillons attendent dans la file d'envoi
+                print("⚠️  Broker injoignable, nouvelles tentatives en arrière-plan")
+                print("\n💡 Broker local : installez et démarrez Mosquitto, puis")
+                print("   IOT_MQTT_BROKER=localhost IOT_MQTT_PORT=1883 IOT_MQTT_TLS=0 python virtual_sensor.py")
             
             print(f"\n{'='*60}")
             print(f"🌡️  Capteur virtuel démarré - Envoi toutes les {sampling_interval}s")
-            print(f"Topic telemetry: {TOPIC_TELEMETRY}")
-            print(f"Topic command: {TOPIC_COMMAND}")
+            print(f"Topic telemetry: {self.topic_telemetry}")
+            print(f"Topic command: {self.topic_command}")
             print("Appuyez sur Ctrl+C pour arrêter")
             print(f"{'='*60}\n")
             
-            while device_status != "offline":
-                self.publish_telemetry()
-                time.sleep(sampling_interval)
+            # Échéances fixes : le temps de publication ne décale pas la cadence
+            self.scheduler.run(self.tick, lambda: device_status != "offline")
                 
         except KeyboardInterrupt:
             print(f"\n[{datetime.now()}] Arrêt demandé par l'utilisateur")
         except Exception as e:
             print(f"\n❌ Erreur: {e}")
         finally:
+            print(f"[{datetime.now()}] {self.scheduler.summary()}")
             if self.client:
+                self.flush()
+                # Ce qui n'a pas pu être envoyé reste sur disque pour le prochain démarrage
+                self.outbox.close()
+                if self.is_connected:
+                    # Hors ligne : exclu des commandes de groupe jusqu'au prochain démarrage
+                    self.client.publish(topics.presence_topic(self.device_id),
+                                        commands.make_presence(self.device_id, self.groups, online=False),
+                                        qos=1, retain=True).wait_for_publish(1)
                 self.client.loop_stop()
                 self.client.disconnect()
                 print(f"[{datetime.now()}] Déconnecté")
 
 
+class VirtualFleet:
+    """Flotte de capteurs virtuels simulés dans un seul processus
+
+    L'état de chaque capteur est stocké dans des tableaux numpy (un élément
+    par appareil) et les marches aléatoires sont mises à jour pour toute la
+    flotte en une seule opération vectorisée par tick. Les appareils se
+    partagent un petit pool de connexions MQTT.
+
+    Chaque appareil est membre des groupes "fleet" et zone-<k> (k = indice
+    modulo zones) : une commande de groupe est appliquée aux membres en une
+    opération vectorisée, puis acquittée appareil par appareil.
+
+    Avec des bandes mortes, le filtrage de tous les appareils dus est fait
+    en une opération par champ (deadband.FleetDeadband).
+    """
+
+    def __init__(self, size=FLEET_SIZE, connections=FLEET_CONNECTIONS, seed=None,
+                 payload_format=PAYLOAD_FORMAT, outbox_path=None, drain_rate=outbox.DRAIN_RATE,
+                 zones=FLEET_ZONES, deadbands=None, heartbeat=deadband.HEARTBEAT):
+        self.size = size
+        self.payload_format = payload_format
+        self.rng = np.random.default_rng(seed)
+
+        # Identité de chaque appareil
+        self.device_ids = [f"{FLEET_ID_PREFIX}{i:05d}" for i in range(size)]
+        self.topics = [topics.data_topic(d) for d in self.device_ids]
+        self.index = {device_id: i for i, device_id in enumerate(self.device_ids)}
+        self.zones = max(1, zones)
+        self.zone = np.arange(size) % self.zones
+        # Commandes récentes : identifiant -> appareils qui l'ont déjà appliquée
+        self.recent = commands.RecentCommands()
+
+        # État compact de la flotte
+        self.temperature = np.full(size, 22.0, dtype=np.float32)
+        self.humidity = np.full(size, 50.0, dtype=np.float32)
+        self.status = np.zeros(size, dtype=np.uint8)  # index dans FLEET_STATUSES
+        self.battery = self.rng.uniform(85.0, 100.0, size)
+        self.signal = self.rng.integers(-70, -29, size).astype(np.int8)
+        self.intervals = np.full(size, fleet_interval(sampling_interval), dtype=np.float32)
+        self.seq = np.zeros(size, dtype=np.uint32)  # prochain numéro de séquence
+        self.boot = int(time.time())  # identifiant de démarrage commun à la flotte
+        self.deadband = (deadband.FleetDeadband(size, deadbands, heartbeat)
+                         if deadbands is not None else None)
+        self.reboot_until = np.zeros(size, dtype=np.float64)
+        # Démarrages étalés pour éviter que toute la flotte publie au même instant
+        self.next_due = time.monotonic() + self.rng.uniform(0, sampling_interval, size)
+
+        self.clients = []
+        self.connected = [False] * connections
+        self.ever_connected = [False] * connections
+        self.reconnects = 0
+        self.samples = 0
+        self.published = 0
+        # File d'envoi commune : appareils dont la connexion est coupée
+        self.outbox = outbox.Outbox(outbox_path or outbox.default_path("virtual_fleet"),
+                                    memory_samples=FLEET_OUTBOX_MEMORY, drain_rate=drain_rate)
+        register_metrics(self)
+
+    def on_connect(self, client, userdata, flags, rc):
+        """Callback de connexion (userdata = index de la connexion)"""
+        if rc == 0:
+            self.connected[userdata] = True
+            if self.ever_connected[userdata]:
+                self.reconnects += 1
+            self.ever_connected[userdata] = True
+            self.outbox.wake()
+            print(f"[{datetime.now()}] ✓ Connexion flotte #{userdata} établie")
+            # Une seule connexion reçoit les commandes de toute la flotte
+            if userdata == 0:
+                client.subscribe(topics.COMMAND_WILDCARD)
+                client.subscribe(topics.GROUP_COMMAND_WILDCARD)
+            # Présence des appareils de cette connexion (groupes pour le ciblage)
+            for i in range(userdata, self.size, len(self.connected)):
+                client.publish(topics.presence_topic(self.device_ids[i]),
+                               commands.make_presence(self.device_ids[i], self.device_groups(i)),
+                               qos=1, retain=True)
+        else:
+            print(f"[{datetime.now()}] ❌ Échec connexion flotte #{userdata}: Code {rc}")
+
+    def on_disconnect(self, client, userdata, rc):
+        """Callback de déconnexion"""
+        self.connected[userdata] = False
+        print(f"[{datetime.now()}] ⚠️  Connexion flotte #{userdata} perdue")
+
+    def device_groups(self, i):
+        """Groupes d'un appareil de la flotte"""
+        return commands.device_groups((FLEET_GROUP, f"zone-{self.zone[i]}"))
+
+    def group_members(self, group):
+        """Indices des appareils membres d'un groupe"""
+        if group in (topics.ALL_GROUP, FLEET_GROUP):
+            return np.arange(self.size)
+        if group.startswith("zone-") and group[5:].isdigit():
+            return np.flatnonzero(self.zone == int(group[5:]))
+        return np.array([], dtype=np.int64)
+
+    def apply_command(self, indices, payload):
+        """Applique une commande aux appareils `indices` (vectorisé) ; retourne (statut d'ack, résultat)"""
+        action = payload.get("action")
+        result = None
+        # Commandes instantanées : exécutées directement, sans bloquer
+        if action == "set_interval":
+            # Intervalle effectif renvoyé dans l'ack (borné à FLEET_TICK en flotte)
+            interval = fleet_interval(payload.get("value", 5))
+            result = {"interval": interval}
+            self.intervals[indices] = interval
+            self.next_due[indices] = np.minimum(self.next_due[indices],
+                                                time.monotonic() + self.intervals[indices])
+        elif action == "reboot":
+            # Pas de sleep : les appareils restent "rebooting" pendant 2 s
+            self.status[indices] = FLEET_STATUSES.index("rebooting")
+            self.reboot_until[indices] = time.monotonic() + 2
+        elif action == "shutdown":
+            self.status[indices] = FLEET_STATUSES.index("offline")
+            # Hors ligne : exclus des prochaines commandes de groupe
+            for i in indices.tolist():
+                self.clients[i % len(self.clients)].publish(
+                    topics.presence_topic(self.device_ids[i]),
+                    commands.make_presence(self.device_ids[i], self.device_groups(i), online=False),
+                    qos=1, retain=True)
+        else:
+            return commands.ACK_UNKNOWN, None
+        return commands.ACK_OK, result
+
+    def command_callback(self, client, userdata, message):
+        """Route une commande vers l'appareil ciblé par le topic, ou vers les membres d'un groupe"""
+        group = topics.group(message.topic)
+        if group is not None:
+            indices = self.group_members(group)
+            target = f"groupe {group}"
+        else:
+            i = self.index.get(topics.device_id(message.topic))
+            if i is None:
+                return
+            indices = np.array([i])
+            target = self.device_ids[i]
+        if len(indices) == 0:
+            return
+        received_at = time.monotonic()
+        payload = {}
+        result = error = None
+        try:
+            payload = json.loads(message.payload.decode('utf-8'))
+            # Une commande relancée n'est appliquée qu'aux appareils qui ne l'ont pas encore reçue
+            applied = self.recent.get(payload.get("id"))
+            if applied is None:
+                applied = np.zeros(self.size, dtype=bool)
+                self.recent.add(payload.get("id"), applied)
+            fresh = indices[~applied[indices]]
+            status, result = self.apply_command(fresh, payload)
+            applied[fresh] = True
+            print(f"[{datetime.now()}] 📥 {target}: commande {payload.get('action')} appliquée "
+                  f"({len(fresh)} appareils)")
+        except Exception as e:
+            print(f"❌ Erreur traitement commande ({target}): {e}")
+            status, error = commands.ACK_ERROR, str(e)
+        # Un ack par appareil : le suivi du déploiement compte chaque appareil
+        for i in indices.tolist():
+            device_id = self.device_ids[i]
+            ack = commands.make_ack(payload, device_id, status, received_at, result, error)
+            client.publish(topics.ack_topic(device_id), json.dumps(ack), qos=1)
+
+    def connect(self):
+        """Ouvre le pool de connexions MQTT partagé par la flotte"""
+        for k in range(len(self.connected)):
+            client = transport.create_client(f"virtual_fleet_{k}", userdata=k)
+            client.max_inflight_messages_set(1000)
+
+            client.on_connect = self.on_connect
+            client.on_disconnect = self.on_disconnect
+            client.on_message = self.command_callback
+            client.reconnect_delay_set(*RECONNECT_DELAY)
+
+            transport.connect_async(client)
+            client.loop_start()
+            self.clients.append(client)
+
+    def generate_telemetry(self, now):
+        """Fait avancer d'un pas les appareils dus et retourne leurs indices"""
+        # Fin des redémarrages simulés
+        rebooting = self.status == FLEET_STATUSES.index("rebooting")
+        self.status[rebooting & (self.reboot_until <= now)] = FLEET_STATUSES.index("online")
+
+        due = np.flatnonzero(
+            (self.next_due <= now) & (self.status != FLEET_STATUSES.index("offline"))
+        )
+        if len(due) == 0:
+            return due
+
+        # Marches aléatoires vectorisées (mêmes bornes que VirtualSensor)
+        n = len(due)
+        self.temperature[due] = np.clip(
+            self.temperature[due] + self.rng.uniform(-0.5, 0.5, n), 15.0, 35.0
+        )
+        self.humidity[due] = np.clip(
+            self.humidity[due] + self.rng.uniform(-2.0, 2.0, n), 30.0, 80.0
+        )
+        self.battery[due] = np.maximum(0.0, self.battery[due] - BATTERY_DRAIN * self.intervals[due] / 3600)
+        self.signal[due] = np.clip(self.signal[due] + self.rng.integers(-1, 2, n), -70, -30)
+        self.next_due[due] += self.intervals[due]
+        # Rattraper sans rafale si la boucle a pris du retard
+        late = self.next_due[due] < now
+        self.next_due[due[late]] = now + self.intervals[due[late]]
+        return due
+
+    def publish_telemetry(self, now):
+        """Publie un message par appareil dû, réparti sur le pool de connexions"""
+        due = self.generate_telemetry(now)
+        if len(due) == 0:
+            return 0
+        self.samples += len(due)
+
+        if self.payload_format == telemetry_codec.FORMAT_BINARY:
+            timestamp = time.time()
+        else:
+            timestamp = datetime.now().isoformat()
+        values = {
+            "temperature": np.round(self.temperature[due].astype(np.float64), 2),
+            "humidity": np.round(self.humidity[due].astype(np.float64), 2),
+            "status": self.status[due],
+            "battery": np.round(self.battery[due]).astype(np.int64),
+            "signal_strength": self.signal[due],
+        }
+        include = None
+        if self.deadband is not None:
+            # Seuls les appareils dont une mesure a franchi sa bande morte publient
+            send, include = self.deadband.select(due, values, now)
+            due = due[send]
+            values = {name: column[send] for name, column in values.items()}
+            include = {name: mask[send].tolist() for name, mask in include.items()}
+        temperatures = values["temperature"].tolist()
+        humidities = values["humidity"].tolist()
+        statuses = [FLEET_STATUSES[s] for s in values["status"].tolist()]
+        batteries = values["battery"].tolist()
+        signals = values["signal_strength"].tolist()
+        columns = (("temperature", temperatures), ("humidity", humidities), ("status", statuses),
+                   ("battery", batteries), ("signal_strength", signals))
+        # Numérotés à l'envoi : un échantillon supprimé n'est pas un trou
+        seqs = self.seq[due].tolist()
+        self.seq[due] += 1
+        sent_at = time.time()
+
+        n_clients = len(self.clients)
+        for k, i in enumerate(due.tolist()):
+            if include is None:
+                telemetry = {
+                    "device_id": self.device_ids[i],
+                    "timestamp": timestamp,
+                    "temperature": temperatures[k],
+                    "humidity": humidities[k],
+                    "status": statuses[k],
+                    "battery": batteries[k],
+                    "signal_strength": signals[k],
+                    "seq": seqs[k],
+                    "boot": self.boot,
+                    "sent_at": sent_at
+                }
+            else:
+                telemetry = {"device_id": self.device_ids[i], "timestamp": timestamp}
+                for name, column in columns:
+                    if include[name][k]:
+                        telemetry[name] = column[k]
+                if len(telemetry) < 2 + len(columns):
+                    telemetry[deadband.DELTA] = True
+                telemetry["seq"] = seqs[k]
+                telemetry["boot"] = self.boot
+                telemetry["sent_at"] = sent_at
+            topic = self.topics[i]
+            connected = self.connected[i % n_clients]
+            if not connected or self.outbox.has_pending(topic):
+                self.outbox.put(topic, [telemetry], live=connected)
+                continue
+            message = telemetry_codec.encode(telemetry, self.payload_format)
+            self.clients[i % n_clients].publish(topic, message, qos=1)
+            self.published += 1
+        return len(due)
+
+    def publish_batch(self, topic, samples):
+        """Publie un lot sorti de la file d'envoi ; False si la connexion de l'appareil est coupée"""
+        k = self.index[topics.device_id(topic)] % len(self.clients)
+        if not self.connected[k]:
+            return False
+        message = telemetry_codec.encode_batch(telemetry_codec.stamp_sent(samples), self.payload_format)
+        self.clients[k].publish(topic, message, qos=1)
+        self.published += 1
+        return True
+
+    def run(self, metrics_port=METRICS_PORT):
+        """Boucle principale de la flotte"""
+        try:
+            metrics.serve(metrics_port)
+            self.connect()
+            self.outbox.start(self.publish_batch, lambda: any(self.connected))
+
+            timeout = 5
+            while not all(self.connected) and timeout > 0:
+                time.sleep(1)
+                timeout -= 1
+
+            if not any(self.connected):
+                # On continue : les échantillons attendent dans la file d'envoi
+                print("⚠️  Broker injoignable, nouvelles tentatives en arrière-plan")
+
+            print(f"\n{'='*60}")
+            print(f"🌡️  Flotte de {self.size} capteurs démarrée sur {len(self.clients)} connexions")
+            print(f"Topic telemetry: {topics.DATA_WILDCARD}")
+            print(f"Topic command: {topics.COMMAND_WILDCARD}")
+            print("Appuyez sur Ctrl+C pour arrêter")
+            print(f"{'='*60}\n")
+
+            next_tick = time.monotonic()
+            last_report = next_tick
+            last_published = 0
+            while (self.status != FLEET_STATUSES.index("offline")).any():
+                now = time.monotonic()
+                self.publish_telemetry(now)
+
+                # Résumé périodique plutôt qu'un print par message
+                if now - last_report >= 5:
+                    rate = (self.published - last_published) / (now - last_report)
+                    print(f"[{datetime.now()}] 📤 {self.published} messages publiés ({rate:.0f} msg/s)")
+                    if self.outbox.depth or self.outbox.drained or self.outbox.dropped:
+                        print(f"[{datetime.now()}] {self.outbox.summary()}")
+                    if self.deadband is not None:
+                        print(f"[{datetime.now()}] {self.deadband.summary()}")
+                    last_report, last_published = now, self.published
+
+                next_tick += FLEET_TICK
+                time.sleep(max(0.0, next_tick - time.monotonic()))
+
+        except KeyboardInterrupt:
+            print(f"\n[{datetime.now()}] Arrêt demandé par l'utilisateur")
+        except Exception as e:
+            print(f"\n❌ Erreur: {e}")
+        finally:
+            self.outbox.close()
+            for client in self.clients:
+                client.loop_stop()
+                client.disconnect()
+            print(f"[{datetime.now()}] Flotte déconnectée")
+
+
 if __name__ == "__main__":
-    print("="*60)
-    print("🚀 CAPTEUR IoT VIRTUEL - Mode Local (Sans AWS)")
-    print("="*60)
-    print("\n📌 Configuration:")
-    print(f"   Broker: {MQTT_BROKER}:{MQTT_PORT}")
-    print(f"   Client ID: {CLIENT_ID}")
-    print(f"   Topics: {TOPIC_TELEMETRY}, {TOPIC_COMMAND}")
-    print("\n💡 Pour recevoir les messages, ouvrez un autre terminal:")
-    print("   python mqtt_subscriber.py")
-    print("\n" + "="*60 + "\n")
+    parser = argparse.ArgumentParser(description="Capteur IoT virtuel")
+    parser.add_argument("--device-id", default=CLIENT_ID,
+                        help="Identifiant du capteur (topics sensors/<device-id>/...)")
+    parser.add_argument("--fleet", type=int, default=0,
+                        help="Nombre de capteurs simulés (mode flotte)")
+    parser.add_argument("--groups", default="",
+                        help="Groupes du capteur, séparés par des virgules (commandes de groupe)")
+    parser.add_argument("--connections", type=int, default=FLEET_CONNECTIONS,
+                        help="Nombre de connexions MQTT partagées en mode flotte")
+    parser.add_argument("--zones", type=int, default=FLEET_ZONES,
+                        help="Nombre de groupes zone-<k> de la flotte")
+    parser.add_argument("--format", choices=telemetry_codec.FORMATS, default=PAYLOAD_FORMAT,
+                        help="Format des messages de télémétrie")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                        help="Nombre d'échantillons par message")
+    parser.add_argument("--batch-linger", type=float, default=BATCH_LINGER,
+                        help="Délai max (s) avant l'envoi d'un lot incomplet")
+    parser.add_argument("--outbox", metavar="FICHIER", default=None,
+                        help=f"Fichier de débordement de la file d'envoi (défaut: {outbox.OUTBOX_DIR}/<id>.outbox)")
+    parser.add_argument("--drain-rate", type=float, default=outbox.DRAIN_RATE,
+                        help="Débit max (échantillons/s) du renvoi de l'arriéré après une coupure (0 = sans limite)")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT,
+                        help="Port HTTP des métriques Prometheus (0 = désactivé)")
+    parser.add_argument("--deadband", nargs="?", const="", default=None, metavar="CHAMP=BANDE,...",
+                        help="Envoi sur changement : bandes mortes par champ, ex. temperature=0.2 "
+                             f"(seul : valeurs par défaut {deadband.DEADBANDS})")
+    parser.add_argument("--heartbeat", type=float, default=deadband.HEARTBEAT,
+                        help="Avec --deadband : secondes max entre deux échantillons complets")
+    args = parser.parse_args()
+    deadbands = deadband.parse_deadbands(args.deadband) if args.deadband is not None else None
+
+    if args.fleet > 0:
+        fleet = VirtualFleet(args.fleet, args.connections, payload_format=args.format,
+                             outbox_path=args.outbox, drain_rate=args.drain_rate, zones=args.zones,
+                             deadbands=deadbands, heartbeat=args.heartbeat)
+        fleet.run(args.metrics_port)
+    else:
+        print("="*60)
+        print("🚀 CAPTEUR IoT VIRTUEL - Mode Local (Sans AWS)")
+        print("="*60)
+        print("\n📌 Configuration:")
+        print(f"   Broker: {transport.describe()}")
+        print(f"   Client ID: {args.device_id}")
+        print(f"   Topics: {topics.data_topic(args.device_id)}, {topics.command_topic(args.device_id)}")
+        print(f"   Format: {args.format}")
+        print("\n💡 Pour recevoir les messages, ouvrez un autre terminal:")
+        print("   python mqtt_subscriber.py")
+        print("\n" + "="*60 + "\n")
     
-    sensor = VirtualSensor()
-    sensor.run()
\ No newline at end of file
+        sensor = VirtualSensor(payload_format=args.format, batch_size=args.batch_size,
+                               batch_linger=args.batch_linger, device_id=args.device_id,
+                               outbox_path=args.outbox, drain_rate=args.drain_rate,
+                               groups=[g.strip() for g in args.groups.split(",") if g.strip()],
+                               deadbands=deadbands, heartbeat=args.heartbeat)
+        sensor.run(args.metrics_port)
\ No newline at end of file